@@ -0,0 +1,879 @@
+"""
+Benchmarks de rendimiento del pipeline
+Mide los componentes con datos sintéticos, sin conexión a SQL Server
+"""
+
+import sys
+from pathlib import Path
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent))
+
+from pipeline.scripts.wide_pivot import LongToWidePivot, long_to_wide
+
+
+def make_long_data(n_rows: int, n_variables: int = 200, seed: int = 0) -> pd.DataFrame:
+    """
+    Genera datos sintéticos con el formato de dbo.ypf_process_data
+
+    Parámetros:
+    -----------
+    n_rows : int
+        Filas en formato largo (aproximadamente)
+    n_variables : int
+        Cantidad de variables distintas
+    seed : int
+        Semilla aleatoria
+
+    Retorna:
+    --------
+    pd.DataFrame con columnas datetime, variable_name, value (ordenado como la query)
+    """
+    rng = np.random.default_rng(seed)
+    n_timestamps = max(1, n_rows // n_variables)
+    names = np.array([f"TAG-{i:04d}" for i in range(n_variables)], dtype=object)
+
+    datetimes = pd.date_range('2024-01-01', periods=n_timestamps, freq='min')
+    df = pd.DataFrame({
+        'datetime': np.repeat(datetimes.values, n_variables),
+        'variable_name': np.tile(names, n_timestamps),
+        'value': rng.normal(100, 10, n_timestamps * n_variables)
+    })
+    # Algunos faltantes, como en los datos reales
+    df = df[rng.random(len(df)) > 0.02].reset_index(drop=True)
+    return df
+
+
+def timed(func, *args, **kwargs):
+    """Ejecuta func y retorna (resultado, segundos)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_pivot(args):
+    """Pivot de formato largo a ancho: pivot_table vs LongToWidePivot"""
+    print(f"\nGenerando {args.rows:,} filas en formato largo ({args.variables} variables)...")
+    df_long = make_long_data(args.rows, args.variables)
+    print(f"  Filas: {len(df_long):,} ({df_long.memory_usage(deep=True).sum() / 1e6:.0f} MB)")
+
+    reference, t_pivot_table = timed(
+        df_long.pivot_table, index='datetime', columns='variable_name', values='value', aggfunc='first'
+    )
+    print(f"  pivot_table(aggfunc='first'): {t_pivot_table:.2f}s")
+
+    wide, t_one_shot = timed(long_to_wide, df_long)
+    print(f"  long_to_wide (float64):       {t_one_shot:.2f}s  ({t_pivot_table / t_one_shot:.1f}x)")
+
+    def chunked(dtype):
+        pivot = LongToWidePivot(dtype=dtype)
+        for start in range(0, len(df_long), args.chunk_size):
+            pivot.add(df_long.iloc[start:start + args.chunk_size])
+        return pivot.result()
+
+    wide_chunked, t_chunked = timed(chunked, np.float64)
+    print(f"  LongToWidePivot por bloques:  {t_chunked:.2f}s  ({t_pivot_table / t_chunked:.1f}x, "
+          f"bloques de {args.chunk_size:,})")
+
+    wide32, t_chunked32 = timed(chunked, np.float32)
+    print(f"  LongToWidePivot float32:      {t_chunked32:.2f}s  "
+          f"({wide32.memory_usage().sum() / 1e6:.0f} MB vs {wide.memory_usage().sum() / 1e6:.0f} MB)")
+
+    ok = wide.equals(reference) and wide_chunked.equals(reference)
+    print(f"  Resultado idéntico a pivot_table: {'sí' if ok else 'NO'}")
+    return ok
+
+
+def bench_source_file(args):
+    """Asignación de source_file a los resultados: apply por fila vs join"""
+    from worker_procesamiento import attach_source_file
+
+    n_results = min(args.rows, 1_000_000)
+    print(f"\nGenerando {n_results:,} filas de resultados con su source_file...")
+    df_long = make_long_data(n_results, args.variables)
+    df_long['source_file'] = 'carga_' + (df_long.index // 50_000).astype(str) + '.csv'
+    results = df_long.rename(columns={'datetime': 'ds', 'variable_name': 'variable', 'value': 'y'})
+    results = results[['ds', 'y', 'variable']].sample(frac=1, random_state=0).reset_index(drop=True)
+
+    def legacy(results):
+        # Implementación anterior de process_new_anomalies
+        source_file_map = df_long.groupby(['datetime', 'variable_name'])['source_file'].first().to_dict()
+        results['source_file'] = results.apply(
+            lambda row: source_file_map.get((row['ds'], row['variable']), 'unknown'),
+            axis=1
+        )
+        return results
+
+    reference, t_legacy = timed(legacy, results.copy())
+    print(f"  groupby + apply(axis=1): {t_legacy:.2f}s")
+
+    joined, t_join = timed(attach_source_file, results.copy(), df_long)
+    print(f"  attach_source_file:      {t_join:.2f}s  ({t_legacy / t_join:.1f}x)")
+
+    ok = joined['source_file'].equals(reference['source_file'])
+    print(f"  Resultado idéntico: {'sí' if ok else 'NO'}")
+    return ok
+
+
+class _LatencyCursor:
+    """Cursor que agrega una demora fija por viaje al servidor (execute/executemany)"""
+
+    def __init__(self, cursor, latency: float):
+        self._cursor = cursor
+        self._latency = latency
+
+    def execute(self, *args):
+        time.sleep(self._latency)
+        return self._cursor.execute(*args)
+
+    def executemany(self, *args):
+        time.sleep(self._latency)
+        return self._cursor.executemany(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _LatencyConnection:
+    """Conexión SQLite cuyos cursores simulan la latencia de red de SQL Server"""
+
+    def __init__(self, conn: sqlite3.Connection, latency: float):
+        self._conn = conn
+        self._latency = latency
+
+    def cursor(self):
+        return _LatencyCursor(self._conn.cursor(), self._latency)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def make_sqlite_connection(latency_ms: float = 0):
+    """
+    Crea una SQLConnection sobre SQLite en memoria, para medir la escritura sin SQL Server
+
+    Se usa la misma clase que en producción: solo cambian la conexión y la creación
+    de la tabla temporal de staging (SQLite no soporta SELECT TOP 0 ... INTO #tabla).
+
+    Parámetros:
+    -----------
+    latency_ms : float
+        Demora simulada por viaje al servidor en milisegundos
+    """
+    from sql_utils import SQLConnection
+
+    class SQLiteConnection(SQLConnection):
+        def __init__(self):
+            self.server = 'sqlite'
+            self._conn = None
+
+        def connect(self):
+            conn = sqlite3.connect(':memory:', check_same_thread=False)
+            conn.execute("ATTACH DATABASE ':memory:' AS dbo")
+            self._conn = _LatencyConnection(conn, latency_ms / 1000)
+            return True
+
+        def _create_staging_table(self, cursor, schema, table_name, columns_str):
+            staging = f"[{table_name}_staging]"
+            self._drop_staging_table(cursor, staging)
+            cursor.execute(f"CREATE TEMP TABLE {staging} AS "
+                           f"SELECT {columns_str} FROM [{schema}].[{table_name}] WHERE 0")
+            return staging
+
+        def _drop_staging_table(self, cursor, staging):
+            cursor.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+
+    sqlite3.register_adapter(pd.Timestamp, lambda ts: ts.isoformat(' '))
+    sqlite3.register_adapter(datetime, lambda ts: ts.isoformat(' '))
+    sqlite3.register_adapter(np.int64, int)
+
+    sql_conn = SQLiteConnection()
+    sql_conn.connect()
+    sql_conn.execute_non_query("""
+        CREATE TABLE dbo.ypf_anomaly_detector (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ds TIMESTAMP NOT NULL, y REAL, yhat REAL, yhat_lower REAL, yhat_upper REAL,
+            residual REAL, outside_interval INTEGER, high_residual INTEGER, is_anomaly INTEGER,
+            anomaly_score REAL, variable VARCHAR(100) NOT NULL, prediction_error_pct REAL,
+            source_file VARCHAR(255)
+        )
+    """)
+    sql_conn.execute_non_query("CREATE INDEX dbo.idx_ds ON ypf_anomaly_detector(ds)")
+    sql_conn.execute_non_query("CREATE INDEX dbo.idx_variable ON ypf_anomaly_detector(variable)")
+    return sql_conn
+
+
+def make_results(n_rows: int, n_variables: int = 200, seed: int = 0) -> pd.DataFrame:
+    """Genera resultados sintéticos con las columnas que se escriben en ypf_anomaly_detector"""
+    rng = np.random.default_rng(seed)
+    df = make_long_data(n_rows, n_variables, seed)
+    y = df['value'].to_numpy()
+    yhat = y + rng.normal(0, 2, len(df))
+    results = pd.DataFrame({
+        'ds': df['datetime'],
+        'y': y,
+        'yhat': yhat,
+        'yhat_lower': yhat - 5,
+        'yhat_upper': yhat + 5,
+        'residual': y - yhat,
+    })
+    results['outside_interval'] = ((results['y'] < results['yhat_lower']) |
+                                   (results['y'] > results['yhat_upper'])).astype(int)
+    results['high_residual'] = (results['residual'].abs() > 4).astype(int)
+    results['is_anomaly'] = results['outside_interval'] | results['high_residual']
+    results['anomaly_score'] = (results['residual'].abs() * 10).clip(upper=100).round(2)
+    results['variable'] = df['variable_name']
+    results['prediction_error_pct'] = (results['residual'] / results['yhat']).abs().mul(100).clip(upper=999.99)
+    results['source_file'] = 'carga.csv'
+    return results
+
+
+def bench_sql_write(args):
+    """Escritura de resultados: write_dataframe vs write_dataframe_bulk (SQLite en memoria)"""
+    n_results = min(args.rows, args.write_rows)
+    print(f"\nGenerando {n_results:,} filas de resultados "
+          f"(latencia simulada por viaje: {args.latency_ms} ms)...")
+    results = make_results(n_results, args.variables)
+
+    def write(method):
+        sql_conn = make_sqlite_connection(args.latency_ms)
+        ok, seconds = timed(method, sql_conn, results)
+        count = sql_conn._conn.execute("SELECT COUNT(*) FROM dbo.ypf_anomaly_detector").fetchone()[0]
+        sql_conn.disconnect()
+        return ok and count == len(results), seconds
+
+    ok_legacy, t_legacy = write(lambda conn, df: conn.write_dataframe(df, 'ypf_anomaly_detector'))
+    print(f"  write_dataframe (executemany de 1000 filas): {t_legacy:.2f}s")
+
+    ok_bulk, t_bulk = write(lambda conn, df: conn.write_dataframe_bulk(df, 'ypf_anomaly_detector'))
+    print(f"  write_dataframe_bulk (staging):              {t_bulk:.2f}s  ({t_legacy / t_bulk:.1f}x)")
+
+    ok = ok_legacy and ok_bulk
+    print(f"  Filas escritas completas: {'sí' if ok else 'NO'}")
+    return ok
+
+
+def make_streaming_detector(n_variables: int, days: int = 7):
+    """Entrena un detector chico (predicción rápida) sobre datos horarios sintéticos"""
+    from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+
+    rng = np.random.default_rng(0)
+    datetimes = pd.date_range(end=pd.Timestamp.now().floor('h'), periods=days * 24, freq='h')
+    hours = datetimes.hour.to_numpy()
+    df = pd.DataFrame({'DATETIME': datetimes})
+    variables = [f"TAG-{i:04d}" for i in range(n_variables)]
+    for var in variables:
+        df[var] = 100 + 10 * np.sin(2 * np.pi * hours / 24) + rng.normal(0, 1, len(df))
+
+    detector = ProphetAnomalyDetector(use_fast_predict=True)
+    detector.train_multiple_variables(df, variables, verbose=False)
+    detector.build_fast_predictors(verbose=False)
+    return detector, variables
+
+
+def bench_streaming(args):
+    """Latencia ingreso-escritura: lote por ciclo vs micro-lotes (MicroBatchScorer)"""
+    from pipeline.scripts.streaming_scorer import MicroBatchScorer
+    from worker_procesamiento import prepare_results_for_sql
+
+    print(f"\nEntrenando {args.stream_variables} modelos de prueba...")
+    detector, variables = make_streaming_detector(args.stream_variables)
+
+    def run(max_batch_points, max_batch_seconds):
+        sql_conn = make_sqlite_connection(args.latency_ms)
+
+        def emit(results, batch):
+            if len(results) == 0:
+                return True
+            return sql_conn.write_dataframe_bulk(prepare_results_for_sql(results, batch), 'ypf_anomaly_detector')
+
+        scorer = MicroBatchScorer(detector, emit, max_batch_points=max_batch_points,
+                                  max_batch_seconds=max_batch_seconds)
+        scorer.start()
+        # Un punto por variable cada `stream_interval` segundos, como llegan de planta
+        ds = pd.Timestamp.now().floor('min')
+        n_sent = 0
+        end = time.time() + args.stream_seconds
+        while time.time() < end:
+            points = pd.DataFrame({
+                'datetime': ds,
+                'variable_name': variables,
+                'value': 100 + np.random.default_rng(n_sent).normal(0, 1, len(variables)),
+                'source_file': 'stream.csv'
+            })
+            scorer.submit(points)
+            n_sent += len(points)
+            ds += pd.Timedelta(minutes=1)
+            time.sleep(args.stream_interval)
+        scorer.close()
+        count = sql_conn._conn.execute("SELECT COUNT(*) FROM dbo.ypf_anomaly_detector").fetchone()[0]
+        sql_conn.disconnect()
+        return scorer, count == n_sent
+
+    def report(label, scorer):
+        lat = scorer.latency_percentiles()
+        if not lat:
+            print(f"  {label}: sin puntos entregados")
+            return
+        print(f"  {label}: p50 {lat['p50'] * 1000:7.0f} ms, p95 {lat['p95'] * 1000:7.0f} ms, "
+              f"p99 {lat['p99'] * 1000:7.0f} ms, máx {lat['max'] * 1000:7.0f} ms "
+              f"({scorer.batches_emitted} lotes, {lat['count']:,} puntos)")
+
+    cycle, ok_cycle = run(10**9, args.stream_cycle_seconds)
+    report(f"Lote por ciclo ({args.stream_cycle_seconds:g}s)        ", cycle)
+    micro, ok_micro = run(args.stream_batch, args.stream_max_seconds)
+    report(f"Micro-lotes ({args.stream_batch} pts / {args.stream_max_seconds:g}s)", micro)
+
+    ok = ok_cycle and ok_micro
+    print(f"  Resultados escritos completos: {'sí' if ok else 'NO'}")
+    return ok
+
+
+def legacy_scores(y, yhat, yhat_lower, yhat_upper, anomaly_threshold: float = 2.0) -> pd.DataFrame:
+    """Cálculo original de detect_anomalies, columna por columna sobre el DataFrame (referencia)"""
+    results = pd.DataFrame({'y': y, 'yhat': yhat, 'yhat_lower': yhat_lower, 'yhat_upper': yhat_upper})
+    results['residual'] = results['y'] - results['yhat']
+    residual_std = results['residual'].std()
+    results['outside_interval'] = (results['y'] < results['yhat_lower']) | (results['y'] > results['yhat_upper'])
+    results['high_residual'] = np.abs(results['residual']) > (anomaly_threshold * residual_std)
+    results['is_anomaly'] = results['outside_interval'] | results['high_residual']
+    results['anomaly_score'] = 0.0
+    mask_above = results['y'] > results['yhat_upper']
+    mask_below = results['y'] < results['yhat_lower']
+    if mask_above.any():
+        results.loc[mask_above, 'anomaly_score'] = (
+            (results.loc[mask_above, 'y'] - results.loc[mask_above, 'yhat_upper']) /
+            (results.loc[mask_above, 'yhat_upper'] - results.loc[mask_above, 'yhat']) * 50
+        ).clip(upper=100)
+    if mask_below.any():
+        results.loc[mask_below, 'anomaly_score'] = (
+            (results.loc[mask_below, 'yhat_lower'] - results.loc[mask_below, 'y']) /
+            (results.loc[mask_below, 'yhat'] - results.loc[mask_below, 'yhat_lower']) * 50
+        ).clip(upper=100)
+    results['anomaly_score'] = np.maximum(
+        results['anomaly_score'],
+        (np.abs(results['residual']) / residual_std * 20).clip(upper=100)
+    )
+    results['prediction_error_pct'] = np.abs(results['residual'] / results['yhat'] * 100).replace([np.inf, -np.inf], np.nan)
+    return results
+
+
+def make_scoring_inputs(n: int, seed: int = 0):
+    """Predicción sintética con ~2% de valores fuera del intervalo"""
+    rng = np.random.default_rng(seed)
+    yhat = 100 + 10 * np.sin(np.arange(n) / 50)
+    width = rng.uniform(1, 5, n)
+    y = yhat + rng.normal(0, 1.5, n)
+    spikes = rng.random(n) < 0.02
+    y[spikes] += rng.choice([-1, 1], spikes.sum()) * rng.uniform(5, 30, spikes.sum())
+    return y, yhat, yhat - width, yhat + width
+
+
+def bench_scoring(args):
+    """Scores de anomalía: cálculo por columnas de pandas vs score_anomalies (NumPy / numba)"""
+    import warnings
+    from pipeline.scripts.anomaly_scoring import NUMBA_AVAILABLE, score_anomalies
+
+    columns = ['residual', 'outside_interval', 'high_residual', 'is_anomaly', 'anomaly_score', 'prediction_error_pct']
+    modes = [False] + ([True] if NUMBA_AVAILABLE else [])
+
+    def same(reference, scores) -> bool:
+        for col in columns:
+            expected = reference[col].to_numpy()
+            if expected.dtype == bool:
+                if not np.array_equal(expected, scores[col]):
+                    return False
+            elif not np.allclose(expected, scores[col], rtol=1e-12, atol=0, equal_nan=True):
+                return False
+        return True
+
+    # Casos borde: sobre el límite, yhat = 0, un solo punto, residuales constantes, NaN
+    y, yhat, lower, upper = make_scoring_inputs(1000, seed=1)
+    y[:3] = upper[:3]
+    y[3:6] = lower[3:6]
+    yhat[6:9] = 0
+    y[9] = np.nan
+    edge_cases = {
+        'aleatorio': make_scoring_inputs(10_000, seed=2),
+        'bordes': (y, yhat, lower, upper),
+        'un punto': tuple(a[:1] for a in make_scoring_inputs(10, seed=3)),
+        'desvío 0': (np.full(50, 101.0), np.full(50, 100.0), np.full(50, 99.0), np.full(50, 100.5)),
+        'intervalo nulo': (np.array([1.0, 2.0, 3.0]), np.array([2.0, 2.0, 2.0]),
+                           np.array([2.0, 2.0, 2.0]), np.array([2.0, 2.0, 2.0])),
+    }
+
+    ok = True
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name, inputs in edge_cases.items():
+            reference = legacy_scores(*inputs)
+            for use_numba in modes:
+                if not same(reference, score_anomalies(*inputs, use_numba=use_numba)):
+                    print(f"  [ERROR] Caso '{name}' distinto a la referencia ({'numba' if use_numba else 'numpy'})")
+                    ok = False
+
+        print(f"\nPuntuando {args.scoring_points:,} puntos...")
+        inputs = make_scoring_inputs(args.scoring_points)
+        if NUMBA_AVAILABLE:
+            score_anomalies(*(a[:10] for a in inputs), use_numba=True)  # compilación fuera de la medición
+        _, t_legacy = timed(legacy_scores, *inputs)
+        print(f"  pandas por columnas:   {t_legacy * 1000:8.1f} ms")
+        _, t_numpy = timed(score_anomalies, *inputs, use_numba=False)
+        print(f"  score_anomalies numpy: {t_numpy * 1000:8.1f} ms  ({t_legacy / t_numpy:.1f}x)")
+        if NUMBA_AVAILABLE:
+            _, t_numba = timed(score_anomalies, *inputs, use_numba=True)
+            print(f"  score_anomalies numba: {t_numba * 1000:8.1f} ms  ({t_legacy / t_numba:.1f}x)")
+        else:
+            print("  score_anomalies numba: (numba no instalado)")
+
+    print(f"  Resultado idéntico a la referencia ({len(edge_cases)} casos): {'sí' if ok else 'NO'}")
+    return ok
+
+
+def bench_residual_stats(args):
+    """Desvío de residuales: por lote vs estadísticas de entrenamiento (mismo resultado con cualquier lote)"""
+    from pipeline.scripts.residual_stats import ResidualStats, ResidualStatsStore
+
+    ok = True
+    # Welford por lotes == desvío de todos los residuales juntos
+    rng = np.random.default_rng(0)
+    residual = rng.normal(0.5, 2.0, 100_000)
+    stats = ResidualStats.from_residuals(residual[:1000])
+    for start in range(1000, len(residual), 777):
+        stats.update_welford(residual[start:start + 777])
+    welford_ok = stats.n == len(residual) and np.isclose(stats.std(), residual.std(ddof=1), rtol=1e-10)
+    print(f"  Welford por lotes igual al desvío total: {'sí' if welford_ok else 'NO'}")
+    ok &= welford_ok
+
+    # EWMA: sigue un cambio de escala de los residuales
+    stats = ResidualStats.from_residuals(rng.normal(0, 1.0, 10_000))
+    for _ in range(20):
+        stats.update_ewma(rng.normal(0, 3.0, 500), alpha=0.001)
+    ewma_ok = 2.7 < stats.std('ewma') < 3.3 and abs(stats.std() - 1.0) < 0.05
+    print(f"  EWMA tras pasar de desvío 1 a 3: {stats.std('ewma'):.2f} (entrenamiento {stats.std():.2f})")
+    ok &= ewma_ok
+
+    # Misma serie puntuada de una vez y en micro-lotes: flags idénticos solo con desvío fijo
+    print(f"\nEntrenando {args.stream_variables} modelos de prueba...")
+    detector, variables = make_streaming_detector(args.stream_variables)
+    datetimes = pd.date_range(pd.Timestamp.now().floor('h'), periods=240, freq='h')
+    df = pd.DataFrame({'DATETIME': datetimes})
+    for i, var in enumerate(variables):
+        values = 100 + 10 * np.sin(2 * np.pi * datetimes.hour.to_numpy() / 24) + rng.normal(0, 1.5, len(df))
+        values[rng.random(len(df)) < 0.03] += 8
+        df[var] = values
+
+    def flags(batch_size):
+        parts = [detector.detect_anomalies_multiple(df.iloc[start:start + batch_size], variables, verbose=False)
+                 for start in range(0, len(df), batch_size)]
+        return pd.concat(parts, ignore_index=True).sort_values(['variable', 'ds'])['high_residual'].to_numpy()
+
+    stored = {var: detector.residual_stats.get(var) for var in variables}
+    fixed = [flags(size) for size in (len(df), 24, 3)]
+    detector.residual_stats = ResidualStatsStore()  # sin estadísticas: desvío del lote
+    per_batch = [flags(size) for size in (len(df), 24, 3)]
+    for var, var_stats in stored.items():
+        detector.residual_stats.set(var, var_stats)
+
+    fixed_ok = all(np.array_equal(fixed[0], f) for f in fixed[1:])
+    changed = [int((per_batch[0] != f).sum()) for f in per_batch[1:]]
+    print(f"  high_residual con desvío de entrenamiento, lotes de 240/24/3 puntos: "
+          f"{'idénticos' if fixed_ok else 'DISTINTOS'}")
+    print(f"  high_residual con desvío del lote: {changed[0]} y {changed[1]} puntos cambian con lotes de 24 y 3")
+    ok &= fixed_ok
+    return bool(ok)
+
+
+def bench_result_memory(args):
+    """Memoria del resultado de detect_anomalies_multiple: DataFrames concatenados vs CompactResults"""
+    import gc
+    import tracemalloc
+    from pipeline.scripts.compact_results import COLUMNS
+
+    n_vars = args.memory_variables
+    detector, (base,) = make_streaming_detector(1)
+    predictor = detector.fast_predictors[base]
+    variables = [f"TAG-{i:04d}" for i in range(n_vars)]
+    detector.models = {var: predictor for var in variables}
+    detector.fast_predictors = {}
+    for var in variables:
+        detector.residual_stats.set(var, detector.residual_stats.get(base))
+
+    n_times = int(args.memory_days * 24 * 60)
+    print(f"\nGenerando {n_vars} variables x {n_times:,} minutos ({n_vars * n_times:,} puntos)...")
+    rng = np.random.default_rng(0)
+    datetimes = pd.date_range(pd.Timestamp.now().floor('D'), periods=n_times, freq='min')
+    base_values = 100 + 10 * np.sin(2 * np.pi * (datetimes.hour.to_numpy() + datetimes.minute.to_numpy() / 60) / 24)
+    df = pd.DataFrame({var: base_values + rng.normal(0, 1.5, n_times) for var in variables})
+    df.insert(0, 'DATETIME', datetimes)
+
+    def measure(compact):
+        gc.collect()
+        tracemalloc.start()
+        results, seconds = timed(detector.detect_anomalies_multiple, df, variables,
+                                 verbose=False, compact=compact)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        size = results.nbytes if compact else int(results.memory_usage(deep=True).sum())
+        return results, seconds, size, peak
+
+    legacy, t_legacy, size_legacy, peak_legacy = measure(False)
+    compact, t_compact, size_compact, peak_compact = measure(True)
+    n_rows = len(legacy)
+    full_rows = n_vars * 365 * 24 * 60
+
+    print(f"  DataFrames concatenados: {t_legacy:5.1f}s, resultado {size_legacy / 1e6:8.0f} MB "
+          f"({size_legacy / n_rows:.0f} B/fila), pico {peak_legacy / 1e6:8.0f} MB")
+    print(f"  CompactResults:          {t_compact:5.1f}s, resultado {size_compact / 1e6:8.0f} MB "
+          f"({size_compact / n_rows:.0f} B/fila), pico {peak_compact / 1e6:8.0f} MB")
+    print(f"  Proyección a {n_vars} variables x 1 año de datos por minuto ({full_rows:,} filas): "
+          f"{size_legacy / n_rows * full_rows / 1e9:.1f} GB vs {size_compact / n_rows * full_rows / 1e9:.1f} GB "
+          f"(pico {peak_legacy / n_rows * full_rows / 1e9:.1f} GB vs {peak_compact / n_rows * full_rows / 1e9:.1f} GB)")
+
+    frame = compact.to_frame()
+    ok = len(frame) == n_rows and list(frame.columns) == COLUMNS
+    ok = ok and (frame['variable'].astype(str).to_numpy() == legacy['variable'].astype(str).to_numpy()).all()
+    ok = ok and (frame['ds'].to_numpy() == legacy['ds'].to_numpy()).all()
+    for col in ['outside_interval', 'high_residual', 'is_anomaly']:
+        ok = ok and np.array_equal(frame[col].to_numpy(), legacy[col].to_numpy())
+    for col in ['y', 'yhat', 'yhat_lower', 'yhat_upper', 'residual', 'anomaly_score', 'prediction_error_pct']:
+        # float32: ~7 dígitos significativos
+        ok = ok and np.allclose(frame[col].to_numpy(), legacy[col].to_numpy(dtype=np.float32),
+                                rtol=1e-6, atol=0, equal_nan=True)
+    ok = ok and (compact.anomaly_counts() == legacy.groupby('variable')['is_anomaly'].sum()).all()
+    print(f"  Resultado igual al concatenado (float32): {'sí' if ok else 'NO'}")
+    return bool(ok)
+
+
+def bench_history_cache(args):
+    """Historial desde SQL: lectura y pivot completos vs cache en disco con actualización incremental"""
+    import tempfile
+    from change_feed import FakeProcessDataSource
+    from pipeline.scripts.history_cache import HistoryCache
+
+    n_vars, n_times = args.cache_variables, int(args.cache_days * 24 * 60)
+    print(f"\nCargando {n_vars} variables x {n_times:,} minutos en SQLite...")
+    source = FakeProcessDataSource(variables=n_vars, name='bench_history_cache')
+    source.connect()
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp('2024-01-01')
+
+    def insert(first, count):
+        ds = (start + pd.to_timedelta(np.arange(first, first + count), unit='min')).strftime('%Y-%m-%d %H:%M:%S')
+        df = pd.DataFrame({'datetime': np.repeat(ds.to_numpy(), n_vars),
+                           'variable_name': np.tile(source.variables, count),
+                           'value': rng.normal(100, 5, count * n_vars),
+                           'source_file': 'bench.csv'})
+        df = df.sample(frac=0.98, random_state=first)  # huecos, como en planta
+        source._conn.executemany("INSERT INTO dbo.ypf_process_data VALUES (?, ?, ?, ?)",
+                                 df.itertuples(index=False, name=None))
+        source._conn.commit()
+
+    insert(0, n_times)
+
+    def read_sql():
+        pivot = LongToWidePivot()
+        query = "SELECT datetime, variable_name, value FROM dbo.ypf_process_data ORDER BY datetime, variable_name"
+        for chunk in source.execute_query_chunked(query, 500_000, dtypes={'value': 'float64'}):
+            pivot.add(chunk)
+        df = pivot.result().reset_index().rename(columns={'datetime': 'DATETIME'})
+        df['DATETIME'] = pd.to_datetime(df['DATETIME'])
+        df.columns.name = None
+        return df
+
+    def same(a, b):
+        return (list(a.columns) == list(b.columns) and len(a) == len(b)
+                and (a['DATETIME'].to_numpy() == b['DATETIME'].to_numpy()).all()
+                and np.array_equal(a.iloc[:, 1:].to_numpy(), b.iloc[:, 1:].to_numpy(), equal_nan=True))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        reference, t_sql = timed(read_sql)
+        print(f"  SQL completo + pivot:                 {t_sql:6.2f}s ({len(reference):,} filas)")
+        cache = HistoryCache(cache_dir)
+        _, t_first = timed(cache.sync, source, verbose=False)
+        print(f"  Primera carga del cache:              {t_first:6.2f}s "
+              f"({cache.info()['bytes'] / 1e6:.0f} MB en {cache.info()['partitions']} particiones)")
+        cached, t_read = timed(HistoryCache(cache_dir).read)
+        print(f"  Lectura del cache:                    {t_read:6.2f}s")
+        ok = same(reference, cached)
+
+        # Llega una hora más de datos: el cache solo lee esa hora
+        insert(n_times, 60)
+        reference, t_sql = timed(read_sql)
+        _, t_sync = timed(cache.sync, source, verbose=False)
+        cached, t_read = timed(HistoryCache(cache_dir).read)
+        print(f"  Con 1 hora nueva: SQL completo {t_sql:.2f}s vs cache {t_sync + t_read:.2f}s "
+              f"(actualización {t_sync:.2f}s + lectura {t_read:.2f}s, {t_sql / (t_sync + t_read):.1f}x)")
+        ok = ok and same(reference, cached)
+
+        variables = source.variables[:5]
+        subset, t_subset = timed(HistoryCache(cache_dir).read, start=start + pd.Timedelta(days=1),
+                                 end=start + pd.Timedelta(days=2), variables=variables)
+        expected = reference[(reference['DATETIME'] >= start + pd.Timedelta(days=1))
+                             & (reference['DATETIME'] <= start + pd.Timedelta(days=2))][['DATETIME'] + variables]
+        print(f"  Lectura de 5 variables x 1 día:       {t_subset * 1000:6.1f} ms")
+        ok = ok and same(expected.reset_index(drop=True), subset)
+
+    source.disconnect()
+    print(f"  Resultado idéntico a la lectura desde SQL: {'sí' if ok else 'NO'}")
+    return bool(ok)
+
+
+def bench_columnar_io(args):
+    """Archivos de datos: read_csv completo vs lectura con proyección de columnas y filtro de fechas"""
+    import tempfile
+    from pipeline.scripts.columnar_io import PYARROW_AVAILABLE, read_data_file
+
+    n_vars, n_times = args.io_variables, int(args.io_days * 24 * 60)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(100, 5, (n_times, n_vars)), columns=[f"TAG-{i:04d}" for i in range(n_vars)])
+    df.insert(0, 'DATETIME', pd.date_range('2024-01-01', periods=n_times, freq='min'))
+    columns = list(df.columns[1:11])
+    start = df['DATETIME'].iloc[n_times // 2]
+    end = start + pd.Timedelta(days=1)
+    expected = df[(df['DATETIME'] >= start) & (df['DATETIME'] <= end)][['DATETIME'] + columns].reset_index(drop=True)
+    print(f"\n{n_vars} variables x {n_times:,} minutos; se leen 10 variables x 1 día")
+
+    def same(result) -> bool:
+        return (list(result.columns) == list(expected.columns) and len(result) == len(expected)
+                and (result['DATETIME'].to_numpy() == expected['DATETIME'].to_numpy()).all()
+                and np.allclose(result[columns].to_numpy(), expected[columns].to_numpy()))
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = Path(tmp) / 'bench_cleaned.csv'
+        df.to_csv(csv_path, index=False)
+
+        def legacy():
+            full = pd.read_csv(csv_path, parse_dates=['DATETIME'])
+            return full[(full['DATETIME'] >= start) & (full['DATETIME'] <= end)][['DATETIME'] + columns]
+
+        _, t_legacy = timed(legacy)
+        print(f"  read_csv completo + filtro:      {t_legacy:6.2f}s")
+        result, t_csv = timed(read_data_file, csv_path, columns, start=start, end=end)
+        print(f"  CSV con proyección:              {t_csv:6.2f}s ({t_legacy / t_csv:.1f}x)")
+        ok = ok and same(result)
+
+        if PYARROW_AVAILABLE:
+            parquet_path = Path(tmp) / 'bench_cleaned.parquet'
+            df.to_parquet(parquet_path, row_group_size=24 * 60)
+            result, t_parquet = timed(read_data_file, parquet_path, columns, start=start, end=end)
+            print(f"  Parquet con proyección y filtro: {t_parquet:6.2f}s ({t_legacy / t_parquet:.1f}x)")
+            ok = ok and same(result)
+        else:
+            print("  Parquet: (pyarrow no instalado)")
+
+    print(f"  Resultado idéntico al de read_csv: {'sí' if ok else 'NO'}")
+    return bool(ok)
+
+
+def legacy_metrics(results: pd.DataFrame, variables) -> pd.DataFrame:
+    """Cálculo original de evaluar_modelo: filtro y funciones de métricas por variable (referencia)"""
+    rows = []
+    for var in variables:
+        r = results[results['variable'] == var].copy()
+        if len(r) == 0:
+            continue
+        y, yhat = r['y'].values, r['yhat'].values
+        m = np.isfinite(y) & np.isfinite(yhat)
+        yt, yp = y[m], yhat[m]
+        mae = rmse = mape = r2 = np.nan
+        if len(yt) > 0:
+            mae = np.mean(np.abs(yt - yp))
+            rmse = np.sqrt(np.mean((yt - yp) ** 2))
+            nz = np.abs(yt) > 1e-10
+            mape = np.mean(np.abs((yt[nz] - yp[nz]) / yt[nz])) * 100 if nz.sum() > 0 else np.nan
+            # r2_score de sklearn
+            ss_res, ss_tot = np.sum((yt - yp) ** 2), np.sum((yt - yt.mean()) ** 2)
+            if len(yt) < 2:
+                r2 = np.nan
+            elif ss_tot == 0:
+                r2 = 1.0 if ss_res == 0 else 0.0
+            else:
+                r2 = 1 - ss_res / ss_tot
+        lo, up = r['yhat_lower'].values, r['yhat_upper'].values
+        c = np.isfinite(y) & np.isfinite(lo) & np.isfinite(up)
+        inside = (y[c] >= lo[c]) & (y[c] <= up[c])
+        res = r['residual'].values
+        res = res[np.isfinite(res)]
+        n_anomalies = r['is_anomaly'].sum()
+        rows.append({
+            'variable': var, 'n_points': len(r), 'mae': mae, 'rmse': rmse, 'mape': mape, 'r2': r2,
+            'interval_coverage_pct': inside.mean() * 100 if c.any() else np.nan,
+            'n_outside_interval': (~inside).sum(),
+            'residual_mean': res.mean() if len(res) else np.nan,
+            'residual_std': res.std() if len(res) else np.nan,
+            'residual_median': np.median(res) if len(res) else np.nan,
+            'n_anomalies': n_anomalies,
+            'anomaly_rate_pct': n_anomalies / len(r) * 100,
+            'avg_anomaly_score': r[r['is_anomaly']]['anomaly_score'].mean() if n_anomalies > 0 else 0,
+            'max_anomaly_score': r['anomaly_score'].max()
+        })
+    return pd.DataFrame(rows)
+
+
+def bench_metrics(args):
+    """Métricas de evaluación: filtro por variable vs grouped_metrics en una pasada"""
+    import warnings
+    from pipeline.scripts.anomaly_scoring import score_anomalies
+    from pipeline.scripts.grouped_metrics import grouped_metrics
+
+    n_vars, n_per_var = args.metrics_variables, args.metrics_points
+    variables = [f"TAG-{i:04d}" for i in range(n_vars)]
+    y, yhat, lower, upper = make_scoring_inputs(n_vars * n_per_var)
+    y[::97] = np.nan                      # huecos
+    y[:n_per_var] = 5.0                   # variable constante
+    y[n_per_var:n_per_var + 10] = 0.0     # ceros (MAPE)
+    scores = score_anomalies(y, yhat, lower, upper)
+    results = pd.DataFrame({'y': y, 'yhat': yhat, 'yhat_lower': lower, 'yhat_upper': upper,
+                            'residual': scores['residual'], 'is_anomaly': scores['is_anomaly'],
+                            'anomaly_score': scores['anomaly_score'],
+                            'variable': np.repeat(variables, n_per_var)})
+    print(f"\n{n_vars} variables x {n_per_var:,} puntos ({len(results):,} filas)")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        reference, t_legacy = timed(legacy_metrics, results, variables)
+    print(f"  Filtro por variable:         {t_legacy:4.2f}s")
+    metrics, t_grouped = timed(grouped_metrics, results, variables)
+    print(f"  grouped_metrics:             {t_grouped:4.2f}s ({t_legacy / t_grouped:.1f}x)")
+
+    # Mismo resultado con las filas desordenadas
+    shuffled = results.sample(frac=1, random_state=0)
+    metrics_shuffled, t_shuffled = timed(grouped_metrics, shuffled, variables)
+    print(f"  grouped_metrics desordenado: {t_shuffled:4.2f}s")
+
+    def same(a, b) -> bool:
+        if list(a['variable']) != list(b['variable']):
+            return False
+        numeric = [c for c in a.columns if c != 'variable']
+        return np.allclose(a[numeric].to_numpy(dtype=float), b[numeric].to_numpy(dtype=float),
+                           rtol=1e-9, atol=1e-12, equal_nan=True)
+
+    ok = same(reference, metrics) and same(reference, metrics_shuffled)
+    print(f"  Resultado idéntico al cálculo por variable: {'sí' if ok else 'NO'}")
+    return ok
+
+
+BENCHMARKS = {
+    'pivot': bench_pivot,
+    'source_file': bench_source_file,
+    'sql_write': bench_sql_write,
+    'streaming': bench_streaming,
+    'scoring': bench_scoring,
+    'residual_stats': bench_residual_stats,
+    'result_memory': bench_result_memory,
+    'history_cache': bench_history_cache,
+    'columnar_io': bench_columnar_io,
+    'metrics': bench_metrics,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks de rendimiento del pipeline (datos sintéticos)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos:
+  # Todos los benchmarks con el tamaño por defecto
+  python benchmark_rendimiento.py
+
+  # Pivot con 10 millones de filas
+  python benchmark_rendimiento.py pivot --rows 10000000
+
+  # Escritura de 1 millón de resultados con 5 ms de latencia por viaje
+  python benchmark_rendimiento.py sql_write --write-rows 1000000 --latency-ms 5
+
+  # Latencia de 50 variables que reportan cada 0.2 s, micro-lotes de 200 puntos o 0.5 s
+  python benchmark_rendimiento.py streaming --stream-variables 50 --stream-interval 0.2 --stream-batch 200 --stream-max-seconds 0.5
+
+  # Scores de anomalía sobre 5 millones de puntos
+  python benchmark_rendimiento.py scoring --scoring-points 5000000
+
+  # Memoria de los resultados de 500 variables con 7 días de datos por minuto (proyectado a 1 año)
+  python benchmark_rendimiento.py result_memory --memory-variables 500 --memory-days 7
+
+  # Cache de historial con 200 variables y 30 días de datos por minuto
+  python benchmark_rendimiento.py history_cache --cache-variables 200 --cache-days 30
+
+  # Lectura de archivos de datos (CSV vs Parquet) con 300 variables y 30 días por minuto
+  python benchmark_rendimiento.py columnar_io --io-variables 300 --io-days 30
+
+  # Métricas de evaluación de 2000 variables con 5000 puntos cada una
+  python benchmark_rendimiento.py metrics --metrics-variables 2000 --metrics-points 5000
+        """
+    )
+    parser.add_argument('benchmarks', nargs='*',
+                       help=f"Benchmarks a ejecutar (default: todos). Opciones: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--rows', type=int, default=10_000_000,
+                       help='Filas en formato largo (default: 10000000)')
+    parser.add_argument('--variables', type=int, default=200,
+                       help='Cantidad de variables (default: 200)')
+    parser.add_argument('--chunk-size', type=int, default=500_000,
+                       help='Filas por bloque en las pruebas por bloques (default: 500000)')
+    parser.add_argument('--write-rows', type=int, default=1_000_000,
+                       help='Filas de resultados en las pruebas de escritura (default: 1000000)')
+    parser.add_argument('--latency-ms', type=float, default=2.0,
+                       help='Latencia simulada por viaje a SQL en milisegundos (default: 2)')
+    parser.add_argument('--stream-variables', type=int, default=20,
+                       help='Modelos en la prueba de streaming (default: 20)')
+    parser.add_argument('--stream-seconds', type=float, default=10.0,
+                       help='Duración de cada corrida de streaming (default: 10)')
+    parser.add_argument('--stream-interval', type=float, default=0.1,
+                       help='Segundos entre timestamps que llegan (default: 0.1)')
+    parser.add_argument('--stream-batch', type=int, default=200,
+                       help='Puntos por micro-lote (default: 200)')
+    parser.add_argument('--stream-max-seconds', type=float, default=0.5,
+                       help='Espera máxima de un punto en un micro-lote (default: 0.5)')
+    parser.add_argument('--stream-cycle-seconds', type=float, default=5.0,
+                       help='Intervalo del lote por ciclo de referencia (default: 5)')
+    parser.add_argument('--scoring-points', type=int, default=1_000_000,
+                       help='Puntos en la prueba de scores de anomalía (default: 1000000)')
+    parser.add_argument('--memory-variables', type=int, default=500,
+                       help='Variables en la prueba de memoria de resultados (default: 500)')
+    parser.add_argument('--memory-days', type=float, default=2.0,
+                       help='Días de datos por minuto en la prueba de memoria; se proyecta a 1 año (default: 2)')
+    parser.add_argument('--cache-variables', type=int, default=50,
+                       help='Variables en la prueba del cache de historial (default: 50)')
+    parser.add_argument('--cache-days', type=float, default=14.0,
+                       help='Días de datos por minuto en la prueba del cache de historial (default: 14)')
+    parser.add_argument('--io-variables', type=int, default=100,
+                       help='Variables en la prueba de lectura de archivos (default: 100)')
+    parser.add_argument('--io-days', type=float, default=14.0,
+                       help='Días de datos por minuto en la prueba de lectura de archivos (default: 14)')
+    parser.add_argument('--metrics-variables', type=int, default=500,
+                       help='Variables en la prueba de métricas de evaluación (default: 500)')
+    parser.add_argument('--metrics-points', type=int, default=2000,
+                       help='Puntos por variable en la prueba de métricas de evaluación (default: 2000)')
+
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        print(f"[ERROR] Benchmarks desconocidos: {', '.join(unknown)}")
+        sys.exit(1)
+
+    print("="*80)
+    print("BENCHMARKS DE RENDIMIENTO")
+    print("="*80)
+
+    failed = []
+    for name in args.benchmarks or list(BENCHMARKS):
+        print(f"\n[{name}] {BENCHMARKS[name].__doc__}")
+        if not BENCHMARKS[name](args):
+            failed.append(name)
+
+    print("\n" + "="*80)
+    if failed:
+        print(f"[ERROR] Resultados distintos a la referencia en: {', '.join(failed)}")
+        sys.exit(1)
+    print("[OK] Benchmarks completados")
+
+
+if __name__ == '__main__':
+    main()
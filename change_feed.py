@@ -0,0 +1,298 @@
+"""
+Detección de datos nuevos para el worker de procesamiento
+
+En lugar de dormir un intervalo fijo entre lecturas, el worker espera a que
+haya datos nuevos en dbo.ypf_process_data:
+
+- `SQLChangeProbe`: consulta liviana "¿hay filas posteriores a la marca?" sobre
+  una columna indexada (datetime por defecto, o un id/rowversion si existe)
+- `NotificationSource`: fuente de avisos enchufable (un proceso de carga, un
+  broker, etc. llama a `notify()` cuando inserta un lote)
+- `AdaptiveBackoff`: sin cambios, el intervalo entre sondeos crece hasta un
+  máximo; al llegar datos vuelve al mínimo
+
+`FakeProcessDataSource` simula la tabla de entrada en SQLite en memoria e
+inserta lotes periódicos, para probar el flujo sin SQL Server:
+
+    python change_feed.py --batch-interval 3 --duration 30
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent))
+
+from sql_utils import SQLConnection
+
+
+class AdaptiveBackoff:
+    """Intervalo de espera que crece mientras no hay cambios"""
+
+    def __init__(self, min_seconds: float = 1.0, max_seconds: float = 60.0, factor: float = 2.0):
+        """
+        Parámetros:
+        -----------
+        min_seconds : float
+            Intervalo después de detectar datos nuevos (default: 1)
+        max_seconds : float
+            Intervalo máximo sin cambios (default: 60)
+        factor : float
+            Multiplicador por cada sondeo sin cambios (default: 2)
+        """
+        self.min_seconds = min_seconds
+        self.max_seconds = max(max_seconds, min_seconds)
+        self.factor = factor
+        self.current = min_seconds
+
+    def increase(self) -> float:
+        self.current = min(self.current * self.factor, self.max_seconds)
+        return self.current
+
+    def reset(self) -> float:
+        self.current = self.min_seconds
+        return self.current
+
+
+class NotificationSource:
+    """
+    Fuente de avisos de datos nuevos
+
+    Quien inserta datos llama a `notify()`; el worker despierta de inmediato en
+    lugar de esperar al próximo sondeo. Se puede reemplazar por cualquier objeto
+    con `wait(timeout) -> bool`.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Espera un aviso hasta `timeout` segundos; retorna True si llegó"""
+        notified = self._event.wait(timeout)
+        self._event.clear()
+        return notified
+
+
+class SQLChangeProbe:
+    """Sondeo liviano de filas nuevas en la tabla de entrada"""
+
+    def __init__(self, sql_conn: SQLConnection, since: Callable[[], Optional[datetime]],
+                 table: str = "dbo.ypf_process_data", column: str = "datetime"):
+        """
+        Parámetros:
+        -----------
+        sql_conn : SQLConnection
+            Conexión a la base de datos de entrada
+        since : Callable[[], Optional[datetime]]
+            Retorna la marca actual del worker (se consulta en cada sondeo)
+        table : str
+            Tabla de entrada (default: dbo.ypf_process_data)
+        column : str
+            Columna creciente e indexada a comparar (default: datetime)
+        """
+        self.sql_conn = sql_conn
+        self.since = since
+        self.table = table
+        self.column = column
+        self.probes = 0
+
+    def has_changes(self) -> bool:
+        """True si hay filas con `column` posterior a la marca del worker"""
+        self.probes += 1
+        mark = self.since()
+        cursor = self.sql_conn._conn.cursor()
+        try:
+            # EXISTS corta en la primera fila: con índice en `column` es un seek
+            if mark is None:
+                cursor.execute(f"SELECT CASE WHEN EXISTS (SELECT 1 FROM {self.table}) THEN 1 ELSE 0 END")
+            else:
+                cursor.execute(
+                    f"SELECT CASE WHEN EXISTS (SELECT 1 FROM {self.table} WHERE {self.column} > ?) "
+                    f"THEN 1 ELSE 0 END",
+                    (pd.Timestamp(mark).strftime('%Y-%m-%d %H:%M:%S'),)
+                )
+            return cursor.fetchone()[0] == 1
+        finally:
+            cursor.close()
+
+
+class ChangeFeed:
+    """
+    Combina avisos, sondeo y espera adaptativa
+
+    Uso:
+        feed = ChangeFeed(probe, notifications, AdaptiveBackoff(1, 600))
+        while True:
+            if feed.wait_for_change():
+                feed.processed(procesar())
+    """
+
+    def __init__(self, probe: Optional[SQLChangeProbe] = None,
+                 notifications: Optional[NotificationSource] = None,
+                 backoff: Optional[AdaptiveBackoff] = None):
+        if probe is None and notifications is None:
+            raise ValueError("Se requiere un sondeo o una fuente de avisos")
+        self.probe = probe
+        self.notifications = notifications
+        self.backoff = backoff or AdaptiveBackoff()
+
+    def wait_for_change(self) -> bool:
+        """
+        Espera como máximo el intervalo actual
+
+        Un aviso despierta antes; al vencer el intervalo se sondea la tabla.
+        Retorna True si hay datos nuevos (sin cambios, el intervalo crece).
+        """
+        if self.notifications is not None:
+            if self.notifications.wait(self.backoff.current):
+                return True
+        else:
+            time.sleep(self.backoff.current)
+
+        if self.probe is not None and self.probe.has_changes():
+            return True
+        self.backoff.increase()
+        return False
+
+    def processed(self, success: bool):
+        """Informa el resultado de procesar un cambio detectado"""
+        if success:
+            self.backoff.reset()
+        else:
+            # Hay datos pero no se pudieron procesar: no reintentar en un ciclo cerrado
+            self.backoff.increase()
+
+
+class FakeProcessDataSource(SQLConnection):
+    """
+    Tabla dbo.ypf_process_data simulada en SQLite en memoria
+
+    Se comporta como una SQLConnection de entrada (las queries del worker
+    funcionan sin cambios) y un hilo inserta un lote por timestamp cada
+    `batch_interval` segundos, avisando a `notifications` si se indica.
+    """
+
+    def __init__(self, variables: int = 20, batch_interval: float = 5.0,
+                 notifications: Optional[NotificationSource] = None, name: str = "fake_process_data"):
+        self.server = 'sqlite'
+        self.variables = [f"TAG-{i:03d}" for i in range(variables)]
+        self.batch_interval = batch_interval
+        self.notifications = notifications
+        self._uri = f"file:{name}?mode=memory&cache=shared"
+        self._conn = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._write_lock = threading.Lock()
+        self.batches = []  # (datetime del lote, instante de inserción)
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        conn.execute(f"ATTACH DATABASE '{self._uri}' AS dbo")
+        return conn
+
+    def connect(self):
+        self._conn = self._open()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dbo.ypf_process_data "
+            "(datetime TEXT, variable_name TEXT, value REAL, source_file TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS dbo.idx_datetime ON ypf_process_data(datetime)")
+        self._conn.commit()
+        return True
+
+    def insert_batch(self, ds: Optional[datetime] = None):
+        """Inserta un timestamp con un valor por variable"""
+        ds = ds or datetime.now().replace(microsecond=0)
+        rng = np.random.default_rng()
+        rows = [(ds.strftime('%Y-%m-%d %H:%M:%S'), var, float(v), 'fake.csv')
+                for var, v in zip(self.variables, rng.normal(100, 5, len(self.variables)))]
+        with self._write_lock:
+            conn = self._open()
+            conn.executemany("INSERT INTO dbo.ypf_process_data VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+            conn.close()
+        self.batches.append((ds, time.time()))
+        if self.notifications is not None:
+            self.notifications.notify()
+
+    def start(self):
+        """Inicia la inserción periódica"""
+        def _loop():
+            while not self._stop_event.wait(self.batch_interval):
+                self.insert_batch()
+
+        self._thread = threading.Thread(target=_loop, name='fake-process-data', daemon=True)
+        self._thread.start()
+
+    def disconnect(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        super().disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Prueba local de la detección de datos nuevos con una fuente simulada',
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--batch-interval', type=float, default=5.0,
+                       help='Segundos entre lotes simulados (default: 5)')
+    parser.add_argument('--duration', type=float, default=30.0,
+                       help='Duración de la prueba en segundos (default: 30)')
+    parser.add_argument('--no-notify', action='store_true',
+                       help='Solo sondeo, sin avisos de la fuente')
+    parser.add_argument('--max-wait', type=float, default=10.0,
+                       help='Intervalo máximo de sondeo en segundos (default: 10)')
+    args = parser.parse_args()
+
+    notifications = None if args.no_notify else NotificationSource()
+    source = FakeProcessDataSource(batch_interval=args.batch_interval, notifications=notifications)
+    source.connect()
+
+    state = {'since': datetime.now() - timedelta(seconds=1)}
+    probe = SQLChangeProbe(source, since=lambda: state['since'])
+    feed = ChangeFeed(probe, notifications, AdaptiveBackoff(0.5, args.max_wait))
+
+    source.start()
+    latencies = []
+    end = time.time() + args.duration
+    while time.time() < end:
+        if not feed.wait_for_change():
+            continue
+        df = source.execute_query(
+            f"SELECT datetime, variable_name, value FROM dbo.ypf_process_data "
+            f"WHERE datetime > '{state['since'].strftime('%Y-%m-%d %H:%M:%S')}'"
+        )
+        if df is None or df.empty:
+            feed.processed(False)
+            continue
+        state['since'] = pd.to_datetime(df['datetime']).max()
+        inserted_at = dict((pd.Timestamp(ds), t) for ds, t in source.batches)
+        latency = time.time() - inserted_at.get(state['since'], time.time())
+        latencies.append(latency)
+        feed.processed(True)
+        print(f"[OK] {len(df)} filas nuevas hasta {state['since']} (latencia {latency * 1000:.0f} ms)")
+        sys.stdout.flush()
+
+    source.disconnect()
+    if latencies:
+        print(f"\nLotes: {len(latencies)}, sondeos: {probe.probes}, "
+              f"latencia p50 {np.percentile(latencies, 50) * 1000:.0f} ms, "
+              f"máx {max(latencies) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Coordinador de workers de procesamiento particionados
+Lanza N procesos de worker_procesamiento.py en este host, cada uno dueño de una
+partición estable de las variables, y reasigna las variables cuando un worker
+entra o sale (ver pipeline/scripts/sharding.py)
+"""
+
+import sys
+from pathlib import Path
+import time
+import signal
+import argparse
+import subprocess
+from typing import Dict, List, Optional
+
+sys.path.append(str(Path(__file__).parent))
+
+from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+from pipeline.scripts.sharding import ShardMembership
+
+
+class ShardCoordinator:
+    """Supervisa los procesos miembro y publica la asignación de variables"""
+
+    def __init__(self, shard_dir: str, n_workers: int, worker_args: Optional[List[str]] = None,
+                 models_dir: str = "pipeline/models/prophet", check_seconds: float = 5.0,
+                 restart: bool = True, refresh_variables_seconds: float = 300.0):
+        """
+        Parámetros:
+        -----------
+        shard_dir : str
+            Directorio de coordinación compartido con los workers
+        n_workers : int
+            Procesos worker a lanzar en este host (0 = solo coordinar miembros lanzados aparte)
+        worker_args : Optional[List[str]]
+            Argumentos adicionales para cada worker_procesamiento.py
+        models_dir : str
+            Directorio de modelos (para conocer las variables a repartir)
+        check_seconds : float
+            Intervalo entre verificaciones de miembros (default: 5)
+        restart : bool
+            Si relanzar un worker que termina inesperadamente (default: True)
+        refresh_variables_seconds : float
+            Cada cuánto releer las variables con modelo, por si se reentrenó (default: 300)
+        """
+        self.shard_dir = shard_dir
+        self.n_workers = n_workers
+        self.worker_args = worker_args or []
+        self.models_dir = models_dir
+        self.check_seconds = check_seconds
+        self.restart = restart
+        self.refresh_variables_seconds = refresh_variables_seconds
+
+        self.membership = ShardMembership(shard_dir)
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self.variables: List[str] = []
+        self.members: List[str] = []
+        self.owners: Dict[str, str] = {}
+        self.rebalances = 0
+
+    def load_variables(self) -> List[str]:
+        """Variables con modelo entrenado"""
+        detector = ProphetAnomalyDetector()
+        detector.load_models(self.models_dir, lazy=True)
+        variables = sorted(detector.models.keys())
+        detector._close_models()
+        return variables
+
+    def spawn(self, member_id: str):
+        """Lanza un worker miembro"""
+        command = [sys.executable, str(Path(__file__).parent / 'worker_procesamiento.py'),
+                   '--shard-dir', self.shard_dir, '--member-id', member_id] + self.worker_args
+        # Sesión propia: el Ctrl+C de la terminal llega solo al coordinador, que detiene a cada worker
+        self.processes[member_id] = subprocess.Popen(command, start_new_session=True)
+        print(f"[INFO] Worker '{member_id}' iniciado (pid {self.processes[member_id].pid})")
+        sys.stdout.flush()
+
+    def check_processes(self):
+        """Detecta workers terminados; los da de baja y, si corresponde, los relanza"""
+        for member_id, process in list(self.processes.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            print(f"[ADVERTENCIA] Worker '{member_id}' terminó (código {code})")
+            sys.stdout.flush()
+            # Sin esperar a que venza su latido: sus variables se reasignan ya
+            self.membership.leave(member_id)
+            del self.processes[member_id]
+            if self.restart:
+                self.spawn(member_id)
+
+    def rebalance(self, force: bool = False) -> bool:
+        """Publica una asignación nueva si cambiaron los miembros vivos"""
+        members = self.membership.live_members()
+        if not force and members == self.members:
+            return False
+        assignment = self.membership.publish_assignment(self.variables, members)
+        moved = self._moved_variables(assignment['members'])
+        self.members = members
+        self.rebalances += 1
+        sizes = ', '.join(f"{m}: {len(v)}" for m, v in assignment['members'].items()) or 'sin miembros'
+        print(f"[INFO] Asignación {assignment['generation']}: {len(members)} miembro(s), "
+              f"{len(self.variables)} variables ({sizes}); {moved} cambiaron de dueño")
+        sys.stdout.flush()
+        return True
+
+    def _moved_variables(self, new_members: Dict[str, List[str]]) -> int:
+        """Cantidad de variables que cambian de dueño respecto de la asignación anterior"""
+        owners = {var: member for member, variables in new_members.items() for var in variables}
+        moved = sum(1 for var, member in owners.items() if self.owners.get(var) not in (None, member))
+        self.owners = owners
+        return moved
+
+    def run(self):
+        """Lanza los workers y los supervisa hasta Ctrl+C"""
+        print("\n" + "="*80)
+        print("COORDINADOR DE WORKERS PARTICIONADOS")
+        print("="*80)
+        self.variables = self.load_variables()
+        print(f"[INFO] {len(self.variables)} variables a repartir; directorio de coordinación: {self.shard_dir}")
+        print("[INFO] Presiona Ctrl+C para detener\n")
+        sys.stdout.flush()
+
+        for i in range(self.n_workers):
+            self.spawn(f"shard-{i}")
+
+        last_refresh = time.time()
+        try:
+            while True:
+                time.sleep(self.check_seconds)
+                self.check_processes()
+
+                force = False
+                if time.time() - last_refresh >= self.refresh_variables_seconds:
+                    variables = self.load_variables()
+                    force = variables != self.variables
+                    self.variables = variables
+                    last_refresh = time.time()
+                self.rebalance(force=force)
+
+        except KeyboardInterrupt:
+            print("\n[INFO] Deteniendo workers...")
+            sys.stdout.flush()
+
+        finally:
+            # SIGINT: cada worker termina su ciclo, escribe lo pendiente y se da de baja
+            for process in self.processes.values():
+                if process.poll() is None:
+                    process.send_signal(signal.SIGINT)
+            for member_id, process in self.processes.items():
+                try:
+                    process.wait(timeout=120)
+                except subprocess.TimeoutExpired:
+                    print(f"[ADVERTENCIA] Worker '{member_id}' no terminó a tiempo; se fuerza la salida")
+                    process.kill()
+            print(f"[OK] Coordinador detenido ({self.rebalances} asignaciones publicadas)")
+            sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Coordinador de workers de procesamiento particionados por variable',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos:
+  # 4 workers, cada uno con ~1/4 de las variables
+  python coordinador_shards.py --workers 4
+
+  # Pasar opciones a cada worker (después de --)
+  python coordinador_shards.py --workers 4 -- --event-driven --fast-predict --bulk-write
+
+  # Sumar un worker lanzado aparte (el coordinador le reasigna ~1/5 de las variables)
+  python worker_procesamiento.py --shard-dir pipeline/shards --member-id extra-1 --event-driven
+        """
+    )
+    parser.add_argument('--workers', type=int, default=2,
+                       help='Procesos worker a lanzar (default: 2)')
+    parser.add_argument('--shard-dir', type=str, default='pipeline/shards',
+                       help='Directorio de coordinación (default: pipeline/shards)')
+    parser.add_argument('--models-dir', type=str, default='pipeline/models/prophet',
+                       help='Directorio de modelos (default: pipeline/models/prophet)')
+    parser.add_argument('--check-seconds', type=float, default=5.0,
+                       help='Segundos entre verificaciones de miembros (default: 5)')
+    parser.add_argument('--no-restart', action='store_true',
+                       help='No relanzar workers que terminan inesperadamente')
+    parser.add_argument('worker_args', nargs=argparse.REMAINDER,
+                       help='Opciones para worker_procesamiento.py (después de --)')
+
+    args = parser.parse_args()
+    worker_args = args.worker_args[1:] if args.worker_args[:1] == ['--'] else args.worker_args
+
+    coordinator = ShardCoordinator(args.shard_dir, args.workers, worker_args,
+                                   models_dir=args.models_dir, check_seconds=args.check_seconds,
+                                   restart=not args.no_restart)
+    coordinator.run()
+
+
+if __name__ == '__main__':
+    main()
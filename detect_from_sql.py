@@ -4,6 +4,7 @@ Script para detectar anomalías leyendo desde SQL y escribiendo resultados a SQL
 
 import sys
 from pathlib import Path
+import argparse
 import pandas as pd
 import numpy as np
 
@@ -13,6 +14,8 @@ sys.path.append(str(Path(__file__).parent))
 from sql_utils import SQLConnection
 
 from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+from pipeline.scripts.wide_pivot import LongToWidePivot
+from pipeline.scripts.history_cache import DEFAULT_OVERLAP_HOURS, read_history
 
 # Configuración de conexión SQL - Base de datos de entrada
 SQL_CONFIG_INPUT = {
@@ -87,10 +90,21 @@ def create_anomalies_table(sql_conn: SQLConnection):
 
 
 def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None, 
-                       end_date: str = None) -> pd.DataFrame:
+                       end_date: str = None, chunk_size: int = 500000,
+                       history_cache: str = None,
+                       history_overlap_hours: float = DEFAULT_OVERLAP_HOURS) -> pd.DataFrame:
     """
     Lee datos desde SQL Server y los convierte a formato ancho
+    
+    Con `history_cache` se usa el cache de historial en disco y de SQL solo se
+    lee lo posterior a lo ya cacheado, más `history_overlap_hours` hacia atrás
+    por datos que llegan tarde (ver pipeline/scripts/history_cache.py)
     """
+    if history_cache:
+        print(f"\n[INFO] Leyendo datos desde el cache de historial ({history_cache})...")
+        return read_history(sql_conn, history_cache, start_date, end_date, chunk_size=chunk_size,
+                            overlap_hours=history_overlap_hours)
+    
     print("\n[INFO] Leyendo datos desde SQL Server...")
     
     query = "SELECT datetime, variable_name, value FROM dbo.ypf_process_data"
@@ -106,21 +120,21 @@ def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None,
     
     query += " ORDER BY datetime, variable_name"
     
-    df_long = sql_conn.execute_query(query)
+    # Leer por bloques y pivotear cada bloque a medida que llega
+    pivot = LongToWidePivot()
+    try:
+        for chunk in sql_conn.execute_query_chunked(query, chunk_size, dtypes={'value': 'float64'}):
+            pivot.add(chunk)
+    except Exception:
+        return None
     
-    if df_long is None or len(df_long) == 0:
+    if pivot.n_rows == 0:
         print("[ERROR] No se encontraron datos en SQL")
         return None
     
-    print(f"  Filas leídas: {len(df_long):,}")
+    print(f"  Filas leídas: {pivot.n_rows:,}")
     
-    # Convertir a formato ancho
-    df_wide = df_long.pivot_table(
-        index='datetime',
-        columns='variable_name',
-        values='value',
-        aggfunc='first'
-    )
+    df_wide = pivot.result()
     
     df_wide = df_wide.reset_index()
     df_wide.rename(columns={'datetime': 'DATETIME'}, inplace=True)
@@ -131,6 +145,15 @@ def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None,
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Detecta anomalías en el historial de SQL Server y escribe los resultados')
+    parser.add_argument('--history-cache', type=str, default=None,
+                       help='Directorio del cache de historial en disco; de SQL solo se leen los datos nuevos '
+                            '(p.ej. pipeline/cache/history; default: leer todo de SQL)')
+    parser.add_argument('--history-overlap-hours', type=float, default=DEFAULT_OVERLAP_HOURS,
+                       help=f'Con --history-cache, horas anteriores a lo cacheado que se releen de SQL '
+                            f'por datos que llegan tarde (default: {DEFAULT_OVERLAP_HOURS:g})')
+    args = parser.parse_args()
+    
     print("="*80)
     print("DETECCIÓN DE ANOMALÍAS DESDE SQL SERVER")
     print("="*80)
@@ -140,7 +163,7 @@ def main():
     datetime_col = 'DATETIME'
     
     # Verificar que existan modelos
-    if not models_dir.exists() or not list(models_dir.glob("prophet_model_*.pkl")):
+    if not ProphetAnomalyDetector.has_saved_models(models_dir):
         print(f"\n[ERROR] No se encontraron modelos entrenados en {models_dir}")
         print("   Entrena los modelos primero:")
         print("   python train_from_sql.py")
@@ -182,7 +205,8 @@ def main():
         # start_date = end_date - timedelta(days=7)
         # df = read_data_from_sql(sql_conn, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
         
-        df = read_data_from_sql(sql_conn_input)
+        df = read_data_from_sql(sql_conn_input, history_cache=args.history_cache,
+                                history_overlap_hours=args.history_overlap_hours)
         
         if df is None:
             return
@@ -202,12 +226,16 @@ def main():
         print("="*80)
         
         try:
+            # Resultados compactos (float32, variable categórica) en lugar del concat de
+            # DataFrames float64; to_frame comparte los arreglos sin copiarlos
             results = detector.detect_anomalies_multiple(
                 df=df,
                 variables=available_vars,
                 datetime_col=datetime_col,
-                combine_results=True
-            )
+                combine_results=True,
+                compact=True
+            ).to_frame()
+            del df
             
             # Agregar source_file si no existe
             if 'source_file' not in results.columns:
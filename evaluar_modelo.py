@@ -4,9 +4,9 @@ Script para evaluar las métricas de rendimiento del modelo de detección de ano
 
 import sys
 from pathlib import Path
+import argparse
 import pandas as pd
 import numpy as np
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import json
 from datetime import datetime
 
@@ -14,104 +14,19 @@ from datetime import datetime
 sys.path.append(str(Path(__file__).parent))
 
 from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+from pipeline.scripts.history_cache import HistoryCache
+from pipeline.scripts.grouped_metrics import grouped_metrics
 
 
-def calculate_prediction_metrics(y_true, y_pred):
-    """Calcula métricas de calidad de predicción"""
-    # Filtrar valores válidos
-    mask = ~(np.isnan(y_true) | np.isnan(y_pred) | np.isinf(y_true) | np.isinf(y_pred))
-    y_true_clean = y_true[mask]
-    y_pred_clean = y_pred[mask]
+def evaluate_model(data_dir='output', models_dir='pipeline/models/prophet', results_dir='pipeline/results',
+                   history_cache=None, start_date=None, end_date=None):
+    """
+    Evalúa el modelo de detección de anomalías y calcula todas las métricas
     
-    if len(y_true_clean) == 0:
-        return {
-            'mae': np.nan,
-            'rmse': np.nan,
-            'mape': np.nan,
-            'r2': np.nan,
-            'n_points': 0
-        }
-    
-    # MAE (Mean Absolute Error)
-    mae = mean_absolute_error(y_true_clean, y_pred_clean)
-    
-    # RMSE (Root Mean Squared Error)
-    rmse = np.sqrt(mean_squared_error(y_true_clean, y_pred_clean))
-    
-    # MAPE (Mean Absolute Percentage Error)
-    # Evitar división por cero
-    mask_nonzero = np.abs(y_true_clean) > 1e-10
-    if mask_nonzero.sum() > 0:
-        mape = np.mean(np.abs((y_true_clean[mask_nonzero] - y_pred_clean[mask_nonzero]) / y_true_clean[mask_nonzero])) * 100
-    else:
-        mape = np.nan
-    
-    # R² (Coeficiente de determinación)
-    r2 = r2_score(y_true_clean, y_pred_clean)
-    
-    return {
-        'mae': mae,
-        'rmse': rmse,
-        'mape': mape,
-        'r2': r2,
-        'n_points': len(y_true_clean)
-    }
-
-
-def calculate_interval_coverage(y_true, y_lower, y_upper):
-    """Calcula la cobertura del intervalo de confianza"""
-    mask = ~(np.isnan(y_true) | np.isnan(y_lower) | np.isnan(y_upper) | 
-             np.isinf(y_true) | np.isinf(y_lower) | np.isinf(y_upper))
-    
-    y_true_clean = y_true[mask]
-    y_lower_clean = y_lower[mask]
-    y_upper_clean = y_upper[mask]
-    
-    if len(y_true_clean) == 0:
-        return {'coverage': np.nan, 'n_points': 0}
-    
-    # Calcular cuántos valores están dentro del intervalo
-    inside_interval = (y_true_clean >= y_lower_clean) & (y_true_clean <= y_upper_clean)
-    coverage = inside_interval.mean() * 100
-    
-    return {
-        'coverage': coverage,
-        'n_points': len(y_true_clean),
-        'n_inside': inside_interval.sum(),
-        'n_outside': (~inside_interval).sum()
-    }
-
-
-def calculate_residual_stats(residuals):
-    """Calcula estadísticas de los residuales"""
-    residuals_clean = residuals[~(np.isnan(residuals) | np.isinf(residuals))]
-    
-    if len(residuals_clean) == 0:
-        return {
-            'mean': np.nan,
-            'std': np.nan,
-            'median': np.nan,
-            'q25': np.nan,
-            'q75': np.nan,
-            'min': np.nan,
-            'max': np.nan,
-            'n_points': 0
-        }
-    
-    return {
-        'mean': residuals_clean.mean(),
-        'std': residuals_clean.std(),
-        'median': np.median(residuals_clean),
-        'q25': np.percentile(residuals_clean, 25),
-        'q75': np.percentile(residuals_clean, 75),
-        'min': residuals_clean.min(),
-        'max': residuals_clean.max(),
-        'n_points': len(residuals_clean)
-    }
-
-
-def evaluate_model(data_dir='output', models_dir='pipeline/models/prophet', results_dir='pipeline/results'):
-    """Evalúa el modelo de detección de anomalías y calcula todas las métricas"""
+    Los datos se leen del archivo *_cleaned.csv de `data_dir` o, con `history_cache`,
+    del cache de historial en disco (sin conectarse a SQL), opcionalmente entre
+    `start_date` y `end_date`.
+    """
     
     print("="*80)
     print("EVALUACIÓN DE MÉTRICAS DEL MODELO DE DETECCIÓN DE ANOMALÍAS")
@@ -131,17 +46,25 @@ def evaluate_model(data_dir='output', models_dir='pipeline/models/prophet', resu
         return
     
     # Cargar datos
-    data_dir = Path(data_dir)
-    cleaned_files = list(data_dir.glob("*_cleaned.csv"))
-    
-    if not cleaned_files:
-        print(f"\n[ERROR] No se encontraron archivos de datos en {data_dir}")
-        return
-    
-    # Usar el archivo más reciente
-    data_file = cleaned_files[0]
-    print(f"\n[INFO] Cargando datos de: {data_file.name}")
-    df = pd.read_csv(data_file, parse_dates=['DATETIME'])
+    if history_cache:
+        cache = HistoryCache(history_cache)
+        print(f"\n[INFO] Cargando datos del cache de historial: {history_cache} (hasta {cache.watermark})")
+        df = cache.read(start_date, end_date, variables=list(detector.models.keys()))
+        if len(df) == 0:
+            print(f"\n[ERROR] El cache de historial no tiene datos para el rango pedido")
+            return
+    else:
+        data_dir = Path(data_dir)
+        cleaned_files = list(data_dir.glob("*_cleaned.csv"))
+        
+        if not cleaned_files:
+            print(f"\n[ERROR] No se encontraron archivos de datos en {data_dir}")
+            return
+        
+        # Usar el archivo más reciente
+        data_file = cleaned_files[0]
+        print(f"\n[INFO] Cargando datos de: {data_file.name}")
+        df = pd.read_csv(data_file, parse_dates=['DATETIME'])
     
     # Obtener variables disponibles
     available_vars = [v for v in detector.models.keys() if v in df.columns]
@@ -149,12 +72,15 @@ def evaluate_model(data_dir='output', models_dir='pipeline/models/prophet', resu
     
     # Detectar anomalías para obtener predicciones
     print(f"\n[INFO] Generando predicciones y detectando anomalías...")
+    # Resultados compactos (float32, flags en bits): grouped_metrics los lee sin armar el DataFrame
     results = detector.detect_anomalies_multiple(
         df=df,
         variables=available_vars,
         datetime_col='DATETIME',
-        combine_results=True
+        combine_results=True,
+        compact=True
     )
+    del df
     
     print(f"[OK] {len(results)} puntos evaluados")
     
@@ -163,63 +89,8 @@ def evaluate_model(data_dir='output', models_dir='pipeline/models/prophet', resu
     print("CALCULANDO MÉTRICAS POR VARIABLE")
     print(f"{'='*80}")
     
-    metrics_by_variable = []
-    
-    for var in available_vars:
-        var_results = results[results['variable'] == var].copy()
-        
-        if len(var_results) == 0:
-            continue
-        
-        # Métricas de predicción
-        pred_metrics = calculate_prediction_metrics(
-            var_results['y'].values,
-            var_results['yhat'].values
-        )
-        
-        # Cobertura del intervalo
-        interval_metrics = calculate_interval_coverage(
-            var_results['y'].values,
-            var_results['yhat_lower'].values,
-            var_results['yhat_upper'].values
-        )
-        
-        # Estadísticas de residuales
-        residual_stats = calculate_residual_stats(var_results['residual'].values)
-        
-        # Métricas de anomalías
-        n_anomalies = var_results['is_anomaly'].sum()
-        anomaly_rate = n_anomalies / len(var_results) * 100
-        avg_anomaly_score = var_results[var_results['is_anomaly']]['anomaly_score'].mean() if n_anomalies > 0 else 0
-        max_anomaly_score = var_results['anomaly_score'].max()
-        
-        # Combinar todas las métricas
-        var_metrics = {
-            'variable': var,
-            'n_points': len(var_results),
-            # Métricas de predicción
-            'mae': pred_metrics['mae'],
-            'rmse': pred_metrics['rmse'],
-            'mape': pred_metrics['mape'],
-            'r2': pred_metrics['r2'],
-            # Cobertura del intervalo
-            'interval_coverage_pct': interval_metrics['coverage'],
-            'n_outside_interval': interval_metrics['n_outside'],
-            # Estadísticas de residuales
-            'residual_mean': residual_stats['mean'],
-            'residual_std': residual_stats['std'],
-            'residual_median': residual_stats['median'],
-            # Métricas de anomalías
-            'n_anomalies': n_anomalies,
-            'anomaly_rate_pct': anomaly_rate,
-            'avg_anomaly_score': avg_anomaly_score,
-            'max_anomaly_score': max_anomaly_score,
-        }
-        
-        metrics_by_variable.append(var_metrics)
-    
-    # Crear DataFrame con métricas
-    metrics_df = pd.DataFrame(metrics_by_variable)
+    # Todas las variables en una pasada (ver pipeline/scripts/grouped_metrics.py)
+    metrics_df = grouped_metrics(results, variables=available_vars)
     
     # Guardar métricas
     results_dir = Path(results_dir)
@@ -259,8 +130,9 @@ def evaluate_model(data_dir='output', models_dir='pipeline/models/prophet', resu
     print(f"  • Total de puntos analizados: {total_points:,}")
     print(f"  • Total de anomalías detectadas: {total_anomalies:,}")
     print(f"  • Tasa global de anomalías: {total_anomalies/total_points*100:.2f}%")
-    print(f"  • Score promedio de anomalías: {results[results['is_anomaly']]['anomaly_score'].mean():.2f}")
-    print(f"  • Score máximo de anomalías: {results['anomaly_score'].max():.2f}")
+    scores = pd.Series(results.measures['anomaly_score'], dtype=np.float64)
+    print(f"  • Score promedio de anomalías: {scores[results.flag('is_anomaly')].mean():.2f}")
+    print(f"  • Score máximo de anomalías: {scores.max():.2f}")
     
     # Top variables por diferentes métricas
     print(f"\n{'='*80}")
@@ -371,7 +243,21 @@ def evaluate_model(data_dir='output', models_dir='pipeline/models/prophet', resu
 
 
 if __name__ == '__main__':
-    evaluate_model()
+    parser = argparse.ArgumentParser(description='Evalúa las métricas del modelo de detección de anomalías')
+    parser.add_argument('--data-dir', type=str, default='output',
+                       help='Directorio con los archivos *_cleaned.csv (default: output)')
+    parser.add_argument('--models-dir', type=str, default='pipeline/models/prophet',
+                       help='Directorio de modelos (default: pipeline/models/prophet)')
+    parser.add_argument('--history-cache', type=str, default=None,
+                       help='Evaluar sobre el cache de historial en disco en lugar de los CSV')
+    parser.add_argument('--start', type=str, default=None,
+                       help='Fecha de inicio con --history-cache (YYYY-MM-DD)')
+    parser.add_argument('--end', type=str, default=None,
+                       help='Fecha de fin con --history-cache (YYYY-MM-DD)')
+    args = parser.parse_args()
+    
+    evaluate_model(data_dir=args.data_dir, models_dir=args.models_dir, history_cache=args.history_cache,
+                   start_date=args.start, end_date=args.end)
 
 
 
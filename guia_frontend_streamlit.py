@@ -13,7 +13,7 @@ from pathlib import Path
 
 # Agregar path para importar módulos
 sys.path.append(str(Path(__file__).parent))
-from sql_utils import SQLConnection
+from sql_utils import ConnectionPool
 
 # Configuración de página
 st.set_page_config(
@@ -32,22 +32,24 @@ SQL_CONFIG = {
     'port': 1433
 }
 
-# Cache para conexión SQL
+# Pool de conexiones compartido por todas las sesiones
+# (cada consulta toma su propia conexión, así las sesiones no comparten un mismo handle)
 @st.cache_resource
-def get_sql_connection():
-    """Obtiene conexión a SQL Server"""
-    conn = SQLConnection(**SQL_CONFIG)
-    if conn.connect():
-        return conn
-    return None
+def get_connection_pool():
+    """Obtiene el pool de conexiones a SQL Server"""
+    try:
+        return ConnectionPool(**SQL_CONFIG, min_size=1, max_size=4)
+    except ConnectionError:
+        return None
 
 # Cache para datos
 @st.cache_data(ttl=300)  # Cache por 5 minutos
 def load_data(query: str):
     """Carga datos desde SQL Server"""
-    conn = get_sql_connection()
-    if conn:
-        df = conn.execute_query(query)
+    pool = get_connection_pool()
+    if pool:
+        with pool.connection() as conn:
+            df = conn.execute_query(query)
         return df
     return None
 
@@ -0,0 +1,153 @@
+"""
+Cálculo de flags y scores de anomalía a partir de la predicción
+
+Reúne en una sola función lo que `detect_anomalies` hacía columna por columna
+sobre el DataFrame de resultados (residual, desvío, flags, score con
+asignaciones `.loc` por máscara y error porcentual). Trabaja sobre arrays NumPy
+sin columnas intermedias, y si numba está instalado puede usar un kernel
+compilado que recorre los datos una sola vez después de calcular el desvío.
+
+Reglas (las mismas de siempre):
+- outside_interval: y fuera de [yhat_lower, yhat_upper]
+- high_residual: |residual| > anomaly_threshold * desvío de los residuales
+- is_anomaly: outside_interval o high_residual
+- anomaly_score: distancia al intervalo relativa a su semiancho (x50), o
+  |residual| / desvío (x20) si es mayor, acotado a 100
+- prediction_error_pct: |residual / yhat| * 100 (NaN si yhat = 0)
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def residual_std(residual: np.ndarray) -> float:
+    """Desvío muestral (ddof=1) de los residuales; NaN con menos de 2 valores, como pandas."""
+    residual = residual[~np.isnan(residual)]
+    if len(residual) < 2:
+        return np.nan
+    return float(np.std(residual, ddof=1))
+
+
+def _score_numpy(y, yhat, lower, upper, threshold, std):
+    residual = y - yhat
+    abs_residual = np.abs(residual)
+    above = y > upper
+    below = y < lower
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.zeros(len(y), dtype=np.float64)
+        if above.any():
+            score[above] = np.minimum((y[above] - upper[above]) / (upper[above] - yhat[above]) * 50, 100)
+        if below.any():
+            score[below] = np.minimum((lower[below] - y[below]) / (yhat[below] - lower[below]) * 50, 100)
+        np.maximum(score, np.minimum(abs_residual / std * 20, 100), out=score)
+
+        high_residual = abs_residual > threshold * std
+        error_pct = np.abs(residual / yhat * 100)
+    error_pct[np.isinf(error_pct)] = np.nan
+
+    outside = above | below
+    return {
+        'residual': residual,
+        'outside_interval': outside,
+        'high_residual': high_residual,
+        'is_anomaly': outside | high_residual,
+        'anomaly_score': score,
+        'prediction_error_pct': error_pct
+    }
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True, error_model='numpy')
+    def _score_kernel(y, yhat, lower, upper, threshold, std,
+                      residual, outside, high, is_anomaly, score, error_pct):
+        for i in range(len(y)):
+            r = y[i] - yhat[i]
+            a = abs(r)
+            residual[i] = r
+
+            s = 0.0
+            if y[i] > upper[i]:
+                s = min((y[i] - upper[i]) / (upper[i] - yhat[i]) * 50, 100.0)
+                outside[i] = True
+            elif y[i] < lower[i]:
+                s = min((lower[i] - y[i]) / (yhat[i] - lower[i]) * 50, 100.0)
+                outside[i] = True
+            else:
+                outside[i] = False
+            # np.maximum/np.minimum propagan NaN; aquí se replica explícitamente
+            rs = a / std * 20
+            rs = rs if rs < 100.0 or np.isnan(rs) else 100.0
+            score[i] = np.nan if (np.isnan(s) or np.isnan(rs)) else max(s, rs)
+
+            high[i] = a > threshold * std
+            is_anomaly[i] = outside[i] or high[i]
+            pct = abs(r / yhat[i] * 100) if yhat[i] != 0 else np.inf
+            error_pct[i] = np.nan if np.isinf(pct) else pct
+
+
+def _score_numba(y, yhat, lower, upper, threshold, std):
+    n = len(y)
+    out = {
+        'residual': np.empty(n, dtype=np.float64),
+        'outside_interval': np.empty(n, dtype=np.bool_),
+        'high_residual': np.empty(n, dtype=np.bool_),
+        'is_anomaly': np.empty(n, dtype=np.bool_),
+        'anomaly_score': np.empty(n, dtype=np.float64),
+        'prediction_error_pct': np.empty(n, dtype=np.float64)
+    }
+    _score_kernel(y, yhat, lower, upper, float(threshold), float(std),
+                  out['residual'], out['outside_interval'], out['high_residual'],
+                  out['is_anomaly'], out['anomaly_score'], out['prediction_error_pct'])
+    return out
+
+
+def score_anomalies(y: np.ndarray,
+                    yhat: np.ndarray,
+                    yhat_lower: np.ndarray,
+                    yhat_upper: np.ndarray,
+                    anomaly_threshold: float = 2.0,
+                    std: Optional[float] = None,
+                    use_numba: Optional[bool] = None) -> Dict[str, np.ndarray]:
+    """
+    Calcula residuales, flags y scores de anomalía
+
+    Parámetros:
+    -----------
+    y, yhat, yhat_lower, yhat_upper : array-like
+        Valores reales, predicción y límites del intervalo (mismo largo)
+    anomaly_threshold : float
+        Desvíos a partir de los cuales el residual es alto (default: 2)
+    std : Optional[float]
+        Desvío de los residuales a usar (None = calcularlo sobre estos datos)
+    use_numba : Optional[bool]
+        Si usar el kernel compilado (None = si numba está instalado)
+
+    Retorna:
+    --------
+    Dict[str, np.ndarray] con residual, outside_interval, high_residual,
+    is_anomaly, anomaly_score, prediction_error_pct y residual_std (float)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    yhat = np.asarray(yhat, dtype=np.float64)
+    lower = np.asarray(yhat_lower, dtype=np.float64)
+    upper = np.asarray(yhat_upper, dtype=np.float64)
+
+    if std is None:
+        std = residual_std(y - yhat)
+
+    if use_numba is None:
+        use_numba = NUMBA_AVAILABLE
+    if use_numba and not NUMBA_AVAILABLE:
+        raise ImportError("numba no está instalado. Ejecuta: pip install numba")
+
+    scores = (_score_numba if use_numba else _score_numpy)(y, yhat, lower, upper, anomaly_threshold, std)
+    scores['residual_std'] = std
+    return scores
@@ -0,0 +1,261 @@
+"""
+Lectura y escritura de archivos para los scripts basados en archivos
+(train_anomaly_detector.py, detect_anomalies.py)
+
+Entrada: los `*_cleaned.parquet` y `*_cleaned.csv` de `output/`, uno por vez
+(`iter_data_files`), leyendo solo las columnas pedidas y las filas dentro del
+rango de fechas. Con Parquet la proyección y el filtro por fecha los resuelve
+pyarrow al leer (se descartan row groups enteros por sus estadísticas); con CSV
+se leen solo esas columnas y se filtra por bloques.
+
+Salida: `PartitionedResultWriter` escribe los resultados a medida que llegan,
+particionados por fecha (`<dir>/date=YYYY-MM-DD/part-NNNNN.parquet` o `.csv`),
+en el formato Hive que leen pyarrow.dataset, pandas y la mayoría de las
+herramientas de consulta.
+
+Parquet requiere pyarrow (opcional); sin él se leen y escriben solo CSV.
+"""
+
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+FORMATS = ('parquet', 'csv')
+
+CSV_CHUNK_ROWS = 200_000
+
+
+def default_format() -> str:
+    """'parquet' si pyarrow está instalado, si no 'csv'"""
+    return 'parquet' if PYARROW_AVAILABLE else 'csv'
+
+
+def _require_pyarrow():
+    if not PYARROW_AVAILABLE:
+        raise ImportError("pyarrow no está instalado (necesario para Parquet). Ejecuta: pip install pyarrow")
+
+
+def find_data_files(data_dir, suffix: str = '_cleaned') -> List[Path]:
+    """
+    Archivos de datos limpios de `data_dir`, ordenados por nombre
+
+    Si un mismo archivo existe como .parquet y .csv se usa el .parquet.
+    Sin pyarrow se ignoran los .parquet.
+    """
+    data_dir = Path(data_dir)
+    files = {f.stem: f for f in data_dir.glob(f"*{suffix}.csv")}
+    if PYARROW_AVAILABLE:
+        files.update({f.stem: f for f in data_dir.glob(f"*{suffix}.parquet")})
+    return [files[stem] for stem in sorted(files)]
+
+
+def file_columns(path) -> List[str]:
+    """Columnas del archivo, leyendo solo el esquema / encabezado"""
+    path = Path(path)
+    if path.suffix == '.parquet':
+        _require_pyarrow()
+        return list(pq.read_schema(path).names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def _end_bound(end) -> Tuple[pd.Timestamp, bool]:
+    """
+    Límite superior de `end`: (límite, inclusive)
+
+    Una fecha sin hora ('2024-03-31') abarca el día completo (< 2024-04-01);
+    con hora, el límite es ese instante inclusive.
+    """
+    date_only = (isinstance(end, str) and ':' not in end) or (isinstance(end, date) and not isinstance(end, datetime))
+    if date_only:
+        return pd.Timestamp(end) + pd.Timedelta(days=1), False
+    return pd.Timestamp(end), True
+
+
+def _parquet_filters(datetime_col: str, start, end) -> Optional[List[Tuple]]:
+    filters = []
+    if start is not None:
+        filters.append((datetime_col, '>=', pd.Timestamp(start).to_pydatetime()))
+    if end is not None:
+        bound, inclusive = _end_bound(end)
+        filters.append((datetime_col, '<=' if inclusive else '<', bound.to_pydatetime()))
+    return filters or None
+
+
+def read_data_file(path,
+                   columns: Optional[Sequence[str]] = None,
+                   datetime_col: str = 'DATETIME',
+                   start=None,
+                   end=None) -> pd.DataFrame:
+    """
+    Lee un archivo de datos con proyección de columnas y filtro de fechas
+
+    Parámetros:
+    -----------
+    path : str o Path
+        Archivo .parquet o .csv
+    columns : Optional[Sequence[str]]
+        Columnas a leer además de `datetime_col` (None = todas); las que el
+        archivo no tiene se ignoran
+    datetime_col : str
+        Columna de fecha/hora
+    start, end : Optional[fecha]
+        Rango de fechas inclusive (None = sin límite); un `end` sin hora
+        ('2024-03-31') incluye ese día completo
+
+    Retorna:
+    --------
+    pd.DataFrame con `datetime_col` como datetime64 y las columnas pedidas
+    """
+    path = Path(path)
+    if columns is not None:
+        available = set(file_columns(path))
+        columns = [datetime_col] + [c for c in columns if c in available and c != datetime_col]
+
+    if path.suffix == '.parquet':
+        _require_pyarrow()
+        table = pq.read_table(path, columns=columns, filters=_parquet_filters(datetime_col, start, end))
+        df = table.to_pandas()
+        df[datetime_col] = pd.to_datetime(df[datetime_col])
+        return df
+
+    chunks = []
+    for chunk in pd.read_csv(path, usecols=columns, parse_dates=[datetime_col], chunksize=CSV_CHUNK_ROWS):
+        if start is not None:
+            chunk = chunk[chunk[datetime_col] >= pd.Timestamp(start)]
+        if end is not None:
+            bound, inclusive = _end_bound(end)
+            chunk = chunk[(chunk[datetime_col] <= bound) if inclusive else (chunk[datetime_col] < bound)]
+        chunks.append(chunk)
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def iter_data_files(files: Sequence,
+                    columns: Optional[Sequence[str]] = None,
+                    datetime_col: str = 'DATETIME',
+                    start=None,
+                    end=None) -> Iterator[Tuple[Path, pd.DataFrame]]:
+    """
+    Lee los archivos de a uno (ver read_data_file); cada DataFrame se puede
+    liberar antes de leer el siguiente
+
+    Retorna:
+    --------
+    Iterator[Tuple[Path, pd.DataFrame]]
+    """
+    for path in files:
+        yield Path(path), read_data_file(path, columns, datetime_col, start, end)
+
+
+class PartitionedResultWriter:
+    """
+    Escribe resultados incrementalmente en un directorio particionado por fecha
+
+    Cada llamada a `write` agrega un archivo por fecha presente en el lote
+    (`date=YYYY-MM-DD/part-NNNNN.<formato>`); nada se acumula en memoria.
+
+    Uso:
+        writer = PartitionedResultWriter("pipeline/results/anomalies_detected_20250101_120000")
+        for df in lotes:
+            writer.write(df)
+        print(writer.rows, writer.files)
+    """
+
+    def __init__(self, directory, format: Optional[str] = None, date_col: str = 'ds'):
+        """
+        Parámetros:
+        -----------
+        directory : str o Path
+            Directorio del conjunto de resultados
+        format : Optional[str]
+            'parquet' o 'csv' (None = parquet si pyarrow está instalado)
+        date_col : str
+            Columna datetime por la que se particiona (default: 'ds')
+        """
+        format = format or default_format()
+        if format not in FORMATS:
+            raise ValueError(f"Formato desconocido: {format}. Opciones: {', '.join(FORMATS)}")
+        if format == 'parquet':
+            _require_pyarrow()
+        self.directory = Path(directory)
+        self.format = format
+        self.date_col = date_col
+        self.rows = 0
+        self.files = 0
+        self._parts: Dict[str, int] = {}
+
+    def write(self, df: pd.DataFrame) -> int:
+        """
+        Escribe un lote de resultados
+
+        Retorna:
+        --------
+        int: Archivos escritos
+        """
+        if df is None or len(df) == 0:
+            return 0
+        dates = pd.to_datetime(df[self.date_col]).dt.strftime('%Y-%m-%d')
+        written = 0
+        for date, part in df.groupby(dates.to_numpy(), sort=True):
+            part_dir = self.directory / f"date={date}"
+            part_dir.mkdir(parents=True, exist_ok=True)
+            n = self._parts.get(date, 0)
+            self._parts[date] = n + 1
+            path = part_dir / f"part-{n:05d}.{self.format}"
+            if self.format == 'parquet':
+                pq.write_table(pa.Table.from_pandas(part, preserve_index=False), path)
+            else:
+                part.to_csv(path, index=False)
+            written += 1
+        self.rows += len(df)
+        self.files += written
+        return written
+
+    @property
+    def dates(self) -> List[str]:
+        """Fechas (particiones) escritas"""
+        return sorted(self._parts)
+
+
+def read_partitioned(directory,
+                     columns: Optional[Sequence[str]] = None,
+                     start=None,
+                     end=None) -> pd.DataFrame:
+    """
+    Lee un directorio escrito por PartitionedResultWriter
+
+    Parámetros:
+    -----------
+    columns : Optional[Sequence[str]]
+        Columnas a leer (None = todas)
+    start, end : Optional[fecha]
+        Rango de fechas de las particiones a leer, inclusive; las demás no se abren
+    """
+    directory = Path(directory)
+    start = pd.Timestamp(start).strftime('%Y-%m-%d') if start is not None else None
+    end = pd.Timestamp(end).strftime('%Y-%m-%d') if end is not None else None
+
+    frames = []
+    for part_dir in sorted(directory.glob("date=*")):
+        date = part_dir.name.split('=', 1)[1]
+        if (start is not None and date < start) or (end is not None and date > end):
+            continue
+        for path in sorted(part_dir.glob("part-*")):
+            if path.suffix == '.parquet':
+                _require_pyarrow()
+                frames.append(pq.read_table(path, columns=columns).to_pandas())
+            else:
+                frames.append(pd.read_csv(path, usecols=columns))
+    if not frames:
+        return pd.DataFrame(columns=list(columns) if columns is not None else None)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,188 @@
+"""
+Resultados de detección en formato compacto
+
+`detect_anomalies_multiple` arma un DataFrame por variable (float64, tres
+columnas bool y la columna `variable` repetida como texto) y los concatena al
+final: con cientos de variables y meses de historia el resultado ocupa varios GB
+y durante el concat existen dos copias.
+
+`CompactResults` reserva de una vez los arreglos de todas las filas (se conoce
+cuántos puntos válidos tiene cada variable antes de predecir) y cada variable
+escribe su tramo en el lugar:
+
+- medidas en float32 (y, yhat, límites, residual, score, error %)
+- los tres flags en un solo byte por fila (bits OUTSIDE_INTERVAL, HIGH_RESIDUAL, IS_ANOMALY)
+- la variable como código entero sobre la lista de variables
+
+~39 bytes por fila contra ~100 del DataFrame concatenado. `to_frame()` arma el
+DataFrame con las columnas de siempre (medidas float32, `variable` categórica)
+para escribir a SQL o analizar con pandas.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+OUTSIDE_INTERVAL = np.uint8(1)
+HIGH_RESIDUAL = np.uint8(2)
+IS_ANOMALY = np.uint8(4)
+
+FLAG_COLUMNS = {
+    'outside_interval': OUTSIDE_INTERVAL,
+    'high_residual': HIGH_RESIDUAL,
+    'is_anomaly': IS_ANOMALY
+}
+
+MEASURE_COLUMNS = ['y', 'yhat', 'yhat_lower', 'yhat_upper', 'residual', 'anomaly_score', 'prediction_error_pct']
+
+# Mismo orden de columnas que detect_anomalies
+COLUMNS = ['ds', 'y', 'yhat', 'yhat_lower', 'yhat_upper', 'residual', 'outside_interval',
+           'high_residual', 'is_anomaly', 'anomaly_score', 'variable', 'prediction_error_pct']
+
+
+def count_valid_points(df: pd.DataFrame, variables: Sequence[str], datetime_col: str = 'DATETIME') -> np.ndarray:
+    """
+    Puntos que `prepare_data_for_prophet` conserva de cada variable (fecha y valor no nulos)
+
+    Retorna:
+    --------
+    np.ndarray: Cantidad de filas de cada variable, en el orden de `variables`
+    """
+    ds_valid = pd.to_datetime(df[datetime_col]).notna().to_numpy()
+    return np.array([np.count_nonzero(df[var].notna().to_numpy() & ds_valid) for var in variables],
+                    dtype=np.int64)
+
+
+class CompactResults:
+    """
+    Resultados de varias variables en arreglos preasignados
+
+    Las filas de cada variable ocupan un tramo contiguo [offsets[i], offsets[i+1]),
+    ordenado por fecha, en el orden de `variables` (igual que el concat de
+    detect_anomalies_multiple).
+    """
+
+    def __init__(self, variables: Sequence[str], counts: Sequence[int]):
+        """
+        Parámetros:
+        -----------
+        variables : Sequence[str]
+            Variables, en el orden en que se guardan sus tramos
+        counts : Sequence[int]
+            Filas reservadas para cada variable
+        """
+        self.variables = list(variables)
+        counts = np.asarray(counts, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._index = {var: i for i, var in enumerate(self.variables)}
+        self._filled = np.zeros(len(self.variables), dtype=bool)
+
+        n = int(self.offsets[-1])
+        code_dtype = np.int16 if len(self.variables) < np.iinfo(np.int16).max else np.int32
+        self.variable_code = np.repeat(np.arange(len(self.variables), dtype=code_dtype), counts)
+        self.ds = np.empty(n, dtype='datetime64[ns]')
+        self.measures = {col: np.empty(n, dtype=np.float32) for col in MEASURE_COLUMNS}
+        self.flags = np.zeros(n, dtype=np.uint8)
+
+    @classmethod
+    def allocate(cls, df: pd.DataFrame, variables: Sequence[str], datetime_col: str = 'DATETIME') -> 'CompactResults':
+        """Reserva lugar para los puntos válidos de cada variable en `df`"""
+        return cls(variables, count_valid_points(df, variables, datetime_col))
+
+    def __len__(self) -> int:
+        return len(self.ds)
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria de los arreglos en bytes"""
+        return (self.ds.nbytes + self.flags.nbytes + self.variable_code.nbytes
+                + sum(values.nbytes for values in self.measures.values()))
+
+    def fill(self, variable: str, ds, y, yhat, yhat_lower, yhat_upper, scores: Dict[str, np.ndarray]):
+        """
+        Escribe los resultados de una variable en su tramo
+
+        Parámetros:
+        -----------
+        ds, y, yhat, yhat_lower, yhat_upper : array-like
+            Fechas, valores y predicción (con el largo reservado para la variable)
+        scores : Dict[str, np.ndarray]
+            Resultado de anomaly_scoring.score_anomalies
+        """
+        i = self._index[variable]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if len(ds) != end - start:
+            raise ValueError(f"{variable}: {len(ds)} filas para un tramo de {end - start}")
+
+        self.ds[start:end] = ds
+        out = self.measures
+        out['y'][start:end] = y
+        out['yhat'][start:end] = yhat
+        out['yhat_lower'][start:end] = yhat_lower
+        out['yhat_upper'][start:end] = yhat_upper
+        for col in ('residual', 'anomaly_score', 'prediction_error_pct'):
+            out[col][start:end] = scores[col]
+
+        flags = self.flags[start:end]
+        flags[:] = 0
+        for col, bit in FLAG_COLUMNS.items():
+            flags[scores[col]] |= bit
+        self._filled[i] = True
+
+    def flag(self, name: str) -> np.ndarray:
+        """Un flag como arreglo bool ('outside_interval', 'high_residual' o 'is_anomaly')"""
+        return (self.flags & FLAG_COLUMNS[name]) != 0
+
+    def anomaly_counts(self) -> pd.Series:
+        """Anomalías por variable, sin armar el DataFrame"""
+        counts = np.bincount(self.variable_code[self.flag('is_anomaly')], minlength=len(self.variables))
+        return pd.Series(counts, index=self.variables, name='n_anomalies')
+
+    def drop_unfilled(self) -> List[str]:
+        """
+        Quita los tramos de variables que no se llegaron a escribir (p.ej. fallaron)
+
+        Retorna:
+        --------
+        List[str]: Variables quitadas
+        """
+        missing = [var for var, filled in zip(self.variables, self._filled) if not filled]
+        if not missing:
+            return []
+        keep = np.repeat(self._filled, np.diff(self.offsets))
+        counts = np.diff(self.offsets)[self._filled]
+        kept_variables = [var for var, filled in zip(self.variables, self._filled) if filled]
+
+        self.ds = self.ds[keep]
+        self.flags = self.flags[keep]
+        self.measures = {col: values[keep] for col, values in self.measures.items()}
+        code_dtype = self.variable_code.dtype
+        self.variable_code = np.repeat(np.arange(len(kept_variables), dtype=code_dtype), counts)
+        self.variables = kept_variables
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._index = {var: i for i, var in enumerate(self.variables)}
+        self._filled = np.ones(len(self.variables), dtype=bool)
+        return missing
+
+    def to_frame(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        DataFrame con las columnas de detect_anomalies (medidas float32, flags bool,
+        `variable` categórica)
+
+        Parámetros:
+        -----------
+        columns : Optional[Sequence[str]]
+            Columnas a incluir (None = todas)
+        """
+        data = {}
+        for col in columns or COLUMNS:
+            if col == 'ds':
+                data[col] = self.ds
+            elif col == 'variable':
+                data[col] = pd.Categorical.from_codes(self.variable_code, categories=self.variables)
+            elif col in FLAG_COLUMNS:
+                data[col] = self.flag(col)
+            else:
+                data[col] = self.measures[col]
+        return pd.DataFrame(data, copy=False)
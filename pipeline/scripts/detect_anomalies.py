@@ -4,6 +4,7 @@ Versión adaptada para datos de Argentina
 """
 
 import sys
+import argparse
 from pathlib import Path
 import pandas as pd
 import numpy as np
@@ -12,21 +13,54 @@ import numpy as np
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
 from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+from pipeline.scripts.columnar_io import (FORMATS, PartitionedResultWriter, default_format, file_columns,
+                                          find_data_files, read_data_file, read_partitioned)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Detecta anomalías en los datos limpios con los modelos entrenados',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos:
+  # Todos los *_cleaned.parquet / *_cleaned.csv de output/
+  python pipeline/scripts/detect_anomalies.py
+
+  # Solo un mes, resultados en CSV
+  python pipeline/scripts/detect_anomalies.py --start 2024-03-01 --end 2024-03-31 --format csv
+        """
+    )
+    parser.add_argument('--data-dir', type=str, default='output',
+                       help='Directorio con los archivos *_cleaned (default: output)')
+    parser.add_argument('--models-dir', type=str, default='pipeline/models/prophet',
+                       help='Directorio de modelos (default: pipeline/models/prophet)')
+    parser.add_argument('--results-dir', type=str, default='pipeline/results',
+                       help='Directorio de resultados (default: pipeline/results)')
+    parser.add_argument('--start', type=str, default=None,
+                       help='Fecha inicial de los datos a analizar (default: sin límite)')
+    parser.add_argument('--end', type=str, default=None,
+                       help='Fecha final de los datos a analizar, inclusive (YYYY-MM-DD incluye el día completo; default: sin límite)')
+    parser.add_argument('--format', choices=FORMATS, default=default_format(),
+                       help=f'Formato de los resultados particionados por fecha (default: {default_format()})')
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
+
     print("="*80)
     print("DETECCIÓN DE ANOMALÍAS CON PROPHET - ARGENTINA")
     print("="*80)
     
     # Configuración
-    models_dir = Path("pipeline/models/prophet")
-    data_dir = Path("output")
-    results_dir = Path("pipeline/results")
+    models_dir = Path(args.models_dir)
+    data_dir = Path(args.data_dir)
+    results_dir = Path(args.results_dir)
     datetime_col = 'DATETIME'
+    timestamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')
     
     # Verificar que existan modelos
-    if not models_dir.exists() or not list(models_dir.glob("prophet_model_*.pkl")):
+    if not ProphetAnomalyDetector.has_saved_models(models_dir):
         print(f"\n[ERROR] No se encontraron modelos entrenados en {models_dir}")
         print("   Entrena los modelos primero:")
         print("   python pipeline/scripts/train_anomaly_detector.py")
@@ -46,53 +80,74 @@ def main():
         return
     
     # Cargar datos
-    cleaned_files = list(data_dir.glob("*_cleaned.csv"))
+    cleaned_files = find_data_files(data_dir)
     
     if not cleaned_files:
         print(f"\n[ERROR] No se encontraron archivos de datos en {data_dir}")
         return
     
-    # Procesar cada archivo o el más reciente
+    # Procesar cada archivo
     print(f"\n[INFO] Archivos de datos encontrados: {len(cleaned_files)}")
+    if args.start or args.end:
+        print(f"[INFO] Rango de fechas: {args.start or 'inicio'} a {args.end or 'fin'}")
     
-    all_results = []
+    # Los resultados de cada archivo se escriben al terminarlo, particionados por fecha
+    results_path = results_dir / f"anomalies_detected_{timestamp}"
+    anomalies_path = results_dir / f"anomalies_only_{timestamp}"
+    writer = PartitionedResultWriter(results_path, format=args.format)
+    anomalies_writer = PartitionedResultWriter(anomalies_path, format=args.format)
+    anomalies_by_date = pd.Series(dtype=np.int64)
     
     for data_file in cleaned_files:
         print(f"\n{'='*80}")
         print(f"Procesando: {data_file.name}")
         print(f"{'='*80}")
         
-        # Cargar datos
-        df = pd.read_csv(data_file, parse_dates=[datetime_col])
-        print(f"  Dimensiones: {df.shape[0]} filas x {df.shape[1]} columnas")
-        
-        # Obtener variables disponibles en los modelos
-        available_vars = [v for v in detector.models.keys() if v in df.columns]
+        # Variables disponibles en los modelos (solo se lee el encabezado / esquema)
+        columns = set(file_columns(data_file))
+        available_vars = [v for v in detector.models.keys() if v in columns]
         
         if not available_vars:
             print(f"  [ADVERTENCIA] No hay variables comunes entre modelos y datos")
             continue
         
+        # Cargar datos: solo las columnas con modelo y las fechas pedidas
+        df = read_data_file(data_file, columns=available_vars, datetime_col=datetime_col,
+                            start=args.start, end=args.end)
+        print(f"  Dimensiones: {df.shape[0]} filas x {df.shape[1]} columnas")
+        
+        if len(df) == 0:
+            print(f"  [ADVERTENCIA] Sin datos en el rango de fechas")
+            continue
+        
         print(f"  Variables a analizar: {len(available_vars)}")
         
         # Detectar anomalías
         try:
+            # Resultados compactos (float32, variable categórica) en lugar del concat de DataFrames
             results = detector.detect_anomalies_multiple(
                 df=df,
                 variables=available_vars,
                 datetime_col=datetime_col,
-                combine_results=True
-            )
+                combine_results=True,
+                compact=True
+            ).to_frame()
+            del df
             
             # Agregar información del archivo
             results['source_file'] = data_file.stem
             
-            all_results.append(results)
+            writer.write(results)
+            anomalies = results[results['is_anomaly']]
+            anomalies_writer.write(anomalies)
+            anomalies_by_date = anomalies_by_date.add(
+                pd.to_datetime(anomalies['ds']).dt.date.value_counts(), fill_value=0)
             
             # Resumen por archivo
             n_anomalies = results['is_anomaly'].sum()
             n_total = len(results)
             print(f"\n  [OK] Anomalias detectadas: {n_anomalies} de {n_total} puntos ({n_anomalies/n_total*100:.2f}%)")
+            del results, anomalies
             
         except Exception as e:
             print(f"  [ERROR] Error detectando anomalias: {str(e)}")
@@ -100,28 +155,16 @@ def main():
             traceback.print_exc()
             continue
     
-    if not all_results:
+    if writer.rows == 0:
         print("\n[ERROR] No se generaron resultados")
         return
     
-    # Combinar todos los resultados
-    print(f"\n{'='*80}")
-    print("COMBINANDO RESULTADOS")
-    print(f"{'='*80}")
-    
-    combined_results = pd.concat(all_results, ignore_index=True)
-    
-    # Crear directorio de resultados
-    results_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Guardar resultados completos
-    results_file = results_dir / f"anomalies_detected_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    combined_results.to_csv(results_file, index=False)
-    print(f"\n[OK] Resultados guardados en: {results_file}")
+    print(f"\n[OK] Resultados guardados en: {results_path} ({writer.rows:,} filas, {len(writer.dates)} fechas)")
     
-    # Generar resumen
-    summary = detector.get_anomaly_summary(combined_results)
-    summary_file = results_dir / f"anomaly_summary_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    # Generar resumen (solo se leen las columnas que usa)
+    summary_input = read_partitioned(results_path, columns=['variable', 'is_anomaly', 'anomaly_score', 'residual', 'y'])
+    summary = detector.get_anomaly_summary(summary_input)
+    summary_file = results_dir / f"anomaly_summary_{timestamp}.csv"
     summary.to_csv(summary_file, index=True)
     print(f"[OK] Resumen guardado en: {summary_file}")
     
@@ -129,35 +172,29 @@ def main():
     print(f"\n{'='*80}")
     print("RESUMEN DE ANOMALÍAS")
     print(f"{'='*80}")
-    print(f"\nTotal de puntos analizados: {len(combined_results):,}")
-    print(f"Total de anomalías detectadas: {combined_results['is_anomaly'].sum():,}")
-    print(f"Tasa de anomalías: {combined_results['is_anomaly'].mean()*100:.2f}%")
+    print(f"\nTotal de puntos analizados: {writer.rows:,}")
+    print(f"Total de anomalías detectadas: {anomalies_writer.rows:,}")
+    print(f"Tasa de anomalías: {anomalies_writer.rows / writer.rows * 100:.2f}%")
     
     print(f"\nTop 10 variables con más anomalías:")
     print(summary.head(10).to_string())
     
     # Anomalías por fecha
-    anomalies_by_date = combined_results[combined_results['is_anomaly']].groupby(
-        pd.to_datetime(combined_results[combined_results['is_anomaly']]['ds']).dt.date
-    ).size().sort_values(ascending=False)
+    anomalies_by_date = anomalies_by_date.astype(np.int64).sort_values(ascending=False)
     
     print(f"\nTop 10 fechas con más anomalías:")
     for date, count in anomalies_by_date.head(10).items():
         print(f"  {date}: {count} anomalías")
     
-    # Guardar solo anomalías
-    anomalies_only = combined_results[combined_results['is_anomaly']].copy()
-    if len(anomalies_only) > 0:
-        anomalies_file = results_dir / f"anomalies_only_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        anomalies_only.to_csv(anomalies_file, index=False)
-        print(f"\n[OK] Solo anomalias guardadas en: {anomalies_file}")
-        print(f"  Total: {len(anomalies_only)} registros anomalos")
+    if anomalies_writer.rows > 0:
+        print(f"\n[OK] Solo anomalias guardadas en: {anomalies_path}")
+        print(f"  Total: {anomalies_writer.rows} registros anomalos")
     
     print(f"\n{'='*80}")
     print("PROCESO COMPLETADO")
     print(f"{'='*80}")
     print(f"\nArchivos generados en: {results_dir}")
-    print(f"  - Resultados completos")
+    print(f"  - Resultados completos (particionados por fecha, {args.format})")
     print(f"  - Resumen por variable")
     print(f"  - Solo anomalías")
 
@@ -0,0 +1,278 @@
+"""
+Cache de pronósticos precalculados por variable
+
+Los timestamps de `dbo.ypf_process_data` llegan en una grilla fija y los
+modelos solo cambian con el reentrenamiento nocturno, así que `yhat`,
+`yhat_lower` y `yhat_upper` de las próximas horas se pueden calcular una
+vez por modelo y servir luego con una búsqueda por índice en arrays.
+
+Para cada variable se guarda una ventana [inicio, inicio + horizonte) sobre
+la grilla del modelo. Los timestamps que caen en la grilla y dentro de la
+ventana se resuelven por lookup; el resto usa la predicción normal. Un hilo
+en segundo plano recalcula la ventana antes de que se agote el horizonte.
+
+Con modelos cargados bajo demanda (LazyModelRegistry) solo se precalculan las
+variables que ya están en memoria, es decir las puntuadas hace poco: recorrer
+todo el registro cargaría cada modelo y expulsaría el conjunto de trabajo. Una
+variable que entra al registro se agrega en el siguiente refresco.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+
+class _CacheEntry:
+    """Ventana precalculada de una variable sobre una grilla regular."""
+
+    __slots__ = ('generation', 'start_ns', 'step_ns', 'yhat', 'yhat_lower', 'yhat_upper')
+
+    def __init__(self, generation: int, start_ns: int, step_ns: int,
+                 yhat: np.ndarray, yhat_lower: np.ndarray, yhat_upper: np.ndarray):
+        self.generation = generation
+        self.start_ns = start_ns
+        self.step_ns = step_ns
+        self.yhat = yhat
+        self.yhat_lower = yhat_lower
+        self.yhat_upper = yhat_upper
+
+    @property
+    def end(self) -> pd.Timestamp:
+        return pd.Timestamp(self.start_ns + self.step_ns * len(self.yhat))
+
+
+class ForecastCache:
+    """
+    Cache de pronósticos con horizonte móvil para un ProphetAnomalyDetector.
+    """
+
+    def __init__(self,
+                 detector,
+                 horizon_hours: float = 24,
+                 lookback_hours: float = 2,
+                 refresh_margin_hours: float = 2,
+                 freq: Optional[str] = None):
+        """
+        Parámetros:
+        -----------
+        detector : ProphetAnomalyDetector
+            Detector con los modelos cargados
+        horizon_hours : float
+            Horas hacia adelante a precalcular desde el momento de construcción
+        lookback_hours : float
+            Horas hacia atrás incluidas en la ventana (datos que llegan con retraso)
+        refresh_margin_hours : float
+            Se recalcula una variable cuando le quedan menos de estas horas de horizonte
+        freq : Optional[str]
+            Paso de la grilla (p.ej. '1min'). None = inferido del historial de cada modelo
+        """
+        self.detector = detector
+        self.horizon = pd.Timedelta(hours=horizon_hours)
+        self.lookback = pd.Timedelta(hours=lookback_hours)
+        self.refresh_margin = pd.Timedelta(hours=refresh_margin_hours)
+        self.freq = pd.Timedelta(freq) if freq else None
+
+        self._entries: Dict[str, _CacheEntry] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def _grid_step(self, model) -> pd.Timedelta:
+        """Paso de la grilla: el configurado, el guardado en el modelo o la mediana del historial."""
+        if self.freq is not None:
+            return self.freq
+        if getattr(model, 'freq', None) is not None:
+            return model.freq
+        history = getattr(model, 'history', None)
+        if history is None or len(history) < 2:
+            raise ValueError("No se puede inferir la frecuencia sin historial; especifica freq")
+        step = pd.Timedelta(np.median(np.diff(history['ds'].values)))
+        if step <= pd.Timedelta(0):
+            raise ValueError("Frecuencia inválida en el historial del modelo")
+        return step
+
+    @staticmethod
+    def _grid_anchor(model) -> pd.Timestamp:
+        """Un punto de la grilla del modelo: el último timestamp de entrenamiento."""
+        if getattr(model, 'history_end', None) is not None:
+            return model.history_end
+        history = getattr(model, 'history', None)
+        if history is not None and len(history) > 0:
+            return pd.Timestamp(history['ds'].iloc[-1])
+        return pd.Timestamp(0)
+
+    def _cached_variables(self) -> List[str]:
+        """Variables a mantener: las que están en memoria (todas si no hay carga bajo demanda)."""
+        models = self.detector.models
+        if hasattr(models, 'loaded'):
+            return models.loaded
+        return list(models.keys())
+
+    def _model(self, variable: str):
+        """Modelo de la variable sin cargarlo si el registro es bajo demanda (None si no está en memoria)."""
+        models = self.detector.models
+        if hasattr(models, 'peek'):
+            return models.peek(variable)
+        return models.get(variable)
+
+    def build(self,
+              variables: Optional[List[str]] = None,
+              now: Optional[datetime] = None,
+              verbose: bool = True) -> int:
+        """
+        Precalcula la ventana de las variables indicadas.
+
+        Parámetros:
+        -----------
+        variables : Optional[List[str]]
+            Variables a precalcular (None = todos los modelos en memoria); las que
+            no están en memoria se omiten
+        now : Optional[datetime]
+            Referencia temporal (default: ahora)
+        verbose : bool
+            Si mostrar el resumen
+
+        Retorna:
+        --------
+        int : Número de variables precalculadas
+        """
+        if variables is None:
+            variables = self._cached_variables()
+        now = pd.Timestamp(now if now is not None else datetime.now())
+        generation = self.detector.models_generation
+
+        built = 0
+        for var in variables:
+            model = self._model(var)
+            if model is None:
+                continue
+            try:
+                step = self._grid_step(model)
+                # Alinear el inicio a la grilla del modelo
+                anchor = self._grid_anchor(model)
+                start = anchor + ((now - self.lookback - anchor) // step) * step
+                grid = pd.date_range(start, start + self.lookback + self.horizon, freq=step, inclusive='left')
+
+                forecast = self.detector._predict_uncached(model, var, pd.DataFrame({'ds': grid}))
+                entry = _CacheEntry(
+                    generation=generation,
+                    start_ns=start.value,
+                    step_ns=step.value,
+                    yhat=forecast['yhat'].to_numpy(dtype=float),
+                    yhat_lower=forecast['yhat_lower'].to_numpy(dtype=float),
+                    yhat_upper=forecast['yhat_upper'].to_numpy(dtype=float)
+                )
+                with self._lock:
+                    self._entries[var] = entry
+                built += 1
+            except Exception as e:
+                if verbose:
+                    print(f"  [ADVERTENCIA] {var}: no se pudo precalcular el pronóstico ({str(e)})")
+
+        if verbose:
+            print(f"Cache de pronósticos: {built}/{len(variables)} variables, "
+                  f"horizonte {self.horizon}")
+        return built
+
+    def refresh_expiring(self, now: Optional[datetime] = None, verbose: bool = False) -> int:
+        """Recalcula las variables cuyo horizonte restante es menor que el margen."""
+        now = pd.Timestamp(now if now is not None else datetime.now())
+        with self._lock:
+            entries = dict(self._entries)
+        current = self._cached_variables()
+        in_memory = set(current)
+        expiring = [var for var, entry in entries.items()
+                    if var in in_memory and (entry.end - now < self.refresh_margin
+                                             or entry.generation != self.detector.models_generation)]
+        missing = [var for var in current if var not in entries]
+        to_build = expiring + missing
+        if not to_build:
+            return 0
+        return self.build(to_build, now=now, verbose=verbose)
+
+    def predict(self,
+                variable: str,
+                ds: pd.Series,
+                fallback: Callable[[pd.DataFrame], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Retorna yhat/yhat_lower/yhat_upper para `ds`, desde el cache cuando es posible.
+
+        Los timestamps fuera de la ventana o de la grilla se calculan con `fallback`,
+        que recibe un DataFrame con la columna 'ds'.
+        """
+        ds = pd.to_datetime(pd.Series(ds)).reset_index(drop=True)
+        n = len(ds)
+        yhat = np.full(n, np.nan)
+        yhat_lower = np.full(n, np.nan)
+        yhat_upper = np.full(n, np.nan)
+        hit = np.zeros(n, dtype=bool)
+
+        with self._lock:
+            entry = self._entries.get(variable)
+
+        # Las ventanas calculadas con modelos anteriores a una recarga no se usan
+        if entry is not None and entry.generation == self.detector.models_generation:
+            offset = ds.values.astype('datetime64[ns]').astype(np.int64) - entry.start_ns
+            idx, remainder = np.divmod(offset, entry.step_ns)
+            hit = (remainder == 0) & (idx >= 0) & (idx < len(entry.yhat))
+            idx_hit = idx[hit]
+            yhat[hit] = entry.yhat[idx_hit]
+            yhat_lower[hit] = entry.yhat_lower[idx_hit]
+            yhat_upper[hit] = entry.yhat_upper[idx_hit]
+
+        n_hit = int(hit.sum())
+        with self._lock:
+            self.hits += n_hit
+            self.misses += n - n_hit
+
+        if n_hit < n:
+            miss = ~hit
+            forecast = fallback(pd.DataFrame({'ds': ds[miss].values}))
+            yhat[miss] = forecast['yhat'].values
+            yhat_lower[miss] = forecast['yhat_lower'].values
+            yhat_upper[miss] = forecast['yhat_upper'].values
+
+        return pd.DataFrame({
+            'ds': ds.values,
+            'yhat': yhat,
+            'yhat_lower': yhat_lower,
+            'yhat_upper': yhat_upper
+        })
+
+    def start_background_refresh(self, check_interval_seconds: float = 60):
+        """Inicia un hilo que mantiene el horizonte precalculado."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+
+        def _loop():
+            while not self._stop_event.wait(check_interval_seconds):
+                try:
+                    self.refresh_expiring()
+                except Exception as e:
+                    print(f"[ERROR] Error refrescando cache de pronósticos: {str(e)}")
+
+        self._thread = threading.Thread(target=_loop, name='forecast-cache-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detiene el hilo de refresco."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> Dict:
+        """Contadores de uso del cache."""
+        total = self.hits + self.misses
+        return {
+            'variables': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -0,0 +1,192 @@
+"""
+Métricas de evaluación por variable en una sola pasada
+
+`evaluar_modelo` filtraba los resultados una vez por variable
+(`results[results['variable'] == var]`, O(variables x filas)) y calculaba cada
+métrica con una función aparte. Aquí las filas se agrupan una sola vez por
+variable (tramos contiguos con sus offsets; si los resultados vienen de
+detect_anomalies_multiple ya están contiguos y no hace falta ordenar) y cada
+suma por variable es un `np.add.reduceat` sobre el arreglo completo.
+
+Las métricas son las mismas que antes (ver `METRIC_COLUMNS`):
+- mae, rmse, mape, r2: sobre los puntos con y e yhat finitos; mape excluye
+  |y| <= 1e-10; r2 como sklearn (1 si la predicción es exacta con y constante,
+  0 si no lo es, NaN con menos de 2 puntos)
+- interval_coverage_pct, n_outside_interval: sobre los puntos con y y límites finitos
+- residual_mean, residual_std (ddof=0), residual_median: sobre residuales finitos
+- n_anomalies, anomaly_rate_pct, avg_anomaly_score (0 sin anomalías), max_anomaly_score
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pipeline.scripts.compact_results import CompactResults
+
+METRIC_COLUMNS = ['variable', 'n_points', 'mae', 'rmse', 'mape', 'r2',
+                  'interval_coverage_pct', 'n_outside_interval',
+                  'residual_mean', 'residual_std', 'residual_median',
+                  'n_anomalies', 'anomaly_rate_pct', 'avg_anomaly_score', 'max_anomaly_score']
+
+_INPUT_COLUMNS = ['y', 'yhat', 'yhat_lower', 'yhat_upper', 'residual', 'anomaly_score']
+
+
+def _group_sum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Suma por tramo (todos los tramos tienen al menos una fila)"""
+    return np.add.reduceat(values, starts)
+
+
+def _divide(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    """num / den, NaN donde den = 0"""
+    out = np.full(len(num), np.nan)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def _grouped_median(values: np.ndarray, valid: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """Mediana de los valores válidos de cada grupo, con un solo ordenamiento"""
+    counts = np.bincount(codes[valid], minlength=n_groups)
+    # Orden por (grupo, valor): dentro de cada grupo los válidos quedan primero y ordenados.
+    # Ordenar por valor y después por grupo con un sort estable es ~4x más rápido que
+    # np.lexsort; con códigos de 16 bits el segundo sort es radix.
+    keys = np.where(valid, values, np.inf)
+    order = np.argsort(keys)
+    code_dtype = np.int16 if n_groups <= np.iinfo(np.int16).max else codes.dtype
+    order = order[np.argsort(codes.astype(code_dtype)[order], kind='stable')]
+    sorted_values = keys[order]
+    starts = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n_groups))[:-1]])
+
+    out = np.full(n_groups, np.nan)
+    has = counts > 0
+    lo = starts[has] + (counts[has] - 1) // 2
+    hi = starts[has] + counts[has] // 2
+    out[has] = (sorted_values[lo] + sorted_values[hi]) / 2
+    return out
+
+
+def _from_frame(results: pd.DataFrame) -> Tuple:
+    """Arreglos de entrada agrupados en tramos contiguos por variable"""
+    codes, names = pd.factorize(results['variable'], sort=False)
+    codes = codes.astype(np.int64)
+    names = list(names)
+    data = {col: results[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in _INPUT_COLUMNS}
+    data['is_anomaly'] = results['is_anomaly'].to_numpy(dtype=bool)
+
+    # Solo se ordena si las filas de una variable no están ya juntas
+    if len(codes) > 1 and (np.diff(codes) < 0).any():
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        data = {col: values[order] for col, values in data.items()}
+    counts = np.bincount(codes, minlength=len(names))
+    return names, counts, codes, data
+
+
+def _from_compact(results: CompactResults) -> Tuple:
+    counts = np.diff(results.offsets)
+    keep = counts > 0
+    names = [var for var, k in zip(results.variables, keep) if k]
+    counts = counts[keep]
+    codes = np.repeat(np.arange(len(names), dtype=np.int64), counts)
+    data = {col: results.measures[col].astype(np.float64) for col in _INPUT_COLUMNS}
+    data['is_anomaly'] = results.flag('is_anomaly')
+    return names, counts, codes, data
+
+
+def grouped_metrics(results, variables: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Métricas de predicción, cobertura, residuales y anomalías de todas las variables
+
+    Parámetros:
+    -----------
+    results : pd.DataFrame o CompactResults
+        Resultados de detect_anomalies_multiple (columnas variable, y, yhat,
+        yhat_lower, yhat_upper, residual, is_anomaly, anomaly_score)
+    variables : Optional[Sequence[str]]
+        Orden de las filas del resultado (None = orden de aparición); las
+        variables sin resultados se omiten
+
+    Retorna:
+    --------
+    pd.DataFrame : Una fila por variable con las columnas de METRIC_COLUMNS
+    """
+    if isinstance(results, CompactResults):
+        names, counts, codes, data = _from_compact(results)
+    else:
+        names, counts, codes, data = _from_frame(results)
+
+    if len(names) == 0:
+        return pd.DataFrame(columns=METRIC_COLUMNS)
+
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    n_groups = len(names)
+    y, yhat = data['y'], data['yhat']
+    lower, upper = data['yhat_lower'], data['yhat_upper']
+    residual, score, is_anomaly = data['residual'], data['anomaly_score'], data['is_anomaly']
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Predicción
+        pred_ok = np.isfinite(y) & np.isfinite(yhat)
+        n_pred = _group_sum(pred_ok.astype(np.int64), starts)
+        error = np.where(pred_ok, y - yhat, 0.0)
+        mae = _divide(_group_sum(np.abs(error), starts), n_pred)
+        ss_res = _group_sum(error * error, starts)
+        rmse = np.sqrt(_divide(ss_res, n_pred))
+
+        nonzero = pred_ok & (np.abs(y) > 1e-10)
+        ape = np.where(nonzero, np.abs(error / np.where(nonzero, y, 1.0)), 0.0)
+        mape = _divide(_group_sum(ape, starts), _group_sum(nonzero.astype(np.int64), starts)) * 100
+
+        y_ok = np.where(pred_ok, y, 0.0)
+        y_mean = _divide(_group_sum(y_ok, starts), n_pred)
+        y_dev = np.where(pred_ok, y - np.repeat(y_mean, counts), 0.0)
+        ss_tot = _group_sum(y_dev * y_dev, starts)
+        r2 = np.where(ss_tot > 0, 1 - ss_res / np.where(ss_tot > 0, ss_tot, 1.0),
+                      np.where(ss_res == 0, 1.0, 0.0))
+        r2[n_pred < 2] = np.nan
+
+        # Cobertura del intervalo
+        interval_ok = np.isfinite(y) & np.isfinite(lower) & np.isfinite(upper)
+        n_interval = _group_sum(interval_ok.astype(np.int64), starts)
+        inside = interval_ok & (y >= lower) & (y <= upper)
+        n_inside = _group_sum(inside.astype(np.int64), starts)
+        coverage = _divide(n_inside.astype(np.float64), n_interval) * 100
+
+        # Residuales
+        res_ok = np.isfinite(residual)
+        n_res = _group_sum(res_ok.astype(np.int64), starts)
+        res_mean = _divide(_group_sum(np.where(res_ok, residual, 0.0), starts), n_res)
+        res_dev = np.where(res_ok, residual - np.repeat(res_mean, counts), 0.0)
+        res_std = np.sqrt(_divide(_group_sum(res_dev * res_dev, starts), n_res))
+        res_median = _grouped_median(residual, res_ok, codes, n_groups)
+
+        # Anomalías (los scores NaN se ignoran, como en pandas)
+        n_anomalies = _group_sum(is_anomaly.astype(np.int64), starts)
+        scored = is_anomaly & ~np.isnan(score)
+        avg_score = _divide(_group_sum(np.where(scored, score, 0.0), starts),
+                            _group_sum(scored.astype(np.int64), starts))
+        avg_score[n_anomalies == 0] = 0
+        max_score = np.fmax.reduceat(score, starts)
+
+    metrics = pd.DataFrame({
+        'variable': names,
+        'n_points': counts,
+        'mae': mae,
+        'rmse': rmse,
+        'mape': mape,
+        'r2': r2,
+        'interval_coverage_pct': coverage,
+        'n_outside_interval': n_interval - n_inside,
+        'residual_mean': res_mean,
+        'residual_std': res_std,
+        'residual_median': res_median,
+        'n_anomalies': n_anomalies,
+        'anomaly_rate_pct': n_anomalies / counts * 100,
+        'avg_anomaly_score': avg_score,
+        'max_anomaly_score': max_score
+    }, columns=METRIC_COLUMNS)
+
+    if variables is not None:
+        position = {var: i for i, var in enumerate(names)}
+        metrics = metrics.iloc[[position[var] for var in variables if var in position]].reset_index(drop=True)
+    return metrics
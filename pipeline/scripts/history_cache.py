@@ -0,0 +1,396 @@
+"""
+Cache local del historial en formato ancho
+
+Cada entrenamiento (train_from_sql.py, worker_reentrenamiento.py) y cada
+detección sobre el historial (detect_from_sql.py) vuelve a leer todo
+dbo.ypf_process_data y a pivotearlo en memoria. Este cache guarda la matriz ya
+pivoteada en disco, particionada por mes, y solo trae de SQL Server lo que
+falta después de la última fecha cargada.
+
+Estructura de `cache_dir`:
+
+    manifest.json                        variables (en orden de llegada), marca de
+                                         agua y particiones vigentes
+    <YYYY-MM>.<gen>.ts.npy               datetimes de la partición (datetime64[ns], ordenados)
+    <YYYY-MM>.<gen>.values.npy           matriz filas x variables conocidas al escribirla
+
+Las particiones se leen con memoria mapeada (np.load(mmap_mode='r')): leer un
+rango de fechas o un subconjunto de variables solo toca esas páginas del disco,
+y una lectura de una sola partición con todas sus variables no copia nada.
+
+Cada actualización vuelve a leer las últimas `overlap_hours` antes de la marca
+(DEFAULT_OVERLAP_HOURS) y reemplaza esas filas: los valores de variables que
+reportan tarde, con un datetime ya cargado, no quedan fuera del cache.
+
+Al actualizar, las particiones modificadas se escriben con un número de
+generación nuevo y el manifiesto se reemplaza al final, así que un proceso que
+está leyendo sigue viendo una versión completa.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from pipeline.scripts.wide_pivot import LongToWidePivot
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Horas antes de la marca de agua que se releen en cada actualización
+DEFAULT_OVERLAP_HOURS = 24.0
+
+
+class HistoryCache:
+    """
+    Historial pivoteado en disco, actualizable desde SQL
+
+    Uso:
+        cache = HistoryCache('pipeline/cache/history')
+        cache.sync(sql_conn)                       # lee de SQL desde la marca (menos el solapamiento)
+        df = cache.read(start='2024-10-01')        # DATETIME + una columna por variable
+    """
+
+    def __init__(self, cache_dir: str = "pipeline/cache/history", dtype=np.float64):
+        """
+        Parámetros:
+        -----------
+        cache_dir : str
+            Directorio del cache (se crea si no existe)
+        dtype : numpy dtype
+            Tipo de los valores guardados (np.float32 reduce el disco a la mitad)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.manifest = self._load_manifest()
+
+    # --- Manifiesto ---
+
+    def _load_manifest(self) -> Dict:
+        path = self.cache_dir / MANIFEST_FILENAME
+        if not path.exists():
+            return {'variables': [], 'watermark': None, 'generation': 0, 'partitions': {}}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict):
+        path = self.cache_dir / MANIFEST_FILENAME
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, path)
+
+    @property
+    def variables(self) -> List[str]:
+        return list(self.manifest['variables'])
+
+    @property
+    def watermark(self) -> Optional[pd.Timestamp]:
+        """Último datetime cargado (None si el cache está vacío)"""
+        mark = self.manifest['watermark']
+        return pd.Timestamp(mark) if mark is not None else None
+
+    @property
+    def n_rows(self) -> int:
+        return sum(part['rows'] for part in self.manifest['partitions'].values())
+
+    # --- Particiones ---
+
+    def _partition_arrays(self, name: str, mmap: bool = True):
+        """(datetimes, valores) de una partición, mapeados en memoria"""
+        part = self.manifest['partitions'][name]
+        mode = 'r' if mmap else None
+        ts = np.load(self.cache_dir / part['ts'], mmap_mode=mode)
+        values = np.load(self.cache_dir / part['values'], mmap_mode=mode)
+        return ts, values
+
+    def _write_partition(self, name: str, generation: int, ts: np.ndarray, values: np.ndarray) -> Dict:
+        files = {}
+        for kind, array in (('ts', ts), ('values', values)):
+            filename = f"{name}.{generation}.{kind}.npy"
+            tmp = self.cache_dir / f".{filename}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp, self.cache_dir / filename)
+            files[kind] = filename
+        return {'ts': files['ts'], 'values': files['values'], 'rows': len(ts), 'cols': values.shape[1],
+                'start': str(pd.Timestamp(ts[0])), 'end': str(pd.Timestamp(ts[-1]))}
+
+    def _remove_files(self, filenames: Sequence[str]):
+        for filename in filenames:
+            try:
+                (self.cache_dir / filename).unlink()
+            except OSError:
+                # p.ej. en Windows mientras otro proceso lo tiene mapeado; se limpia en la próxima escritura
+                pass
+
+    def _remove_orphans(self):
+        """Elimina archivos de generaciones anteriores que ya no están en el manifiesto"""
+        current = {f for part in self.manifest['partitions'].values() for f in (part['ts'], part['values'])}
+        orphans = []
+        for path in self.cache_dir.glob('*.npy'):
+            parts = path.name.split('.')
+            # Solo generaciones anteriores: las más nuevas pueden ser de otro proceso escribiendo
+            if path.name not in current and len(parts) == 4 and parts[1].isdigit() \
+                    and int(parts[1]) < self.manifest['generation']:
+                orphans.append(path.name)
+        self._remove_files(orphans)
+
+    # --- Escritura ---
+
+    def append(self, df_wide: pd.DataFrame, replace_after=None) -> int:
+        """
+        Agrega filas en formato ancho (índice datetime, una columna por variable)
+
+        Parámetros:
+        -----------
+        df_wide : pd.DataFrame
+            Filas nuevas, p.ej. el resultado de LongToWidePivot.result()
+        replace_after : datetime, optional
+            Las filas ya guardadas posteriores a esta fecha se descartan y quedan
+            las de `df_wide` (para releer un tramo reciente con datos que llegaron tarde).
+            Por defecto, la marca de agua actual.
+
+        Retorna:
+        --------
+        int: Filas agregadas
+        """
+        if df_wide is None or len(df_wide) == 0:
+            return 0
+
+        manifest = json.loads(json.dumps(self.manifest))
+        ts_new = pd.to_datetime(df_wide.index).to_numpy(dtype='datetime64[ns]')
+        order = np.argsort(ts_new, kind='stable')
+        ts_new = ts_new[order]
+        values_new = df_wide.to_numpy(dtype=self.dtype, na_value=np.nan)[order]
+
+        if replace_after is None:
+            replace_after = manifest['watermark']
+        cutoff = np.datetime64(pd.Timestamp(replace_after), 'ns') if replace_after is not None else None
+        if cutoff is not None:
+            keep = ts_new > cutoff
+            ts_new, values_new = ts_new[keep], values_new[keep]
+        if len(ts_new) == 0:
+            return 0
+
+        # Las variables nuevas se agregan al final: las particiones anteriores no se reescriben
+        positions = {var: i for i, var in enumerate(manifest['variables'])}
+        for var in df_wide.columns:
+            if var not in positions:
+                positions[var] = len(manifest['variables'])
+                manifest['variables'].append(var)
+        columns = np.array([positions[var] for var in df_wide.columns], dtype=np.int64)
+        n_cols = len(manifest['variables'])
+
+        months_new = ts_new.astype('datetime64[M]')
+        affected = set(np.unique(months_new).astype(str))
+        if cutoff is not None:
+            affected |= {name for name, part in manifest['partitions'].items()
+                         if np.datetime64(pd.Timestamp(part['end']), 'ns') > cutoff}
+
+        generation = manifest['generation'] + 1
+        old_files = []
+        for name in sorted(affected):
+            parts_ts, parts_values = [], []
+            if name in manifest['partitions']:
+                ts_old, values_old = self._partition_arrays(name)
+                n_keep = len(ts_old) if cutoff is None else int(np.searchsorted(ts_old, cutoff, side='right'))
+                block = np.full((n_keep, n_cols), np.nan, dtype=self.dtype)
+                block[:, :values_old.shape[1]] = values_old[:n_keep]
+                parts_ts.append(np.array(ts_old[:n_keep]))
+                parts_values.append(block)
+                old_files += [manifest['partitions'][name]['ts'], manifest['partitions'][name]['values']]
+                del ts_old, values_old
+
+            in_month = months_new == np.datetime64(name, 'M')
+            if in_month.any():
+                block = np.full((int(in_month.sum()), n_cols), np.nan, dtype=self.dtype)
+                block[:, columns] = values_new[in_month]
+                parts_ts.append(ts_new[in_month])
+                parts_values.append(block)
+
+            ts = np.concatenate(parts_ts) if parts_ts else np.empty(0, dtype='datetime64[ns]')
+            if len(ts) == 0:
+                manifest['partitions'].pop(name, None)
+                continue
+            manifest['partitions'][name] = self._write_partition(name, generation, ts, np.concatenate(parts_values))
+
+        last = max(np.datetime64(pd.Timestamp(part['end']), 'ns') for part in manifest['partitions'].values())
+        manifest['watermark'] = str(pd.Timestamp(last))
+        manifest['generation'] = generation
+        manifest['updated_at'] = time.time()
+        self._write_manifest(manifest)
+        self.manifest = manifest
+        self._remove_files(old_files)
+        return len(ts_new)
+
+    def sync(self, sql_conn, overlap_hours: float = DEFAULT_OVERLAP_HOURS, chunk_size: int = 500000,
+             table: str = "dbo.ypf_process_data", verbose: bool = True) -> int:
+        """
+        Trae de SQL las filas desde la marca de agua (todo, si el cache está vacío)
+
+        Las filas desde `marca - overlap_hours` (inclusive) se vuelven a leer y
+        reemplazan a las guardadas, así se completan los datetimes a los que les
+        faltaban valores de variables que reportaron tarde.
+
+        Parámetros:
+        -----------
+        sql_conn : SQLConnection
+            Conexión a la base de datos de entrada
+        overlap_hours : float
+            Horas anteriores a la marca que se releen (default: DEFAULT_OVERLAP_HOURS;
+            0 = releer solo el datetime de la marca)
+        chunk_size : int
+            Filas leídas de SQL por bloque (default: 500000)
+
+        Retorna:
+        --------
+        int: Filas (datetimes) agregadas o reemplazadas en el cache
+        """
+        since = self.watermark
+        if since is not None and overlap_hours > 0:
+            since = since - pd.Timedelta(hours=overlap_hours)
+
+        query = f"SELECT datetime, variable_name, value FROM {table}"
+        if since is not None:
+            query += f" WHERE datetime >= '{since.strftime('%Y-%m-%d %H:%M:%S')}'"
+        query += " ORDER BY datetime, variable_name"
+
+        if verbose:
+            print(f"  [INFO] Actualizando cache de historial desde {since if since is not None else 'el inicio'}...")
+
+        pivot = LongToWidePivot(dtype=self.dtype)
+        for chunk in sql_conn.execute_query_chunked(query, chunk_size, dtypes={'value': 'float64'}):
+            pivot.add(chunk)
+
+        # Se reemplazan las filas guardadas desde `since` inclusive (las releídas)
+        replace_after = since - pd.Timedelta(1, 'ns') if since is not None else None
+        added = self.append(pivot.result(), replace_after=replace_after) if pivot.n_rows > 0 else 0
+        self._remove_orphans()
+        if verbose:
+            print(f"  [OK] Cache de historial: {pivot.n_rows:,} filas leídas de SQL, {added:,} datetimes escritos "
+                  f"({self.n_rows:,} en total, hasta {self.watermark})")
+        return added
+
+    # --- Lectura ---
+
+    def read(self, start=None, end=None, variables: Optional[Sequence[str]] = None,
+             datetime_col: str = 'DATETIME') -> pd.DataFrame:
+        """
+        Lee el historial en formato ancho, como read_data_from_sql
+
+        Parámetros:
+        -----------
+        start, end : datetime o str, optional
+            Rango de fechas (ambos inclusive)
+        variables : Optional[Sequence[str]]
+            Variables a leer (None = todas); solo se leen esas columnas del disco
+        datetime_col : str
+            Nombre de la columna de fecha (default: DATETIME)
+
+        Retorna:
+        --------
+        pd.DataFrame con `datetime_col` y una columna por variable (ordenadas por nombre)
+        """
+        positions = {var: i for i, var in enumerate(self.manifest['variables'])}
+        if variables is None:
+            names = sorted(positions, key=str)
+        else:
+            names = [var for var in variables if var in positions]
+        wanted = np.array([positions[var] for var in names], dtype=np.int64)
+
+        lo_ts = np.datetime64(pd.Timestamp(start), 'ns') if start is not None else None
+        hi_ts = np.datetime64(pd.Timestamp(end), 'ns') if end is not None else None
+
+        slices = []
+        for name in sorted(self.manifest['partitions']):
+            part = self.manifest['partitions'][name]
+            if lo_ts is not None and np.datetime64(pd.Timestamp(part['end']), 'ns') < lo_ts:
+                continue
+            if hi_ts is not None and np.datetime64(pd.Timestamp(part['start']), 'ns') > hi_ts:
+                continue
+            ts, values = self._partition_arrays(name)
+            lo = int(np.searchsorted(ts, lo_ts, side='left')) if lo_ts is not None else 0
+            hi = int(np.searchsorted(ts, hi_ts, side='right')) if hi_ts is not None else len(ts)
+            if hi > lo:
+                slices.append((ts[lo:hi], values[lo:hi]))
+
+        if len(slices) == 1 and slices[0][1].shape[1] == len(positions) \
+                and np.array_equal(wanted, np.arange(len(positions))):
+            # Una partición con todas las variables en su orden: vista directa del archivo
+            matrix = slices[0][1]
+        else:
+            n_rows = sum(len(ts) for ts, _ in slices)
+            matrix = np.full((n_rows, len(wanted)), np.nan, dtype=self.dtype)
+            row = 0
+            for ts, values in slices:
+                present = wanted < values.shape[1]
+                matrix[row:row + len(ts), present] = values[:, wanted[present]]
+                row += len(ts)
+
+        ts_all = np.concatenate([np.asarray(ts) for ts, _ in slices]) if slices \
+            else np.empty(0, dtype='datetime64[ns]')
+        df = pd.DataFrame(matrix, columns=pd.Index(names), copy=False)
+        df.insert(0, datetime_col, ts_all)
+        return df
+
+    def info(self) -> Dict:
+        """Resumen del cache (particiones, filas, variables, tamaño en disco)"""
+        size = sum((self.cache_dir / f).stat().st_size
+                   for part in self.manifest['partitions'].values() for f in (part['ts'], part['values']))
+        return {
+            'partitions': len(self.manifest['partitions']),
+            'rows': self.n_rows,
+            'variables': len(self.manifest['variables']),
+            'watermark': self.watermark,
+            'bytes': size
+        }
+
+
+def read_history(sql_conn, cache_dir: str, start_date: str = None, end_date: str = None,
+                 overlap_hours: float = DEFAULT_OVERLAP_HOURS, chunk_size: int = 500000) -> Optional[pd.DataFrame]:
+    """
+    Actualiza el cache con lo que falta en SQL y retorna el historial en formato ancho
+
+    Reemplaza a read_data_from_sql en los scripts que aceptan --history-cache.
+
+    Parámetros:
+    -----------
+    sql_conn : SQLConnection o None
+        Conexión de entrada; None = usar el cache sin actualizarlo
+    cache_dir : str
+        Directorio del cache
+    start_date, end_date : str
+        Rango de fechas (opcional, formato: 'YYYY-MM-DD')
+    overlap_hours : float
+        Horas anteriores a la marca del cache que se releen de SQL, por datos que
+        llegan tarde (default: DEFAULT_OVERLAP_HOURS)
+    chunk_size : int
+        Filas leídas de SQL por bloque
+
+    Retorna:
+    --------
+    pd.DataFrame en formato ancho (DATETIME + variables en columnas), o None si no hay datos
+    """
+    cache = HistoryCache(cache_dir)
+    if sql_conn is not None:
+        try:
+            cache.sync(sql_conn, overlap_hours=overlap_hours, chunk_size=chunk_size)
+        except Exception as e:
+            if cache.n_rows == 0:
+                print(f"[ERROR] No se pudo cargar el cache de historial: {str(e)}")
+                return None
+            print(f"[ADVERTENCIA] No se pudo actualizar el cache de historial ({str(e)}); "
+                  f"se usan los datos hasta {cache.watermark}")
+
+    df_wide = cache.read(start_date, end_date)
+    if len(df_wide) == 0:
+        print("[ERROR] No hay datos en el cache de historial para el rango pedido")
+        return None
+
+    print(f"  Dimensiones: {df_wide.shape[0]} filas x {df_wide.shape[1]} columnas (cache {cache_dir})")
+    return df_wide
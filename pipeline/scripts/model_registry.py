@@ -0,0 +1,179 @@
+"""
+Registro de modelos con carga bajo demanda y cache LRU
+
+`load_models` carga todos los modelos en memoria al inicio, aunque cada ciclo
+del worker solo ve las variables presentes en los datos nuevos. Este registro
+se comporta como el diccionario `detector.models` (claves, `in`, `[]`, `len`)
+pero solo lee un modelo la primera vez que se pide y mantiene en memoria un
+conjunto de trabajo acotado por cantidad de modelos y/o bytes, expulsando el
+usado menos recientemente.
+"""
+
+import pickle
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from pipeline.scripts.model_store import ModelStore, STORE_FILENAME, discover_pickle_models
+from pipeline.scripts.prophet_fast_predict import ARRAY_FIELDS
+
+
+# Tamaño aproximado de un predictor además de sus arrays (objeto y escalares)
+_PREDICTOR_OVERHEAD_BYTES = 1024
+
+
+class LazyModelRegistry(Mapping):
+    """
+    Mapeo variable -> modelo que carga bajo demanda con expulsión LRU.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 config_variables: Optional[List[str]] = None,
+                 variables: Optional[List[str]] = None,
+                 max_models: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 prefer_pickles: bool = False):
+        """
+        Parámetros:
+        -----------
+        directory : str
+            Directorio con los modelos (almacén compacto y/o pickles)
+        config_variables : Optional[List[str]]
+            Lista original de variables de detector_config.json
+        variables : Optional[List[str]]
+            Restringir el registro a estas variables (None = todas)
+        max_models : Optional[int]
+            Máximo de modelos en memoria (None = sin límite)
+        max_bytes : Optional[int]
+            Tamaño máximo aproximado de los modelos en memoria (None = sin límite).
+            Para pickles se usa el tamaño del archivo como estimación.
+        prefer_pickles : bool
+            Si usar el pickle del modelo Prophet cuando una variable está también
+            en el almacén compacto (para puntuar con Prophet.predict)
+        """
+        self.directory = Path(directory)
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+
+        self._store = None
+        store_path = self.directory / STORE_FILENAME
+        if store_path.exists():
+            self._store = ModelStore(store_path)
+
+        # Origen de cada variable: None = almacén compacto, Path = pickle
+        self._sources: Dict[str, Optional[Path]] = {}
+        if self._store is not None:
+            for var in self._store.variables:
+                self._sources[var] = None
+        for var, model_file in discover_pickle_models(self.directory, config_variables).items():
+            if prefer_pickles:
+                self._sources[var] = model_file
+            else:
+                self._sources.setdefault(var, model_file)
+        if variables is not None:
+            wanted = set(variables)
+            self._sources = {var: src for var, src in self._sources.items() if var in wanted}
+
+        self._cache: "OrderedDict[str, object]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, variable: str):
+        with self._lock:
+            if variable in self._cache:
+                self._cache.move_to_end(variable)
+                self.hits += 1
+                return self._cache[variable]
+            if variable not in self._sources:
+                raise KeyError(variable)
+
+            self.misses += 1
+            model, size = self._load(variable)
+            self._cache[variable] = model
+            self._sizes[variable] = size
+            self._bytes += size
+            self._evict(keep=variable)
+            return model
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._sources))
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def __contains__(self, variable) -> bool:
+        # Sin cargar el modelo (Mapping.__contains__ usaría __getitem__)
+        return variable in self._sources
+
+    def _load(self, variable: str):
+        """Lee un modelo de su origen y estima su tamaño en memoria."""
+        source = self._sources[variable]
+        if source is None:
+            predictor = self._store.load(variable)
+            size = _PREDICTOR_OVERHEAD_BYTES + sum(getattr(predictor, name).nbytes for name in ARRAY_FIELDS)
+            return predictor, size
+        with open(source, 'rb') as f:
+            model = pickle.load(f)
+        return model, source.stat().st_size
+
+    def _evict(self, keep: str):
+        """Expulsa los modelos menos usados hasta cumplir los límites."""
+        while len(self._cache) > 1:
+            over_count = self.max_models is not None and len(self._cache) > self.max_models
+            over_bytes = self.max_bytes is not None and self._bytes > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            oldest = next(iter(self._cache))
+            if oldest == keep:
+                break
+            del self._cache[oldest]
+            self._bytes -= self._sizes.pop(oldest)
+            self.evictions += 1
+
+    @property
+    def store_only(self) -> List[str]:
+        """Variables que se leen del almacén compacto (sin pickle del modelo Prophet)."""
+        return [var for var, source in self._sources.items() if source is None]
+
+    def peek(self, variable: str):
+        """Modelo si ya está en memoria (None si no), sin cargarlo ni cambiar el orden LRU."""
+        with self._lock:
+            return self._cache.get(variable)
+
+    @property
+    def loaded(self) -> List[str]:
+        """Variables actualmente en memoria, de la menos a la más reciente."""
+        with self._lock:
+            return list(self._cache)
+
+    def stats(self) -> Dict:
+        """Contadores del cache."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'registered': len(self._sources),
+                'loaded': len(self._cache),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+    def close(self):
+        """Vacía el cache y libera el almacén."""
+        with self._lock:
+            self._cache.clear()
+            self._sizes.clear()
+            self._bytes = 0
+            if self._store is not None:
+                self._store.close()
+                self._store = None
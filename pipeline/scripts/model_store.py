@@ -0,0 +1,184 @@
+"""
+Almacén compacto de modelos Prophet
+
+Los pickles de Prophet incluyen el DataFrame completo de entrenamiento, por lo
+que el directorio de modelos crece con el historial y el worker tarda en
+arrancar deserializando cientos de archivos. Este almacén guarda solo los
+parámetros que necesita `FastProphetPredictor` para puntuar, todos los
+modelos en un único archivo:
+
+    MAGIC | longitud del encabezado (uint64) | encabezado JSON | datos float64
+
+El encabezado es el índice: por variable contiene los parámetros escalares y
+la posición (offset, longitud) de cada array dentro del bloque de datos. El
+bloque se abre con `np.memmap`, de modo que leer una variable solo toca sus
+propios bytes y abrir el almacén solo lee el encabezado.
+"""
+
+import json
+import os
+import struct
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from pipeline.scripts.prophet_fast_predict import FastProphetPredictor, ARRAY_FIELDS
+
+
+STORE_FILENAME = "prophet_models.store"
+
+_MAGIC = b'YPFSTORE'
+_VERSION = 1
+_ALIGN = 8
+
+
+def safe_model_filename(var: str) -> str:
+    """Limpia el nombre de variable para usarlo en nombres de archivo."""
+    return var.replace('/', '_').replace('\\', '_').replace(' ', '_').replace('-', '_')
+
+
+def discover_pickle_models(directory: Path, config_variables: Optional[List[str]] = None) -> Dict[str, Path]:
+    """
+    Localiza los modelos guardados como `prophet_model_<var>.pkl`.
+
+    El nombre de archivo pierde caracteres especiales; si se conoce la lista
+    original de variables (detector_config.json) se usa para recuperarlos.
+
+    Retorna:
+    --------
+    Dict[str, Path] : Ruta del pickle por nombre de variable
+    """
+    safe_names = {safe_model_filename(v): v for v in (config_variables or [])}
+    found = {}
+    for model_file in sorted(Path(directory).glob("prophet_model_*.pkl")):
+        safe_name = model_file.stem.replace("prophet_model_", "")
+        found[safe_names.get(safe_name, safe_name.replace("_", "/"))] = model_file
+    return found
+
+
+class ModelStore:
+    """
+    Lector de un almacén de modelos con carga perezosa por variable.
+
+    Uso:
+        store = ModelStore(path)
+        predictor = store.load('TI-101')
+    """
+
+    def __init__(self, path: str):
+        """
+        Parámetros:
+        -----------
+        path : str
+            Ruta del archivo del almacén
+        """
+        self.path = Path(path)
+
+        with open(self.path, 'rb') as f:
+            magic = f.read(len(_MAGIC))
+            if magic != _MAGIC:
+                raise ValueError(f"{self.path} no es un almacén de modelos válido")
+            (header_len,) = struct.unpack('<Q', f.read(8))
+            self.header = json.loads(f.read(header_len).decode('utf-8'))
+
+        if self.header.get('version') != _VERSION:
+            raise ValueError(f"Versión de almacén no soportada: {self.header.get('version')}")
+
+        self._index: Dict[str, Dict] = self.header['variables']
+        self._data = None
+        if self.header['n_values'] > 0:
+            self._data = np.memmap(self.path, dtype='<f8', mode='r',
+                                   offset=self.header['data_offset'],
+                                   shape=(self.header['n_values'],))
+
+    @property
+    def variables(self) -> List[str]:
+        """Variables disponibles, en el orden en que se guardaron."""
+        return list(self._index.keys())
+
+    def __contains__(self, variable: str) -> bool:
+        return variable in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def load(self, variable: str) -> FastProphetPredictor:
+        """Lee el predictor de una variable (solo sus bytes)."""
+        entry = self._index[variable]
+        arrays = {}
+        for name, (offset, length) in entry['arrays'].items():
+            # Copia fuera del memmap para no mantener referencias al archivo
+            arrays[name] = np.array(self._data[offset:offset + length]) if length else np.empty(0)
+        return FastProphetPredictor.from_state(entry['scalars'], arrays)
+
+    def load_many(self, variables: Optional[Iterable[str]] = None) -> Dict[str, FastProphetPredictor]:
+        """Lee varias variables (None = todas)."""
+        if variables is None:
+            variables = self.variables
+        return {var: self.load(var) for var in variables if var in self._index}
+
+    def close(self):
+        """Libera el mapeo del archivo."""
+        if self._data is not None:
+            mmap = getattr(self._data, '_mmap', None)
+            self._data = None
+            if mmap is not None:
+                mmap.close()
+
+    @staticmethod
+    def write(path: str, predictors: Dict[str, FastProphetPredictor]) -> int:
+        """
+        Escribe todos los predictores en un único archivo.
+
+        La escritura es atómica: se genera un archivo temporal y se reemplaza
+        el destino al final, así un worker nunca lee un almacén a medio escribir.
+
+        Parámetros:
+        -----------
+        path : str
+            Ruta de destino
+        predictors : Dict[str, FastProphetPredictor]
+            Predictores por variable
+
+        Retorna:
+        --------
+        int : Tamaño del archivo en bytes
+        """
+        path = Path(path)
+        index = {}
+        chunks = []
+        n_values = 0
+
+        for var, predictor in predictors.items():
+            scalars, arrays = predictor.to_state()
+            positions = {}
+            for name in ARRAY_FIELDS:
+                values = np.ascontiguousarray(arrays[name], dtype='<f8').ravel()
+                positions[name] = [n_values, int(values.size)]
+                chunks.append(values)
+                n_values += values.size
+            index[var] = {'scalars': scalars, 'arrays': positions}
+
+        header = {'version': _VERSION, 'n_values': n_values, 'variables': index}
+        # data_offset depende del largo del encabezado; se itera hasta que sea estable
+        data_offset = 0
+        while True:
+            header['data_offset'] = data_offset
+            header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+            prefix_len = len(_MAGIC) + 8 + len(header_bytes)
+            aligned = prefix_len + (-prefix_len) % _ALIGN
+            if aligned == data_offset:
+                break
+            data_offset = aligned
+
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b'\0' * (data_offset - prefix_len))
+            for values in chunks:
+                f.write(values.tobytes())
+        os.replace(tmp_path, path)
+
+        return path.stat().st_size
@@ -10,13 +10,93 @@ import numpy as np
 from prophet import Prophet
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import os
+import time
 import warnings
 import pickle
 import json
 from datetime import datetime
+
+from pipeline.scripts.prophet_fast_predict import FastProphetPredictor
+from pipeline.scripts.forecast_cache import ForecastCache
+from pipeline.scripts.model_store import ModelStore, STORE_FILENAME, safe_model_filename, discover_pickle_models
+from pipeline.scripts.model_registry import LazyModelRegistry
+from pipeline.scripts.anomaly_scoring import score_anomalies
+from pipeline.scripts.residual_stats import ResidualStats, ResidualStatsStore
+from pipeline.scripts.compact_results import CompactResults
+
 warnings.filterwarnings('ignore')
 
 
+def _build_prophet(config: Dict) -> Prophet:
+    """Crea un modelo Prophet sin entrenar a partir de la configuración del detector."""
+    return Prophet(
+        interval_width=config['interval_width'],
+        changepoint_prior_scale=config['changepoint_prior_scale'],
+        seasonality_mode=config['seasonality_mode'],
+        daily_seasonality=config['daily_seasonality'],
+        weekly_seasonality=config['weekly_seasonality'],
+        yearly_seasonality=config['yearly_seasonality']
+    )
+
+
+def _compute_variable_stats(prophet_df: pd.DataFrame) -> Dict:
+    """Estadísticas descriptivas de una serie ya preparada para Prophet."""
+    return {
+        'mean': prophet_df['y'].mean(),
+        'std': prophet_df['y'].std(),
+        'min': prophet_df['y'].min(),
+        'max': prophet_df['y'].max(),
+        'n_points': len(prophet_df)
+    }
+
+
+def _training_residual_stats(model: Prophet, prophet_df: pd.DataFrame) -> Dict:
+    """Estadísticas de los residuales del modelo sobre sus propios datos de entrenamiento."""
+    try:
+        # Solo hace falta yhat: la forma cerrada evita el muestreo de intervalos de predict
+        yhat = FastProphetPredictor.from_model(model).predict(prophet_df['ds'])['yhat'].to_numpy()
+    except Exception:
+        yhat = model.predict(prophet_df[['ds']])['yhat'].to_numpy()
+    return ResidualStats.from_residuals(prophet_df['y'].to_numpy(dtype=np.float64) - yhat).to_dict()
+
+
+def _fit_prophet_worker(prophet_df: pd.DataFrame,
+                        config: Dict,
+                        init: Optional[Dict] = None) -> Tuple[Prophet, Dict]:
+    """
+    Entrena un modelo y retorna sus estadísticas, incluyendo el tiempo de ajuste.
+    
+    Se define a nivel de módulo para poder ejecutarse en un proceso del pool, y
+    recibe solo las columnas 'ds'/'y' de su variable en lugar del DataFrame
+    ancho completo. Con `init` el optimizador de Stan parte de esos parámetros
+    (warm start) en lugar de los valores por defecto.
+    """
+    warnings.filterwarnings('ignore')
+    start = time.time()
+    model = _build_prophet(config)
+    if init is not None:
+        model.fit(prophet_df, init=init)
+    else:
+        model.fit(prophet_df)
+    
+    stats = _compute_variable_stats(prophet_df)
+    stats['fit_seconds'] = time.time() - start
+    stats['fit_mode'] = 'warm' if init is not None else 'cold'
+    stats['residual_stats'] = _training_residual_stats(model, prophet_df)
+    return model, stats
+
+
+def _terminate_pool(executor: ProcessPoolExecutor):
+    """Cierra un pool de procesos matando los entrenamientos que sigan en curso."""
+    processes = list(getattr(executor, '_processes', {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
 class ProphetAnomalyDetector:
     """
     Detector de anomalías usando Facebook Prophet.
@@ -34,7 +114,11 @@ class ProphetAnomalyDetector:
                  daily_seasonality: bool = True,
                  weekly_seasonality: bool = True,
                  yearly_seasonality: bool = False,
-                 anomaly_threshold: float = 2.0):
+                 anomaly_threshold: float = 2.0,
+                 use_fast_predict: bool = False,
+                 fast_predict_tolerance: float = 0.1,
+                 residual_stats_update: Optional[str] = None,
+                 residual_stats_alpha: float = 0.001):
         """
         Parámetros:
         -----------
@@ -52,6 +136,20 @@ class ProphetAnomalyDetector:
             Si incluir estacionalidad anual
         anomaly_threshold : float
             Número de desviaciones estándar fuera del intervalo de confianza para considerar anomalía
+        use_fast_predict : bool
+            Si calcular yhat e intervalos en forma cerrada (ver prophet_fast_predict)
+            en lugar de llamar a Prophet.predict. Los modelos que solo están en el
+            almacén compacto se puntúan siempre en forma cerrada; con False,
+            load_models usa el pickle del modelo cuando existe (ver save_models)
+        fast_predict_tolerance : float
+            Error admitido en los límites del intervalo al validar la predicción rápida
+            contra Prophet.predict; los modelos que no la cumplen usan predict
+        residual_stats_update : Optional[str]
+            Si actualizar el desvío de los residuales de cada variable con los puntos
+            que se van puntuando: 'welford' (acumulado) o 'ewma' (exponencial, sigue
+            la deriva). None = desvío fijo calculado al entrenar (ver residual_stats)
+        residual_stats_alpha : float
+            Factor por punto de la actualización 'ewma'
         """
         self.interval_width = interval_width
         self.changepoint_prior_scale = changepoint_prior_scale
@@ -60,10 +158,28 @@ class ProphetAnomalyDetector:
         self.weekly_seasonality = weekly_seasonality
         self.yearly_seasonality = yearly_seasonality
         self.anomaly_threshold = anomaly_threshold
+        self.use_fast_predict = use_fast_predict
+        self.fast_predict_tolerance = fast_predict_tolerance
         
         self.models = {}  # Un modelo por variable
         self.variable_stats = {}  # Estadísticas de cada variable
+        self.residual_stats = ResidualStatsStore(residual_stats_update, residual_stats_alpha)
+        self.fast_predictors = {}  # Predictores vectorizados por variable
+        self.forecast_cache = None  # Pronósticos precalculados (ver enable_forecast_cache)
+        self.models_generation = 0  # Se incrementa cada vez que cambian los modelos
         
+    def get_config(self) -> Dict:
+        """Retorna los parámetros del detector como diccionario serializable."""
+        return {
+            'interval_width': self.interval_width,
+            'changepoint_prior_scale': self.changepoint_prior_scale,
+            'seasonality_mode': self.seasonality_mode,
+            'daily_seasonality': self.daily_seasonality,
+            'weekly_seasonality': self.weekly_seasonality,
+            'yearly_seasonality': self.yearly_seasonality,
+            'anomaly_threshold': self.anomaly_threshold
+        }
+    
     def prepare_data_for_prophet(self, 
                                  df: pd.DataFrame, 
                                  variable: str,
@@ -90,7 +206,8 @@ class ProphetAnomalyDetector:
                    df: pd.DataFrame,
                    variable: str,
                    datetime_col: str = 'DATETIME',
-                   verbose: bool = False) -> Prophet:
+                   verbose: bool = False,
+                   init: Optional[Dict] = None) -> Prophet:
         """
         Entrena un modelo Prophet para una variable específica.
         
@@ -104,6 +221,8 @@ class ProphetAnomalyDetector:
             Nombre de la columna de fecha/hora
         verbose : bool
             Si mostrar información de entrenamiento
+        init : Optional[Dict]
+            Parámetros iniciales para Stan (k, m, delta, beta, sigma_obs); None = ajuste desde cero
         
         Retorna:
         --------
@@ -111,37 +230,32 @@ class ProphetAnomalyDetector:
         """
         # Preparar datos
         prophet_df = self.prepare_data_for_prophet(df, variable, datetime_col)
-        
-        if len(prophet_df) < 10:
-            raise ValueError(f"Insuficientes datos para entrenar modelo de {variable}. Mínimo 10 puntos requeridos.")
-        
-        # Crear y configurar modelo
-        model = Prophet(
-            interval_width=self.interval_width,
-            changepoint_prior_scale=self.changepoint_prior_scale,
-            seasonality_mode=self.seasonality_mode,
-            daily_seasonality=self.daily_seasonality,
-            weekly_seasonality=self.weekly_seasonality,
-            yearly_seasonality=self.yearly_seasonality
-        )
+        self._check_training_data(prophet_df, variable)
         
         # Entrenar modelo
         if verbose:
             print(f"  Entrenando modelo para {variable}...")
         
-        model.fit(prophet_df)
+        model, stats = _fit_prophet_worker(prophet_df, self.get_config(), init)
         
         # Guardar estadísticas de la variable
-        self.variable_stats[variable] = {
-            'mean': prophet_df['y'].mean(),
-            'std': prophet_df['y'].std(),
-            'min': prophet_df['y'].min(),
-            'max': prophet_df['y'].max(),
-            'n_points': len(prophet_df)
-        }
+        self._set_stats(variable, stats)
         
         return model
     
+    def _set_stats(self, variable: str, stats: Dict):
+        """Guarda las estadísticas de un entrenamiento (las de residuales van a su propio store)."""
+        residual = stats.pop('residual_stats', None)
+        if residual is not None:
+            self.residual_stats.set(variable, ResidualStats.from_dict(residual))
+        self.variable_stats[variable] = stats
+    
+    @staticmethod
+    def _check_training_data(prophet_df: pd.DataFrame, variable: str):
+        """Valida que haya suficientes puntos para entrenar."""
+        if len(prophet_df) < 10:
+            raise ValueError(f"Insuficientes datos para entrenar modelo de {variable}. Mínimo 10 puntos requeridos.")
+    
     def detect_anomalies(self,
                         model: Prophet,
                         df: pd.DataFrame,
@@ -165,69 +279,135 @@ class ProphetAnomalyDetector:
         --------
         pd.DataFrame : DataFrame con predicciones y detección de anomalías
         """
+        prophet_df, yhat, yhat_lower, yhat_upper, scores = self._score_variable(model, df, variable, datetime_col)
+        
+        return pd.DataFrame({
+            'ds': prophet_df['ds'].to_numpy(),
+            'y': prophet_df['y'].to_numpy(),
+            'yhat': yhat,
+            'yhat_lower': yhat_lower,
+            'yhat_upper': yhat_upper,
+            'residual': scores['residual'],
+            'outside_interval': scores['outside_interval'],
+            'high_residual': scores['high_residual'],
+            'is_anomaly': scores['is_anomaly'],
+            'anomaly_score': scores['anomaly_score'],
+            'variable': variable,
+            'prediction_error_pct': scores['prediction_error_pct']
+        })
+    
+    def _score_variable(self, model: Prophet, df: pd.DataFrame, variable: str, datetime_col: str) -> Tuple:
+        """Predicción y scores de una variable: (prophet_df, yhat, yhat_lower, yhat_upper, scores)."""
         # Preparar datos
         prophet_df = self.prepare_data_for_prophet(df, variable, datetime_col)
         
         # Hacer predicciones
-        forecast = model.predict(prophet_df[['ds']])
+        forecast = self._predict(model, variable, prophet_df[['ds']])
+        yhat = forecast['yhat'].to_numpy(dtype=np.float64)
+        yhat_lower = forecast['yhat_lower'].to_numpy(dtype=np.float64)
+        yhat_upper = forecast['yhat_upper'].to_numpy(dtype=np.float64)
         
-        # Combinar datos reales con predicciones
-        results = prophet_df.copy()
-        results['yhat'] = forecast['yhat'].values
-        results['yhat_lower'] = forecast['yhat_lower'].values
-        results['yhat_upper'] = forecast['yhat_upper'].values
+        # Detectar anomalías (ver anomaly_scoring):
+        # 1. El valor está fuera del intervalo de confianza, O
+        # 2. El residual está más de 'anomaly_threshold' desviaciones estándar del promedio
+        # El desvío es el de los residuales de entrenamiento (ver residual_stats); solo
+        # si la variable no lo tiene (modelos anteriores) se calcula sobre este lote.
+        scores = score_anomalies(prophet_df['y'].to_numpy(dtype=np.float64), yhat, yhat_lower, yhat_upper,
+                                 self.anomaly_threshold, std=self.residual_stats.std(variable))
+        self.residual_stats.update(variable, scores['residual'])
+        return prophet_df, yhat, yhat_lower, yhat_upper, scores
+    
+    def _detect_into(self, out: CompactResults, model: Prophet, df: pd.DataFrame,
+                     variable: str, datetime_col: str) -> int:
+        """Detecta anomalías de una variable y las escribe en su tramo de `out`; retorna cuántas hay."""
+        prophet_df, yhat, yhat_lower, yhat_upper, scores = self._score_variable(model, df, variable, datetime_col)
+        out.fill(variable, prophet_df['ds'].to_numpy(), prophet_df['y'].to_numpy(),
+                 yhat, yhat_lower, yhat_upper, scores)
+        return int(scores['is_anomaly'].sum())
+    
+    def _predict(self, model: Prophet, variable: str, ds_df: pd.DataFrame) -> pd.DataFrame:
+        """Predice usando el cache de pronósticos si está habilitado."""
+        if self.forecast_cache is not None:
+            return self.forecast_cache.predict(
+                variable, ds_df['ds'],
+                fallback=lambda missing: self._predict_uncached(model, variable, missing)
+            )
+        return self._predict_uncached(model, variable, ds_df)
+    
+    def _predict_uncached(self, model: Prophet, variable: str, ds_df: pd.DataFrame) -> pd.DataFrame:
+        """Predice con el predictor rápido si existe para este modelo, o con Prophet.predict."""
+        if isinstance(model, FastProphetPredictor):
+            # Modelo leído del almacén compacto sin pickle: solo existe la forma cerrada
+            return model.predict(ds_df['ds'])
+        if self.use_fast_predict and isinstance(self.models, LazyModelRegistry) \
+                and variable not in self.fast_predictors:
+            # Con carga bajo demanda el predictor se crea al primer uso; se guarda aunque
+            # el modelo completo salga del cache LRU (ocupa unos pocos KB). None = no disponible.
+            self.fast_predictors[variable] = self._build_fast_predictor(variable, model)
+        predictor = self.fast_predictors.get(variable) if self.use_fast_predict else None
+        if predictor is not None:
+            return predictor.predict(ds_df['ds'])
+        return model.predict(ds_df)
+    
+    def build_fast_predictors(self, validate: bool = True, verbose: bool = True) -> Dict[str, FastProphetPredictor]:
+        """
+        Extrae los parámetros de cada modelo cargado para la predicción rápida.
         
-        # Calcular residuales (diferencia entre valor real y predicho)
-        results['residual'] = results['y'] - results['yhat']
+        Parámetros:
+        -----------
+        validate : bool
+            Si comparar cada predictor contra Prophet.predict sobre el final del
+            historial y descartar los que excedan `fast_predict_tolerance`
+        verbose : bool
+            Si mostrar el resumen
         
-        # Calcular desviación estándar de los residuales
-        residual_std = results['residual'].std()
+        Retorna:
+        --------
+        Dict[str, FastProphetPredictor] : Predictores por variable
+        """
+        self.fast_predictors = {}
         
-        # Detectar anomalías
-        # Una anomalía es cuando:
-        # 1. El valor está fuera del intervalo de confianza, O
-        # 2. El residual está más de 'anomaly_threshold' desviaciones estándar del promedio
-        results['outside_interval'] = (results['y'] < results['yhat_lower']) | (results['y'] > results['yhat_upper'])
-        results['high_residual'] = np.abs(results['residual']) > (self.anomaly_threshold * residual_std)
-        results['is_anomaly'] = results['outside_interval'] | results['high_residual']
-        
-        # Calcular score de anomalía (0-100, mayor = más anómalo)
-        # Basado en qué tan lejos está del intervalo de confianza
-        results['anomaly_score'] = 0.0
-        
-        # Para valores fuera del intervalo
-        mask_above = results['y'] > results['yhat_upper']
-        mask_below = results['y'] < results['yhat_lower']
-        
-        if mask_above.any():
-            results.loc[mask_above, 'anomaly_score'] = (
-                (results.loc[mask_above, 'y'] - results.loc[mask_above, 'yhat_upper']) / 
-                (results.loc[mask_above, 'yhat_upper'] - results.loc[mask_above, 'yhat']) * 50
-            ).clip(upper=100)
-        
-        if mask_below.any():
-            results.loc[mask_below, 'anomaly_score'] = (
-                (results.loc[mask_below, 'yhat_lower'] - results.loc[mask_below, 'y']) / 
-                (results.loc[mask_below, 'yhat'] - results.loc[mask_below, 'yhat_lower']) * 50
-            ).clip(upper=100)
-        
-        # Ajustar score basado en residuales
-        results['anomaly_score'] = np.maximum(
-            results['anomaly_score'],
-            (np.abs(results['residual']) / residual_std * 20).clip(upper=100)
-        )
-        
-        # Agregar información adicional
-        results['variable'] = variable
-        results['prediction_error_pct'] = np.abs(results['residual'] / results['yhat'] * 100).replace([np.inf, -np.inf], np.nan)
-        
-        return results
+        for var, model in self.models.items():
+            predictor = self._build_fast_predictor(var, model, validate, verbose)
+            if predictor is not None:
+                self.fast_predictors[var] = predictor
+        
+        if verbose:
+            print(f"Predicción rápida: {len(self.fast_predictors)}/{len(self.models)} modelos")
+        
+        return self.fast_predictors
+    
+    def _build_fast_predictor(self,
+                              variable: str,
+                              model,
+                              validate: bool = True,
+                              verbose: bool = True) -> Optional[FastProphetPredictor]:
+        """Crea (y valida) el predictor rápido de un modelo; None si no es posible."""
+        if isinstance(model, FastProphetPredictor):
+            # Cargado del almacén compacto: solo existe la forma cerrada
+            return model
+        try:
+            predictor = FastProphetPredictor.from_model(model)
+            if validate:
+                check = predictor.validate(model, tolerance=self.fast_predict_tolerance)
+                if not check['ok']:
+                    future_error = check['future_interval_error']
+                    raise ValueError(f"validación fallida (yhat={check['yhat_error']:.2e}, "
+                                     f"intervalo={check['interval_error']:.3f}, futuro="
+                                     f"{'-' if future_error is None else f'{future_error:.3f}'})")
+        except Exception as e:
+            if verbose:
+                print(f"  [ADVERTENCIA] {variable}: predicción rápida no disponible ({str(e)}), se usará predict")
+            return None
+        return predictor
     
     def train_multiple_variables(self,
                                 df: pd.DataFrame,
                                 variables: List[str],
                                 datetime_col: str = 'DATETIME',
-                                verbose: bool = True) -> Dict[str, Prophet]:
+                                verbose: bool = True,
+                                n_jobs: int = 1,
+                                timeout: Optional[float] = None) -> Dict[str, Prophet]:
         """
         Entrena modelos Prophet para múltiples variables.
         
@@ -241,33 +421,68 @@ class ProphetAnomalyDetector:
             Nombre de la columna de fecha/hora
         verbose : bool
             Si mostrar progreso
+        n_jobs : int
+            Número de procesos de entrenamiento (1 = secuencial, -1 = todos los núcleos)
+        timeout : Optional[float]
+            Tiempo máximo en segundos para entrenar cada variable (None = sin límite).
+            Las variables que lo superan se reportan como fallidas.
         
         Retorna:
         --------
-        Dict[str, Prophet] : Diccionario de modelos entrenados
+        Dict[str, Prophet] : Diccionario de modelos entrenados (en el orden de `variables`)
         """
+        self._close_models()
         self.models = {}
+        self._models_changed()
         failed_variables = []
         
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        
         if verbose:
             print(f"\nEntrenando modelos Prophet para {len(variables)} variables...")
+            if n_jobs > 1 or timeout is not None:
+                print(f"Procesos: {n_jobs}" + (f", timeout por variable: {timeout}s" if timeout else ""))
             print("="*80)
         
-        for i, var in enumerate(variables, 1):
-            try:
-                if verbose:
-                    print(f"[{i}/{len(variables)}] Procesando {var}...")
-                
-                model = self.train_model(df, var, datetime_col, verbose=False)
-                self.models[var] = model
-                
-                if verbose:
-                    print(f"  [OK] Modelo entrenado exitosamente")
+        if n_jobs == 1 and timeout is None:
+            for i, var in enumerate(variables, 1):
+                try:
+                    if verbose:
+                        print(f"[{i}/{len(variables)}] Procesando {var}...")
                     
-            except Exception as e:
-                failed_variables.append(var)
-                if verbose:
-                    print(f"  [ERROR] Error entrenando modelo: {str(e)}")
+                    model = self.train_model(df, var, datetime_col, verbose=False)
+                    self.models[var] = model
+                    
+                    if verbose:
+                        print(f"  [OK] Modelo entrenado exitosamente")
+                        
+                except Exception as e:
+                    failed_variables.append(var)
+                    if verbose:
+                        print(f"  [ERROR] Error entrenando modelo: {str(e)}")
+        else:
+            tasks = []
+            for i, var in enumerate(variables, 1):
+                try:
+                    # Preparar en el proceso principal: cada tarea solo lleva sus columnas ds/y
+                    prophet_df = self.prepare_data_for_prophet(df, var, datetime_col)
+                    self._check_training_data(prophet_df, var)
+                    tasks.append((i, var, prophet_df, None))
+                except Exception as e:
+                    if verbose:
+                        print(f"[{i}/{len(variables)}] [ERROR] {var}: {str(e)}")
+            
+            trained = self._train_parallel(tasks, len(variables), verbose, n_jobs, timeout)
+            
+            # Recolectar en el mismo orden que `variables`, sin importar el orden de finalización
+            for var in variables:
+                if var in trained:
+                    model, stats = trained[var]
+                    self.models[var] = model
+                    self._set_stats(var, stats)
+                else:
+                    failed_variables.append(var)
         
         if verbose:
             print("\n" + "="*80)
@@ -278,13 +493,274 @@ class ProphetAnomalyDetector:
                 if len(failed_variables) > 10:
                     print(f"  ... y {len(failed_variables) - 10} más")
         
+        if self.use_fast_predict:
+            self.build_fast_predictors(verbose=verbose)
+        
+        return self.models
+    
+    def train_incremental(self,
+                          df: pd.DataFrame,
+                          variables: List[str],
+                          datetime_col: str = 'DATETIME',
+                          window_days: Optional[float] = None,
+                          verbose: bool = True,
+                          n_jobs: int = 1,
+                          timeout: Optional[float] = None) -> Dict[str, Prophet]:
+        """
+        Reentrena a partir de los modelos cargados en lugar de hacerlo desde cero.
+        
+        Para cada variable:
+        - sin datos posteriores al final del entrenamiento anterior: se conserva el modelo
+        - con modelo anterior: ajuste con warm start (Stan parte de los parámetros previos)
+        - sin modelo anterior, o si el warm start falla: ajuste completo
+        
+        Los modelos de variables que no están en `variables` o que fallan se conservan.
+        
+        Parámetros:
+        -----------
+        df : pd.DataFrame
+            DataFrame con los datos (puede contener solo la ventana reciente)
+        variables : List[str]
+            Lista de variables a reentrenar
+        datetime_col : str
+            Nombre de la columna de fecha/hora
+        window_days : Optional[float]
+            Entrenar solo con los últimos días de cada variable (None = todos los datos de df)
+        verbose : bool
+            Si mostrar progreso
+        n_jobs : int
+            Número de procesos de entrenamiento (1 = secuencial, -1 = todos los núcleos)
+        timeout : Optional[float]
+            Tiempo máximo en segundos para entrenar cada variable (None = sin límite)
+        
+        Retorna:
+        --------
+        Dict[str, Prophet] : Diccionario de modelos (anteriores y reentrenados)
+        """
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        
+        previous_models = dict(self.models.items())
+        previous_stats = dict(self.variable_stats)
+        
+        if verbose:
+            print(f"\nReentrenamiento incremental de {len(variables)} variables "
+                  f"({len(previous_models)} modelos previos)...")
+            if window_days:
+                print(f"Ventana de entrenamiento: últimos {window_days} días")
+            print("="*80)
+        
+        skipped = []
+        tasks = []
+        for i, var in enumerate(variables, 1):
+            try:
+                prophet_df = self.prepare_data_for_prophet(df, var, datetime_col)
+                if window_days and len(prophet_df) > 0:
+                    cutoff = prophet_df['ds'].max() - pd.Timedelta(days=window_days)
+                    prophet_df = prophet_df[prophet_df['ds'] >= cutoff].reset_index(drop=True)
+                
+                previous = previous_models.get(var)
+                history_end = self._history_end(previous)
+                if history_end is not None and len(prophet_df) > 0 and prophet_df['ds'].max() <= history_end:
+                    skipped.append(var)
+                    if verbose:
+                        print(f"[{i}/{len(variables)}] {var}: sin datos nuevos, se conserva el modelo")
+                    continue
+                
+                self._check_training_data(prophet_df, var)
+                tasks.append((i, var, prophet_df, self._warm_start_init(previous, prophet_df)))
+            except Exception as e:
+                if verbose:
+                    print(f"[{i}/{len(variables)}] [ERROR] {var}: {str(e)}")
+        
+        if n_jobs == 1 and timeout is None:
+            trained = {}
+            for i, var, prophet_df, init in tasks:
+                try:
+                    trained[var] = _fit_prophet_worker(prophet_df, self.get_config(), init)
+                except Exception as e:
+                    if init is None:
+                        if verbose:
+                            print(f"[{i}/{len(variables)}] [ERROR] {var}: {str(e)}")
+                        continue
+                    # Warm start rechazado (p.ej. cambió el número de parámetros): ajuste completo
+                    try:
+                        trained[var] = _fit_prophet_worker(prophet_df, self.get_config())
+                    except Exception as e:
+                        if verbose:
+                            print(f"[{i}/{len(variables)}] [ERROR] {var}: {str(e)}")
+                        continue
+                if verbose:
+                    stats = trained[var][1]
+                    print(f"[{i}/{len(variables)}] [OK] {var} ({stats['fit_mode']}, {stats['fit_seconds']:.1f}s)")
+        else:
+            trained = self._train_parallel(tasks, len(variables), verbose, n_jobs, timeout)
+            retry = [(i, var, prophet_df, None) for i, var, prophet_df, init in tasks
+                     if init is not None and var not in trained]
+            if retry:
+                if verbose:
+                    print(f"Reintentando {len(retry)} variables con ajuste completo...")
+                trained.update(self._train_parallel(retry, len(variables), verbose, n_jobs, timeout))
+        
+        # Reconstruir: modelos nuevos en el orden de `variables`, el resto se conserva
+        models = {}
+        time_saved = 0.0
+        for var in list(variables) + [v for v in previous_models if v not in variables]:
+            if var in models:
+                continue
+            if var in trained:
+                model, stats = trained[var]
+                if stats['fit_mode'] == 'cold':
+                    stats['cold_fit_seconds'] = stats['fit_seconds']
+                else:
+                    prev = previous_stats.get(var, {})
+                    cold_seconds = prev.get('cold_fit_seconds')
+                    if cold_seconds is None and prev.get('fit_mode') == 'cold':
+                        cold_seconds = prev.get('fit_seconds')
+                    if cold_seconds is not None:
+                        stats['cold_fit_seconds'] = cold_seconds
+                        time_saved += cold_seconds - stats['fit_seconds']
+                models[var] = model
+                self._set_stats(var, stats)
+            elif var in previous_models:
+                models[var] = previous_models[var]
+        
+        self._close_models()
+        self.models = models
+        self._models_changed()
+        
+        if verbose:
+            n_warm = sum(1 for _, stats in trained.values() if stats['fit_mode'] == 'warm')
+            failed = [t[1] for t in tasks if t[1] not in trained]
+            print("\n" + "="*80)
+            print(f"Reentrenados: {len(trained)} ({n_warm} warm start, {len(trained) - n_warm} completos), "
+                  f"sin cambios: {len(skipped)}")
+            print(f"Tiempo ahorrado frente al último ajuste completo: {time_saved:.1f}s")
+            if failed:
+                print(f"Variables con errores (se conserva el modelo anterior si existe): {len(failed)}")
+                print(f"  {', '.join(failed[:10])}")
+        
+        if self.use_fast_predict:
+            self.build_fast_predictors(verbose=verbose)
+        
         return self.models
     
+    @staticmethod
+    def _history_end(model) -> Optional[pd.Timestamp]:
+        """Último timestamp con el que se entrenó el modelo (None si no se conoce)."""
+        if model is None:
+            return None
+        if isinstance(model, FastProphetPredictor):
+            return model.history_end
+        history = getattr(model, 'history', None)
+        if history is not None and len(history) > 0:
+            return pd.Timestamp(history['ds'].max())
+        return None
+    
+    @staticmethod
+    def _warm_start_init(model, prophet_df: pd.DataFrame) -> Optional[Dict]:
+        """Parámetros iniciales a partir del modelo anterior; None si no es posible."""
+        if model is None:
+            return None
+        try:
+            predictor = model if isinstance(model, FastProphetPredictor) else FastProphetPredictor.from_model(model)
+            return predictor.warm_start_init(prophet_df['ds'], prophet_df['y'])
+        except Exception:
+            return None
+    
+    def _train_parallel(self,
+                        tasks: List[Tuple[int, str, pd.DataFrame, Optional[Dict]]],
+                        total: int,
+                        verbose: bool,
+                        n_jobs: int,
+                        timeout: Optional[float]) -> Dict[str, Tuple[Prophet, Dict]]:
+        """
+        Entrena variables en un pool de procesos.
+        
+        Se envían como máximo `n_jobs` tareas a la vez, de modo que el tiempo desde
+        el envío es el tiempo real de entrenamiento y sirve para aplicar `timeout`.
+        Si una variable excede el límite, el pool se descarta (matando el proceso
+        bloqueado) y las tareas que estaban en curso se reenvían a un pool nuevo.
+        
+        Parámetros:
+        -----------
+        tasks : List[Tuple[int, str, pd.DataFrame, Optional[Dict]]]
+            (posición, variable, datos ds/y, parámetros iniciales o None)
+        total : int
+            Total de variables, para los mensajes de progreso
+        
+        Retorna:
+        --------
+        Dict[str, Tuple[Prophet, Dict]] : modelo y estadísticas de cada variable exitosa
+        """
+        config = self.get_config()
+        trained = {}
+        pending = list(tasks)
+        
+        executor = None
+        in_flight = {}  # future -> (i, var, prophet_df, init, t_envio)
+        
+        try:
+            while pending or in_flight:
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=n_jobs)
+                
+                while pending and len(in_flight) < n_jobs:
+                    i, var, prophet_df, init = pending.pop(0)
+                    future = executor.submit(_fit_prophet_worker, prophet_df, config, init)
+                    in_flight[future] = (i, var, prophet_df, init, time.time())
+                
+                wait_timeout = None
+                if timeout is not None:
+                    next_deadline = min(item[-1] for item in in_flight.values()) + timeout
+                    wait_timeout = max(0.0, next_deadline - time.time())
+                
+                done, _ = wait(list(in_flight), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    i, var, _, _, t0 = in_flight.pop(future)
+                    try:
+                        trained[var] = future.result()
+                        if verbose:
+                            print(f"[{i}/{total}] [OK] {var} ({time.time() - t0:.1f}s)")
+                    except Exception as e:
+                        if verbose:
+                            print(f"[{i}/{total}] [ERROR] {var}: {str(e)}")
+                
+                if timeout is None:
+                    continue
+                
+                now = time.time()
+                expired = [f for f, item in in_flight.items() if now - item[-1] >= timeout]
+                if expired:
+                    for future in expired:
+                        i, var = in_flight.pop(future)[:2]
+                        if verbose:
+                            print(f"[{i}/{total}] [ERROR] {var}: timeout de {timeout}s excedido")
+                    
+                    # Reenviar al frente de la cola lo que seguía en curso y reiniciar el pool
+                    requeue = sorted(in_flight.values(), key=lambda item: item[0])
+                    pending = [item[:4] for item in requeue] + pending
+                    in_flight = {}
+                    _terminate_pool(executor)
+                    executor = None
+        finally:
+            if executor is not None:
+                if in_flight:
+                    _terminate_pool(executor)
+                else:
+                    executor.shutdown(wait=True)
+        
+        return trained
+    
     def detect_anomalies_multiple(self,
                                   df: pd.DataFrame,
                                   variables: Optional[List[str]] = None,
                                   datetime_col: str = 'DATETIME',
-                                  combine_results: bool = True) -> pd.DataFrame:
+                                  combine_results: bool = True,
+                                  n_jobs: int = 1,
+                                  verbose: bool = True,
+                                  compact: bool = False):
         """
         Detecta anomalías para múltiples variables.
         
@@ -298,10 +774,20 @@ class ProphetAnomalyDetector:
             Nombre de la columna de fecha/hora
         combine_results : bool
             Si combinar todos los resultados en un solo DataFrame
+        n_jobs : int
+            Máximo de hilos de inferencia concurrentes (1 = secuencial).
+            Limitarlo deja CPU libre para otras tareas del proceso (p.ej. escritura a SQL).
+        verbose : bool
+            Si mostrar el progreso por variable
+        compact : bool
+            Con combine_results, escribir los resultados de cada variable en arreglos
+            preasignados (float32, flags en bits, variable como código) en lugar de
+            concatenar DataFrames (ver compact_results)
         
         Retorna:
         --------
-        pd.DataFrame : Resultados de detección de anomalías
+        pd.DataFrame : Resultados de detección de anomalías (en el orden de `variables`);
+        CompactResults si compact=True (usar `.to_frame()` para obtener el DataFrame)
         """
         if variables is None:
             variables = list(self.models.keys())
@@ -309,75 +795,192 @@ class ProphetAnomalyDetector:
         if not self.models:
             raise ValueError("No hay modelos entrenados. Llama a train_multiple_variables primero.")
         
-        all_results = []
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
         
-        print(f"\nDetectando anomalías en {len(variables)} variables...")
+        total = len(variables)
+        results_by_var = {}
         
+        if verbose:
+            print(f"\nDetectando anomalías en {total} variables...")
+        
+        to_process = []
         for i, var in enumerate(variables, 1):
             if var not in self.models:
-                print(f"[{i}/{len(variables)}] [ADVERTENCIA] {var}: Modelo no encontrado, saltando...")
+                if verbose:
+                    print(f"[{i}/{total}] [ADVERTENCIA] {var}: Modelo no encontrado, saltando...")
                 continue
-            
-            try:
-                print(f"[{i}/{len(variables)}] Analizando {var}...", end=' ')
-                results = self.detect_anomalies(self.models[var], df, var, datetime_col)
-                all_results.append(results)
-                
-                n_anomalies = results['is_anomaly'].sum()
-                print(f"[OK] ({n_anomalies} anomalias detectadas)")
-                
-            except Exception as e:
-                print(f"[ERROR] Error: {str(e)}")
+            to_process.append((i, var))
+        
+        compact_out = None
+        if compact and combine_results:
+            compact_out = CompactResults.allocate(df, [var for _, var in to_process], datetime_col)
+        
+        def detect(var):
+            if compact_out is not None:
+                return self._detect_into(compact_out, self.models[var], df, var, datetime_col)
+            return self.detect_anomalies(self.models[var], df, var, datetime_col)
+        
+        def n_anomalies(results) -> int:
+            # En modo compacto cada variable retorna directamente su cantidad de anomalías
+            return results if compact_out is not None else int(results['is_anomaly'].sum())
+        
+        if n_jobs == 1:
+            for i, var in to_process:
+                try:
+                    if verbose:
+                        print(f"[{i}/{total}] Analizando {var}...", end=' ')
+                    results = detect(var)
+                    results_by_var[var] = results
+                    
+                    if verbose:
+                        print(f"[OK] ({n_anomalies(results)} anomalias detectadas)")
+                    
+                except Exception as e:
+                    if verbose:
+                        print(f"[ERROR] Error: {str(e)}")
+        else:
+            # Prophet.predict pasa la mayor parte del tiempo en NumPy/pandas, que liberan
+            # el GIL; con hilos los modelos se comparten sin serializarlos a otro proceso.
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                futures = {executor.submit(detect, var): (i, var) for i, var in to_process}
+                for future in as_completed(futures):
+                    i, var = futures[future]
+                    try:
+                        results = future.result()
+                        results_by_var[var] = results
+                        if verbose:
+                            print(f"[{i}/{total}] {var}: [OK] ({n_anomalies(results)} anomalias detectadas)")
+                    except Exception as e:
+                        if verbose:
+                            print(f"[{i}/{total}] {var}: [ERROR] Error: {str(e)}")
+        
+        all_results = [results_by_var[var] for _, var in to_process if var in results_by_var]
         
         if not all_results:
             raise ValueError("No se pudieron procesar variables. Verifica los datos.")
         
+        if compact_out is not None:
+            compact_out.drop_unfilled()
+            return compact_out
+        
         if combine_results:
             combined = pd.concat(all_results, ignore_index=True)
             return combined
         else:
             return all_results
     
-    def save_models(self, directory: str):
-        """Guarda los modelos entrenados en archivos pickle."""
-        Path(directory).mkdir(parents=True, exist_ok=True)
+    @staticmethod
+    def has_saved_models(directory: str) -> bool:
+        """Indica si el directorio contiene modelos guardados (almacén o pickles)."""
+        directory = Path(directory)
+        if not directory.exists():
+            return False
+        return (directory / STORE_FILENAME).exists() or any(directory.glob("prophet_model_*.pkl"))
+    
+    def save_models(self, directory: str, save_pickles: bool = False, validate: bool = False):
+        """
+        Guarda los modelos entrenados.
+        
+        Los modelos soportados por la predicción rápida se guardan juntos en un
+        almacén compacto (ver model_store), con solo los parámetros necesarios
+        para puntuar. Los que no se pueden convertir (o no pasan la validación)
+        se guardan como pickle.
+        
+        Parámetros:
+        -----------
+        directory : str
+            Directorio de destino
+        save_pickles : bool
+            Si guardar además el pickle completo de cada modelo Prophet, para
+            puntuar con Prophet.predict (use_fast_predict=False) o inspeccionarlo
+        validate : bool
+            Si comparar cada predictor contra Prophet.predict antes de guardarlo
+            (ver FastProphetPredictor.validate; lento con muchas variables). Los
+            predictores ya validados por build_fast_predictors no se repiten.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
         
+        predictors = {}
+        pickled = {}
         for var, model in self.models.items():
-            # Limpiar nombre de variable para nombre de archivo
-            safe_name = var.replace('/', '_').replace('\\', '_').replace(' ', '_').replace('-', '_')
-            model_path = Path(directory) / f"prophet_model_{safe_name}.pkl"
-            
+            if isinstance(model, FastProphetPredictor):
+                predictors[var] = model
+                continue
+            try:
+                predictor = self.fast_predictors.get(var)
+                if predictor is None:
+                    predictor = FastProphetPredictor.from_model(model)
+                    if validate and not predictor.validate(model, tolerance=self.fast_predict_tolerance)['ok']:
+                        raise ValueError("validación fallida")
+                predictors[var] = predictor
+            except Exception:
+                pickled[var] = model
+            if save_pickles:
+                pickled[var] = model
+        
+        store_size = ModelStore.write(directory / STORE_FILENAME, predictors)
+        
+        written = set()
+        for var, model in pickled.items():
+            model_path = directory / f"prophet_model_{safe_model_filename(var)}.pkl"
             with open(model_path, 'wb') as f:
                 pickle.dump(model, f)
+            written.add(model_path.name)
+        
+        # Eliminar pickles de un entrenamiento anterior para que no se mezclen al cargar
+        for old_file in directory.glob("prophet_model_*.pkl"):
+            if old_file.name not in written:
+                old_file.unlink()
         
         # Guardar estadísticas
-        stats_path = Path(directory) / "variable_stats.json"
+        stats_path = directory / "variable_stats.json"
         with open(stats_path, 'w') as f:
             json.dump(self.variable_stats, f, indent=2, default=str)
         
+        self.residual_stats.retain(self.models.keys())
+        self.residual_stats.save(directory)
+        
         # Guardar configuración
-        config = {
-            'interval_width': self.interval_width,
-            'changepoint_prior_scale': self.changepoint_prior_scale,
-            'seasonality_mode': self.seasonality_mode,
-            'daily_seasonality': self.daily_seasonality,
-            'weekly_seasonality': self.weekly_seasonality,
-            'yearly_seasonality': self.yearly_seasonality,
-            'anomaly_threshold': self.anomaly_threshold,
-            'variables': list(self.models.keys())
-        }
+        config = self.get_config()
+        config['variables'] = list(self.models.keys())
         
-        config_path = Path(directory) / "detector_config.json"
+        config_path = directory / "detector_config.json"
         with open(config_path, 'w') as f:
             json.dump(config, f, indent=2)
         
         print(f"\nModelos guardados en: {directory}")
-        print(f"  - {len(self.models)} modelos")
-        print(f"  - Estadísticas de variables")
+        print(f"  - {len(predictors)} modelos en {STORE_FILENAME} ({store_size / 1024:.1f} KB)")
+        if pickled:
+            print(f"  - {len(pickled)} modelos en pickle")
+        print(f"  - Estadísticas de variables ({len(self.residual_stats)} con desvío de residuales)")
         print(f"  - Configuración del detector")
     
-    def load_models(self, directory: str):
-        """Carga modelos guardados previamente."""
+    def load_models(self,
+                    directory: str,
+                    variables: Optional[List[str]] = None,
+                    lazy: bool = False,
+                    max_models: Optional[int] = None,
+                    max_bytes: Optional[int] = None):
+        """
+        Carga modelos guardados previamente.
+        
+        Parámetros:
+        -----------
+        directory : str
+            Directorio con los modelos
+        variables : Optional[List[str]]
+            Variables a cargar (None = todas). Del almacén compacto solo se leen
+            los bytes de las variables pedidas.
+        lazy : bool
+            Si no cargar nada al inicio: cada modelo se lee la primera vez que se
+            usa y se mantiene en un cache LRU (ver model_registry)
+        max_models : Optional[int]
+            Con lazy=True, máximo de modelos en memoria (None = sin límite)
+        max_bytes : Optional[int]
+            Con lazy=True, tamaño máximo aproximado de los modelos en memoria
+        """
         directory = Path(directory)
         
         # Cargar configuración
@@ -395,31 +998,116 @@ class ProphetAnomalyDetector:
             self.yearly_seasonality = config.get('yearly_seasonality', False)
             self.anomaly_threshold = config.get('anomaly_threshold', 2.0)
         
-        # Cargar modelos
-        model_files = list(directory.glob("prophet_model_*.pkl"))
-        self.models = {}
+        self._close_models()
         
-        for model_file in model_files:
-            with open(model_file, 'rb') as f:
-                model = pickle.load(f)
-                # Extraer nombre de variable del nombre de archivo
-                var_name = model_file.stem.replace("prophet_model_", "").replace("_", "/")
-                # Intentar encontrar el nombre original en la lista de variables
-                if 'variables' in config:
-                    for orig_var in config['variables']:
-                        safe_orig = orig_var.replace('/', '_').replace('\\', '_').replace(' ', '_').replace('-', '_')
-                        if safe_orig == model_file.stem.replace("prophet_model_", ""):
-                            var_name = orig_var
-                            break
-                self.models[var_name] = model
+        if lazy:
+            self.models = LazyModelRegistry(directory, config.get('variables'), variables,
+                                            max_models=max_models, max_bytes=max_bytes,
+                                            prefer_pickles=not self.use_fast_predict)
+        else:
+            self.models = {}
+            wanted = set(variables) if variables is not None else None
+            
+            # Cargar modelos en pickle (formato anterior, modelos no soportados por el
+            # almacén, o todos si se guardaron para puntuar con Prophet.predict)
+            store_path = directory / STORE_FILENAME
+            store = ModelStore(store_path) if store_path.exists() else None
+            in_store = set(store.variables) if store is not None else set()
+            for var_name, model_file in discover_pickle_models(directory, config.get('variables')).items():
+                if wanted is not None and var_name not in wanted:
+                    continue
+                if self.use_fast_predict and var_name in in_store:
+                    continue
+                with open(model_file, 'rb') as f:
+                    self.models[var_name] = pickle.load(f)
+            
+            # Cargar almacén compacto (las variables que no tienen pickle)
+            if store is not None:
+                pending = [var for var in store.variables
+                           if var not in self.models and (wanted is None or var in wanted)]
+                self.models.update(store.load_many(pending))
+                store.close()
+        
+        if not self.use_fast_predict:
+            if lazy:
+                stored_only = len(self.models.store_only)
+            else:
+                stored_only = sum(isinstance(model, FastProphetPredictor) for model in self.models.values())
+            if stored_only:
+                print(f"[INFO] {stored_only} modelos sin pickle: se puntúan en forma cerrada "
+                      f"(guardar con save_pickles para usar Prophet.predict)")
         
         # Cargar estadísticas
         stats_path = directory / "variable_stats.json"
         if stats_path.exists():
             with open(stats_path, 'r') as f:
                 self.variable_stats = json.load(f)
+        self.residual_stats = ResidualStatsStore.load(directory, variables,
+                                                      update=self.residual_stats.update_mode,
+                                                      alpha=self.residual_stats.alpha)
+        
+        self._models_changed()
+        
+        if lazy:
+            print(f"Modelos registrados: {len(self.models)} desde {directory} (carga bajo demanda)")
+        else:
+            print(f"Modelos cargados: {len(self.models)} desde {directory}")
         
-        print(f"Modelos cargados: {len(self.models)} desde {directory}")
+        if self.use_fast_predict and not lazy:
+            self.build_fast_predictors()
+    
+    def _models_changed(self):
+        """Invalida lo derivado de los modelos anteriores (predictores y pronósticos)."""
+        self.models_generation += 1
+        self.fast_predictors = {}
+    
+    def _close_models(self):
+        """Libera los recursos del registro de modelos actual, si lo hay."""
+        if isinstance(self.models, LazyModelRegistry):
+            self.models.close()
+    
+    def enable_forecast_cache(self,
+                              horizon_hours: float = 24,
+                              lookback_hours: float = 2,
+                              refresh_margin_hours: float = 2,
+                              freq: Optional[str] = None,
+                              background_refresh: bool = True) -> ForecastCache:
+        """
+        Precalcula los pronósticos de los modelos cargados para las próximas horas.
+        
+        A partir de aquí detect_anomalies resuelve por lookup los timestamps que caen
+        en la ventana y usa predict para el resto.
+        
+        Parámetros:
+        -----------
+        horizon_hours : float
+            Horas hacia adelante a precalcular
+        lookback_hours : float
+            Horas hacia atrás incluidas en la ventana
+        refresh_margin_hours : float
+            Horizonte restante a partir del cual se recalcula cada variable
+        freq : Optional[str]
+            Paso de la grilla (None = inferido del historial de cada modelo)
+        background_refresh : bool
+            Si iniciar el hilo que recalcula el horizonte antes de que se agote
+        
+        Retorna:
+        --------
+        ForecastCache : El cache creado
+        """
+        self.disable_forecast_cache()
+        cache = ForecastCache(self, horizon_hours, lookback_hours, refresh_margin_hours, freq)
+        cache.build()
+        if background_refresh:
+            cache.start_background_refresh()
+        self.forecast_cache = cache
+        return cache
+    
+    def disable_forecast_cache(self):
+        """Detiene y descarta el cache de pronósticos."""
+        if self.forecast_cache is not None:
+            self.forecast_cache.stop()
+            self.forecast_cache = None
     
     def get_anomaly_summary(self, results_df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -427,14 +1115,17 @@ class ProphetAnomalyDetector:
         
         Parámetros:
         -----------
-        results_df : pd.DataFrame
+        results_df : pd.DataFrame o CompactResults
             DataFrame con resultados de detección
         
         Retorna:
         --------
         pd.DataFrame : Resumen por variable
         """
-        summary = results_df.groupby('variable').agg({
+        if isinstance(results_df, CompactResults):
+            results_df = results_df.to_frame(['variable', 'is_anomaly', 'anomaly_score', 'residual', 'y'])
+        
+        summary = results_df.groupby('variable', observed=True).agg({
             'is_anomaly': ['sum', 'mean'],
             'anomaly_score': ['mean', 'max'],
             'residual': ['mean', 'std'],
@@ -0,0 +1,384 @@
+"""
+Predicción rápida para modelos Prophet ya entrenados
+
+Prophet calcula `yhat_lower`/`yhat_upper` simulando por Monte Carlo la
+incertidumbre de la tendencia (1000 muestras por defecto), lo que domina el
+costo de `predict` cuando solo llegan unos pocos puntos nuevos por ciclo.
+
+Este módulo extrae una sola vez los parámetros ajustados del modelo y evalúa
+tendencia, estacionalidad e intervalos en forma cerrada con NumPy:
+
+- Tendencia lineal por tramos (o plana) y series de Fourier idénticas a Prophet.
+- Intervalo = yhat ± z * sigma, donde sigma combina el ruido de observación
+  (sigma_obs) y la varianza de los cambios de tendencia futuros. Prophet los
+  modela como un proceso de Poisson de tasa S (número de changepoints) sobre
+  el tiempo escalado t > 1 con saltos Laplace(0, lambda), cuya varianza
+  acumulada en t es 2/3 * S * lambda^2 * (t - 1)^3.
+
+Solo se soportan las configuraciones que usa el detector (sin holidays,
+regresores extra, estacionalidades condicionales ni crecimiento logístico);
+para el resto `from_model` lanza ValueError y se debe usar `model.predict`.
+"""
+
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple
+
+
+_EPOCH = pd.Timestamp('1970-01-01')
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+# Parámetros vectoriales del predictor (el resto son escalares)
+ARRAY_FIELDS = ('deltas', 'changepoints_t', 'beta', 's_a', 's_m')
+
+
+class FastProphetPredictor:
+    """
+    Evaluador vectorizado de un modelo Prophet entrenado.
+
+    Guarda únicamente los parámetros necesarios para puntuar, sin el
+    historial de entrenamiento ni el backend de Stan.
+    """
+
+    def __init__(self,
+                 growth: str,
+                 start: pd.Timestamp,
+                 t_scale: float,
+                 y_scale: float,
+                 floor: float,
+                 k: float,
+                 m: float,
+                 deltas: np.ndarray,
+                 changepoints_t: np.ndarray,
+                 seasonalities: List[Dict],
+                 beta: np.ndarray,
+                 s_a: np.ndarray,
+                 s_m: np.ndarray,
+                 sigma_obs: float,
+                 interval_width: float,
+                 freq: Optional[pd.Timedelta] = None,
+                 history_end: Optional[pd.Timestamp] = None):
+        """
+        Parámetros:
+        -----------
+        growth : str
+            'linear' o 'flat'
+        start : pd.Timestamp
+            Inicio del historial de entrenamiento (origen de t)
+        t_scale : float
+            Duración del historial en segundos (t = (ds - start) / t_scale)
+        y_scale, floor : float
+            Escalado de y usado por Prophet (y_scaled = (y - floor) / y_scale)
+        k, m, deltas, changepoints_t :
+            Parámetros de la tendencia lineal por tramos
+        seasonalities : List[Dict]
+            [{'name', 'period', 'fourier_order'}, ...] en el orden de las features
+        beta, s_a, s_m : np.ndarray
+            Coeficientes de estacionalidad y máscaras de términos aditivos/multiplicativos
+        sigma_obs : float
+            Desviación estándar del ruido de observación (escalada)
+        interval_width : float
+            Ancho del intervalo de predicción
+        freq : Optional[pd.Timedelta]
+            Paso típico de la grilla de entrenamiento (mediana entre timestamps)
+        history_end : Optional[pd.Timestamp]
+            Último timestamp del historial de entrenamiento
+        """
+        self.growth = growth
+        self.start = pd.Timestamp(start)
+        self.t_scale = float(t_scale)
+        self.y_scale = float(y_scale)
+        self.floor = float(floor)
+        self.k = float(k)
+        self.m = float(m)
+        self.deltas = np.asarray(deltas, dtype=float)
+        self.changepoints_t = np.asarray(changepoints_t, dtype=float)
+        self.seasonalities = list(seasonalities)
+        self.beta = np.asarray(beta, dtype=float)
+        self.s_a = np.asarray(s_a, dtype=float)
+        self.s_m = np.asarray(s_m, dtype=float)
+        self.sigma_obs = float(sigma_obs)
+        self.interval_width = float(interval_width)
+        self.freq = pd.Timedelta(freq) if freq is not None else None
+        self.history_end = pd.Timestamp(history_end) if history_end is not None else None
+
+        # Constantes derivadas que no dependen de los timestamps a evaluar
+        self.z = NormalDist().inv_cdf(0.5 + self.interval_width / 2)
+        self.lambda_ = float(np.mean(np.abs(self.deltas))) + 1e-8 if len(self.deltas) else 1e-8
+        self._beta_a = self.beta * self.s_a * self.y_scale
+        self._beta_m = self.beta * self.s_m
+        # Ordenada de cada tramo: m - sum(deltas_j * cp_j) para los cp_j <= t
+        self._k_cum = self.k + np.concatenate(([0.0], np.cumsum(self.deltas)))
+        self._m_cum = self.m - np.concatenate(([0.0], np.cumsum(self.deltas * self.changepoints_t)))
+
+    @classmethod
+    def from_model(cls, model) -> 'FastProphetPredictor':
+        """
+        Extrae los parámetros de un modelo Prophet entrenado.
+
+        Lanza ValueError si el modelo usa características no soportadas.
+        """
+        if getattr(model, 'history', None) is None or model.params is None:
+            raise ValueError("El modelo no está entrenado")
+        if model.growth not in ('linear', 'flat'):
+            raise ValueError(f"Crecimiento '{model.growth}' no soportado")
+        if model.mcmc_samples:
+            raise ValueError("Modelos con mcmc_samples > 0 no soportados")
+        if model.holidays is not None or getattr(model, 'country_holidays', None):
+            raise ValueError("Modelos con holidays no soportados")
+        if model.extra_regressors:
+            raise ValueError("Modelos con regresores extra no soportados")
+        if not model.uncertainty_samples:
+            raise ValueError("Modelos sin uncertainty_samples no generan intervalos")
+
+        seasonalities = []
+        for name, props in model.seasonalities.items():
+            if props.get('condition_name') is not None:
+                raise ValueError(f"Estacionalidad condicional '{name}' no soportada")
+            seasonalities.append({
+                'name': name,
+                'period': float(props['period']),
+                'fourier_order': int(props['fourier_order'])
+            })
+
+        component_cols = model.train_component_cols
+
+        floor = 0.0
+        if getattr(model, 'scaling', 'absmax') == 'minmax':
+            floor = float(model.y_min)
+
+        history_ds = model.history['ds']
+        freq = pd.Timedelta(np.median(np.diff(history_ds.values))) if len(history_ds) > 1 else None
+
+        params = model.params
+        return cls(
+            growth=model.growth,
+            start=model.start,
+            t_scale=model.t_scale.total_seconds(),
+            y_scale=model.y_scale,
+            floor=floor,
+            k=np.ravel(params['k'])[0],
+            m=np.ravel(params['m'])[0],
+            deltas=np.asarray(params['delta'])[0],
+            changepoints_t=model.changepoints_t if model.changepoints_t is not None else [],
+            seasonalities=seasonalities,
+            beta=np.asarray(params['beta'])[0],
+            s_a=component_cols['additive_terms'].values,
+            s_m=component_cols['multiplicative_terms'].values,
+            sigma_obs=np.ravel(params['sigma_obs'])[0],
+            interval_width=model.interval_width,
+            freq=freq,
+            history_end=history_ds.iloc[-1]
+        )
+
+    def trend(self, ds) -> np.ndarray:
+        """Tendencia en unidades originales para los timestamps dados."""
+        t = self.scaled_time(ds)
+        if self.growth == 'linear':
+            segment = np.searchsorted(self.changepoints_t, t, side='right')
+            trend = self._k_cum[segment] * t + self._m_cum[segment]
+        else:
+            trend = np.full(len(t), self.m)
+        return trend * self.y_scale + self.floor
+
+    def warm_start_init(self, ds, y) -> Dict:
+        """
+        Parámetros iniciales de Stan para reentrenar este modelo con nuevos datos.
+
+        Prophet reescala t e y con el rango de cada conjunto de entrenamiento, así
+        que los parámetros no se pueden reutilizar tal cual: la tendencia anterior
+        se aproxima con una recta sobre la nueva ventana, los coeficientes aditivos
+        y sigma_obs se convierten a la nueva escala de y, y los multiplicativos
+        (adimensionales) se mantienen.
+
+        Parámetros:
+        -----------
+        ds, y : array-like
+            Datos de entrenamiento nuevos (ya limpios y ordenados)
+
+        Retorna:
+        --------
+        Dict con k, m, delta, beta, sigma_obs para `Prophet.fit(df, init=...)`
+        """
+        ds = self._as_datetime_index(ds)
+        y = np.asarray(y, dtype=float)
+        # Misma escala que usará Prophet con scaling='absmax' (floor = 0)
+        y_scale_new = float(np.abs(y).max()) or 1.0
+        t_scale_new = (ds.max() - ds.min()).total_seconds() or 1.0
+
+        trend_start, trend_end = self.trend(ds[[0, -1]])
+        slope = (trend_end - trend_start) / t_scale_new  # unidades de y por segundo
+
+        ratio = self.y_scale / y_scale_new
+        beta = np.where(self.s_a > 0, self.beta * ratio, self.beta)
+
+        return {
+            'k': float(slope * t_scale_new / y_scale_new),
+            'm': float(trend_start / y_scale_new),
+            'delta': np.zeros(len(self.deltas)),
+            'beta': beta,
+            'sigma_obs': float(self.sigma_obs * ratio)
+        }
+
+    def to_state(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """
+        Separa el estado en escalares serializables a JSON y arrays float64.
+
+        Retorna:
+        --------
+        Tuple[Dict, Dict[str, np.ndarray]] : (escalares, arrays)
+        """
+        scalars = {
+            'growth': self.growth,
+            'start_ns': int(self.start.value),
+            't_scale': self.t_scale,
+            'y_scale': self.y_scale,
+            'floor': self.floor,
+            'k': self.k,
+            'm': self.m,
+            'seasonalities': self.seasonalities,
+            'sigma_obs': self.sigma_obs,
+            'interval_width': self.interval_width,
+            'freq_ns': int(self.freq.value) if self.freq is not None else None,
+            'history_end_ns': int(self.history_end.value) if self.history_end is not None else None
+        }
+        arrays = {name: getattr(self, name) for name in ARRAY_FIELDS}
+        return scalars, arrays
+
+    @classmethod
+    def from_state(cls, scalars: Dict, arrays: Dict[str, np.ndarray]) -> 'FastProphetPredictor':
+        """Reconstruye un predictor a partir de `to_state`."""
+        freq_ns = scalars.get('freq_ns')
+        history_end_ns = scalars.get('history_end_ns')
+        return cls(
+            growth=scalars['growth'],
+            start=pd.Timestamp(scalars['start_ns']),
+            t_scale=scalars['t_scale'],
+            y_scale=scalars['y_scale'],
+            floor=scalars['floor'],
+            k=scalars['k'],
+            m=scalars['m'],
+            seasonalities=scalars['seasonalities'],
+            sigma_obs=scalars['sigma_obs'],
+            interval_width=scalars['interval_width'],
+            freq=pd.Timedelta(freq_ns) if freq_ns is not None else None,
+            history_end=pd.Timestamp(history_end_ns) if history_end_ns is not None else None,
+            **{name: arrays[name] for name in ARRAY_FIELDS}
+        )
+
+    def _as_datetime_index(self, ds) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(pd.to_datetime(np.asarray(ds)))
+
+    def seasonal_features(self, ds) -> np.ndarray:
+        """Matriz de features de Fourier en el mismo orden que Prophet."""
+        ds = self._as_datetime_index(ds)
+        days = (ds - _EPOCH).total_seconds().to_numpy() / _SECONDS_PER_DAY
+        x_T = 2 * np.pi * days
+        n_features = sum(2 * s['fourier_order'] for s in self.seasonalities)
+        features = np.empty((len(ds), n_features))
+        col = 0
+        for s in self.seasonalities:
+            orders = np.arange(1, s['fourier_order'] + 1)
+            c = np.outer(x_T, orders / s['period'])
+            features[:, col:col + 2 * len(orders):2] = np.sin(c)
+            features[:, col + 1:col + 2 * len(orders):2] = np.cos(c)
+            col += 2 * len(orders)
+        return features
+
+    def scaled_time(self, ds) -> np.ndarray:
+        """Tiempo escalado de Prophet: 0 al inicio y 1 al final del historial."""
+        ds = self._as_datetime_index(ds)
+        return (ds - self.start).total_seconds().to_numpy() / self.t_scale
+
+    def predict(self, ds) -> pd.DataFrame:
+        """
+        Calcula yhat, yhat_lower y yhat_upper para los timestamps dados.
+
+        Parámetros:
+        -----------
+        ds : array-like de fechas
+
+        Retorna:
+        --------
+        pd.DataFrame con columnas ds, trend, yhat, yhat_lower, yhat_upper
+        """
+        ds = self._as_datetime_index(ds)
+        t = self.scaled_time(ds)
+
+        trend = self.trend(ds)
+
+        X = self.seasonal_features(ds)
+        additive = X @ self._beta_a
+        multiplicative = X @ self._beta_m
+        yhat = trend * (1 + multiplicative) + additive
+
+        # Varianza del ruido más la de los cambios de tendencia posteriores al historial
+        horizon = np.clip(t - 1, 0, None)
+        trend_var = (2.0 / 3.0) * len(self.changepoints_t) * self.lambda_ ** 2 * horizon ** 3
+        trend_sd = np.sqrt(trend_var) * self.y_scale * np.abs(1 + multiplicative)
+        sd = np.sqrt((self.sigma_obs * self.y_scale) ** 2 + trend_sd ** 2)
+
+        return pd.DataFrame({
+            'ds': ds,
+            'trend': trend,
+            'yhat': yhat,
+            'yhat_lower': yhat - self.z * sd,
+            'yhat_upper': yhat + self.z * sd
+        })
+
+    def validate(self, model, ds=None, tolerance: float = 0.1, horizon: int = 200) -> Dict:
+        """
+        Compara contra `model.predict` en los timestamps dados.
+
+        Parámetros:
+        -----------
+        model : Prophet
+            Modelo del que se extrajeron los parámetros
+        ds : array-like, optional
+            Fechas a comparar (default: últimos 200 puntos del historial y los
+            `horizon` períodos siguientes, donde se puntúan los datos nuevos y
+            el intervalo incluye la incertidumbre de la tendencia)
+        tolerance : float
+            Error relativo máximo admitido en los límites del intervalo, medido
+            como error medio respecto al semiancho del intervalo (incluye el ruido
+            Monte Carlo de Prophet, ~3% con 1000 muestras). El yhat debe
+            coincidir a precisión numérica (1e-6 relativo a y_scale).
+        horizon : int
+            Períodos futuros (a la frecuencia del historial) agregados al `ds` por defecto
+
+        Retorna:
+        --------
+        Dict con 'yhat_error', 'interval_error' (dentro del historial),
+        'future_interval_error' (None sin fechas futuras) y 'ok'
+        """
+        if ds is None:
+            history_ds = model.history['ds']
+            ds = history_ds.tail(200)
+            step = self.freq if self.freq is not None else (
+                pd.Timedelta(np.median(np.diff(history_ds.values))) if len(history_ds) > 1 else None)
+            if horizon > 0 and step is not None and step > pd.Timedelta(0):
+                future = pd.Series(history_ds.iloc[-1] + step * np.arange(1, horizon + 1))
+                ds = pd.concat([ds, future], ignore_index=True)
+        fast = self.predict(ds)
+        reference = model.predict(pd.DataFrame({'ds': self._as_datetime_index(ds)}))
+
+        yhat_error = float(np.max(np.abs(fast['yhat'].values - reference['yhat'].values))) / self.y_scale
+        half_width = np.maximum((reference['yhat_upper'].values - reference['yhat_lower'].values) / 2, 1e-12)
+        bound_error = (np.abs(fast['yhat_lower'].values - reference['yhat_lower'].values) +
+                       np.abs(fast['yhat_upper'].values - reference['yhat_upper'].values)) / 2
+        relative_error = bound_error / half_width
+
+        # Dentro del historial y en el futuro por separado: la fórmula de la
+        # incertidumbre de la tendencia solo actúa fuera del historial
+        future = self._as_datetime_index(ds).values > model.history['ds'].values[-1]
+        interval_error = float(np.mean(relative_error[~future])) if (~future).any() else 0.0
+        future_interval_error = float(np.mean(relative_error[future])) if future.any() else None
+
+        return {
+            'yhat_error': yhat_error,
+            'interval_error': interval_error,
+            'future_interval_error': future_interval_error,
+            'ok': bool(yhat_error <= 1e-6 and interval_error <= tolerance
+                       and (future_interval_error is None or future_interval_error <= tolerance))
+        }
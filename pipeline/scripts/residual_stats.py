@@ -0,0 +1,267 @@
+"""
+Estadísticas de residuales por variable
+
+`detect_anomalies` marcaba `high_residual` comparando cada residual con el
+desvío de los residuales del mismo lote: con pocos puntos (un ciclo del worker,
+un micro-lote) ese desvío es ruidoso o NaN y el criterio depende de qué puntos
+llegaron juntos. Aquí el desvío de cada variable se calcula una vez al entrenar
+(residuales del modelo sobre sus datos de entrenamiento) y se guarda en
+`residual_stats.json`, junto a `variable_stats.json`; al puntuar es una consulta.
+
+Opcionalmente las estadísticas se actualizan en línea con los residuales que se
+van puntuando, para seguir la deriva sin reentrenar:
+
+- 'welford': media y desvío acumulados exactos (algoritmo de Welford,
+  combinando cada lote con la fórmula de Chan)
+- 'ewma': media y varianza exponenciales con factor `alpha` por punto; pesan
+  más los residuales recientes
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+RESIDUAL_STATS_FILENAME = "residual_stats.json"
+
+UPDATE_MODES = ('welford', 'ewma')
+
+
+def _batch_moments(residual: np.ndarray):
+    """(n, media, suma de cuadrados de desvíos) de los residuales finitos."""
+    residual = np.asarray(residual, dtype=np.float64)
+    residual = residual[np.isfinite(residual)]
+    n = len(residual)
+    if n == 0:
+        return 0, 0.0, 0.0
+    mean = float(residual.mean())
+    return n, mean, float(np.square(residual - mean).sum())
+
+
+class ResidualStats:
+    """
+    Media y dispersión de los residuales de una variable
+
+    `n`, `mean` y `m2` son las acumuladas (entrenamiento más actualizaciones
+    'welford'); `ewm_mean` y `ewm_var`, las exponenciales.
+    """
+
+    __slots__ = ('n', 'mean', 'm2', 'ewm_mean', 'ewm_var', 'updated_at')
+
+    def __init__(self, n: int = 0, mean: float = 0.0, m2: float = 0.0,
+                 ewm_mean: Optional[float] = None, ewm_var: Optional[float] = None,
+                 updated_at: Optional[float] = None):
+        self.n = int(n)
+        self.mean = float(mean)
+        self.m2 = float(m2)
+        # La media/varianza exponencial parten de las de entrenamiento
+        self.ewm_mean = self.mean if ewm_mean is None else float(ewm_mean)
+        self.ewm_var = self.variance() if ewm_var is None else float(ewm_var)
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_residuals(cls, residual) -> 'ResidualStats':
+        """Estadísticas de un conjunto de residuales (p.ej. los de entrenamiento)"""
+        n, mean, m2 = _batch_moments(residual)
+        return cls(n, mean, m2, updated_at=time.time())
+
+    def variance(self) -> float:
+        """Varianza muestral (ddof=1); NaN con menos de 2 puntos"""
+        return self.m2 / (self.n - 1) if self.n > 1 else math.nan
+
+    def std(self, mode: Optional[str] = None) -> float:
+        """Desvío acumulado o, con mode='ewma', el exponencial"""
+        if mode == 'ewma':
+            return math.sqrt(self.ewm_var) if self.ewm_var >= 0 else math.nan
+        return math.sqrt(self.variance()) if self.n > 1 else math.nan
+
+    def update_welford(self, residual):
+        """Suma un lote de residuales a la media y el desvío acumulados"""
+        n_b, mean_b, m2_b = _batch_moments(residual)
+        if n_b == 0:
+            return
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+        self.updated_at = time.time()
+
+    def update_ewma(self, residual, alpha: float):
+        """
+        Incorpora un lote a la media y varianza exponenciales
+
+        El lote de n puntos pesa 1 - (1 - alpha)^n, lo mismo que aplicar el
+        factor punto por punto, pero combinando media y varianza del lote.
+        """
+        n_b, mean_b, m2_b = _batch_moments(residual)
+        if n_b == 0:
+            return
+        weight = 1.0 - (1.0 - alpha) ** n_b
+        var_b = m2_b / n_b
+        delta = mean_b - self.ewm_mean
+        if not math.isfinite(self.ewm_var):
+            # Sin varianza previa (p.ej. se entrenó con un solo punto)
+            self.ewm_mean, self.ewm_var = mean_b, var_b
+        else:
+            self.ewm_mean += weight * delta
+            self.ewm_var = (1.0 - weight) * (self.ewm_var + weight * delta * delta) + weight * var_b
+        self.updated_at = time.time()
+
+    def to_dict(self) -> Dict:
+        return {
+            'n': self.n,
+            'mean': self.mean,
+            'm2': self.m2,
+            'std': self.std(),
+            'ewm_mean': self.ewm_mean,
+            'ewm_var': self.ewm_var,
+            'updated_at': self.updated_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ResidualStats':
+        return cls(data.get('n', 0), data.get('mean', 0.0), data.get('m2', 0.0),
+                   data.get('ewm_mean'), data.get('ewm_var'), data.get('updated_at'))
+
+
+class ResidualStatsStore:
+    """
+    Estadísticas de residuales de todas las variables
+
+    Uso:
+        store = ResidualStatsStore.load(models_dir, update='ewma', alpha=0.001)
+        std = store.std('TAG-001')          # None si la variable no tiene estadísticas
+        store.update('TAG-001', residuales)  # solo si update no es None
+        store.save_updates(models_dir)
+    """
+
+    def __init__(self, update: Optional[str] = None, alpha: float = 0.001):
+        """
+        Parámetros:
+        -----------
+        update : Optional[str]
+            Actualización en línea con los residuales puntuados: 'welford', 'ewma'
+            o None (default: None = desvío fijo de entrenamiento)
+        alpha : float
+            Factor por punto de la actualización 'ewma' (default: 0.001, ~1000 puntos de memoria)
+        """
+        if update is not None and update not in UPDATE_MODES:
+            raise ValueError(f"Modo de actualización desconocido: {update}. Opciones: {', '.join(UPDATE_MODES)}")
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha debe estar entre 0 (excluido) y 1")
+        self.update_mode = update
+        self.alpha = alpha
+        self._stats: Dict[str, ResidualStats] = {}
+        self._dirty = set()  # variables actualizadas en línea desde el último guardado
+        self._lock = threading.Lock()
+
+    def __contains__(self, variable: str) -> bool:
+        return variable in self._stats
+
+    def __len__(self) -> int:
+        return len(self._stats)
+
+    def get(self, variable: str) -> Optional[ResidualStats]:
+        return self._stats.get(variable)
+
+    def set(self, variable: str, stats: ResidualStats):
+        """Reemplaza las estadísticas de una variable (p.ej. tras reentrenarla)"""
+        with self._lock:
+            self._stats[variable] = stats
+            self._dirty.discard(variable)
+
+    def std(self, variable: str) -> Optional[float]:
+        """Desvío de los residuales de la variable; None si no tiene estadísticas utilizables"""
+        stats = self._stats.get(variable)
+        if stats is None:
+            return None
+        std = stats.std(self.update_mode)
+        return std if math.isfinite(std) else None
+
+    def update(self, variable: str, residual):
+        """Incorpora residuales puntuados (no hace nada si update es None o la variable no tiene estadísticas)"""
+        if self.update_mode is None:
+            return
+        stats = self._stats.get(variable)
+        if stats is None:
+            return
+        with self._lock:
+            if self.update_mode == 'ewma':
+                stats.update_ewma(residual, self.alpha)
+            else:
+                stats.update_welford(residual)
+            self._dirty.add(variable)
+
+    def retain(self, variables: Iterable[str]):
+        """Descarta las estadísticas de variables que ya no tienen modelo"""
+        keep = set(variables)
+        with self._lock:
+            self._stats = {var: stats for var, stats in self._stats.items() if var in keep}
+            self._dirty &= keep
+
+    def save(self, directory: str):
+        """Guarda todas las estadísticas en `directory`/residual_stats.json"""
+        with self._lock:
+            data = {var: stats.to_dict() for var, stats in self._stats.items()}
+            self._dirty.clear()
+        self._write(Path(directory) / RESIDUAL_STATS_FILENAME, data)
+
+    def save_updates(self, directory: str) -> int:
+        """
+        Guarda solo las variables actualizadas en línea, sobre el archivo existente
+
+        Así varios workers que puntúan variables distintas no se pisan entre sí.
+
+        Retorna:
+        --------
+        int: Cantidad de variables guardadas
+        """
+        with self._lock:
+            updates = {var: self._stats[var].to_dict() for var in self._dirty if var in self._stats}
+            self._dirty.clear()
+        if not updates:
+            return 0
+        path = Path(directory) / RESIDUAL_STATS_FILENAME
+        data = {}
+        if path.exists():
+            with open(path, 'r') as f:
+                data = json.load(f)
+        data.update(updates)
+        self._write(path, data)
+        return len(updates)
+
+    @staticmethod
+    def _write(path: Path, data: Dict):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory: str, variables: Optional[Iterable[str]] = None,
+             update: Optional[str] = None, alpha: float = 0.001) -> 'ResidualStatsStore':
+        """
+        Lee `directory`/residual_stats.json (store vacío si no existe, p.ej. modelos
+        entrenados antes de guardar estas estadísticas)
+
+        Parámetros:
+        -----------
+        variables : Optional[Iterable[str]]
+            Variables a cargar (None = todas)
+        """
+        store = cls(update=update, alpha=alpha)
+        path = Path(directory) / RESIDUAL_STATS_FILENAME
+        if path.exists():
+            with open(path, 'r') as f:
+                data = json.load(f)
+            wanted = set(variables) if variables is not None else None
+            store._stats = {var: ResidualStats.from_dict(values) for var, values in data.items()
+                            if wanted is None or var in wanted}
+        return store
@@ -0,0 +1,196 @@
+"""
+Particionado de variables entre varios workers de procesamiento
+
+Cada worker (miembro) es dueño de un subconjunto de variables: solo carga esos
+modelos, solo lee esos datos y guarda sus propias marcas de agua. La asignación
+usa hashing de rendezvous (HRW): cada variable va al miembro con mayor
+hash(miembro, variable). Es estable entre reinicios y, cuando un miembro entra o
+sale, solo cambian de dueño las variables de ese miembro (~1/N del total).
+
+La coordinación es por archivos en un directorio local compartido:
+
+    <shard_dir>/members/<member_id>.json   latido de cada miembro (se reescribe
+                                           periódicamente; el mtime indica si está vivo)
+    <shard_dir>/assignment.json            asignación vigente, con número de generación
+
+El coordinador (coordinador_shards.py) lee los latidos, recalcula la asignación
+cuando cambia el conjunto de miembros vivos y la publica; cada worker la relee
+en cada ciclo.
+
+Cambio de dueño: cada miembro informa en su latido la generación que ya aplicó
+(`generation`), después de escribir lo pendiente y soltar las variables que
+perdió. Quien recibe variables no las procesa hasta que todos los miembros
+vivos informan esa generación (`members_behind`); así el dueño anterior ya
+escribió sus resultados y sus marcas de agua, y el nuevo no repite la ventana.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+def _hrw_score(member: str, variable: str) -> int:
+    """Peso de rendezvous de un par (miembro, variable), igual en todos los procesos."""
+    digest = hashlib.md5(f"{member}\x00{variable}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def owner_of(variable: str, members: Iterable[str]) -> Optional[str]:
+    """Miembro dueño de una variable (None si no hay miembros)."""
+    return max(members, key=lambda member: _hrw_score(member, variable), default=None)
+
+
+def assign_variables(variables: Iterable[str], members: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Reparte las variables entre los miembros por hashing de rendezvous
+
+    Retorna:
+    --------
+    Dict[str, List[str]]: variables de cada miembro (ordenadas; lista vacía si no le toca ninguna)
+    """
+    members = sorted(set(members))
+    assignment = {member: [] for member in members}
+    if not members:
+        return assignment
+    for variable in sorted(set(variables)):
+        assignment[owner_of(variable, members)].append(variable)
+    return assignment
+
+
+def _write_json_atomic(path: Path, data: Dict):
+    """Escribe un JSON reemplazando el archivo de una vez (nadie lee un archivo a medias)."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+class ShardMembership:
+    """Latidos de los miembros y asignación publicada en `shard_dir`"""
+
+    ASSIGNMENT_FILE = 'assignment.json'
+    MEMBERS_DIR = 'members'
+
+    def __init__(self, shard_dir: str, heartbeat_seconds: float = 5.0, member_ttl_seconds: Optional[float] = None):
+        """
+        Parámetros:
+        -----------
+        shard_dir : str
+            Directorio compartido entre el coordinador y los workers
+        heartbeat_seconds : float
+            Intervalo entre latidos (default: 5)
+        member_ttl_seconds : Optional[float]
+            Antigüedad máxima del último latido para considerar vivo a un miembro
+            (default: 3 latidos)
+        """
+        self.shard_dir = Path(shard_dir)
+        self.members_dir = self.shard_dir / self.MEMBERS_DIR
+        self.members_dir.mkdir(parents=True, exist_ok=True)
+        self.heartbeat_seconds = heartbeat_seconds
+        self.member_ttl_seconds = member_ttl_seconds or 3 * heartbeat_seconds
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._info: Dict = {}
+
+    # --- Lado del worker ---
+
+    def heartbeat(self, member_id: str, info: Optional[Dict] = None):
+        """Registra (o renueva) un miembro"""
+        data = {'member_id': member_id, 'pid': os.getpid(), 'updated_at': time.time()}
+        data.update(info or {})
+        _write_json_atomic(self.members_dir / f"{member_id}.json", data)
+
+    def start_heartbeat(self, member_id: str, info: Optional[Dict] = None):
+        """Renueva el latido en un hilo aparte mientras el worker está activo"""
+        self._info = dict(info or {})
+        self.heartbeat(member_id, self._info)
+
+        def _loop():
+            while not self._stop_event.wait(self.heartbeat_seconds):
+                try:
+                    self.heartbeat(member_id, self._info)
+                except OSError as e:
+                    print(f"[ADVERTENCIA] No se pudo renovar el latido de {member_id}: {str(e)}")
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=_loop, name='shard-heartbeat', daemon=True)
+        self._thread.start()
+
+    def set_generation(self, member_id: str, generation: Optional[int]):
+        """
+        Informa que el miembro ya aplicó la asignación `generation`: escribió lo
+        pendiente y no procesa más las variables que ya no le tocan
+        """
+        self._info = {**self._info, 'generation': generation}
+        self.heartbeat(member_id, self._info)
+
+    def leave(self, member_id: str):
+        """Detiene el latido y da de baja al miembro (el coordinador reasigna sus variables)"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat_seconds)
+            self._thread = None
+        try:
+            (self.members_dir / f"{member_id}.json").unlink()
+        except FileNotFoundError:
+            pass
+
+    def read_assignment(self) -> Optional[Dict]:
+        """Asignación vigente ({'generation', 'members': {miembro: [variables]}}) o None"""
+        path = self.shard_dir / self.ASSIGNMENT_FILE
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def members_behind(self, generation: int, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        Miembros vivos que todavía no aplicaron la asignación `generation`
+
+        Mientras haya alguno, las variables recibidas en esa generación pueden
+        tener resultados del dueño anterior sin escribir.
+        """
+        exclude = set(exclude)
+        behind = []
+        for member in self.live_members():
+            if member in exclude:
+                continue
+            try:
+                with open(self.members_dir / f"{member}.json", 'r') as f:
+                    applied = json.load(f).get('generation')
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if applied is None or applied < generation:
+                behind.append(member)
+        return behind
+
+    # --- Lado del coordinador ---
+
+    def live_members(self) -> List[str]:
+        """Miembros con un latido reciente"""
+        now = time.time()
+        live = []
+        for path in self.members_dir.glob('*.json'):
+            try:
+                if now - path.stat().st_mtime <= self.member_ttl_seconds:
+                    live.append(path.stem)
+            except FileNotFoundError:
+                continue
+        return sorted(live)
+
+    def publish_assignment(self, variables: Iterable[str], members: Iterable[str]) -> Dict:
+        """Calcula y publica una nueva asignación con la generación siguiente"""
+        previous = self.read_assignment()
+        assignment = {
+            'generation': (previous['generation'] + 1) if previous else 1,
+            'created_at': time.time(),
+            'members': assign_variables(variables, members)
+        }
+        _write_json_atomic(self.shard_dir / self.ASSIGNMENT_FILE, assignment)
+        return assignment
@@ -0,0 +1,339 @@
+"""
+Detección de anomalías por micro-lotes con latencia acotada
+
+El worker procesa los datos nuevos en un único lote por ciclo: el primer punto
+que llega espera a que se lea, pivotee, puntúe y escriba todo el ciclo. Aquí
+los puntos (formato largo: datetime, variable_name, value[, source_file]) se
+acumulan en micro-lotes que se cierran al llegar a `max_batch_points` o cuando
+el punto más antiguo lleva `max_batch_seconds` esperando. Cada micro-lote se
+puntúa con `ProphetAnomalyDetector.detect_anomalies_multiple` (predicción
+vectorizada por variable) y se entrega de inmediato a `emit`.
+
+Por cada punto se registra la latencia desde su ingreso hasta que `emit`
+retorna (p.ej. hasta que la escritura a SQL hizo commit).
+
+El criterio `high_residual` usa el desvío de residuales guardado al entrenar
+(ver residual_stats), así que no depende del tamaño del micro-lote; solo los
+modelos sin esas estadísticas usan el desvío del lote.
+"""
+
+import queue
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from pipeline.scripts.wide_pivot import long_to_wide
+
+
+# Marca interna: venció el plazo del micro-lote abierto
+_DEADLINE = object()
+
+
+class MicroBatchScorer:
+    """
+    Puntúa puntos en micro-lotes en un hilo dedicado.
+
+    Uso:
+        scorer = MicroBatchScorer(detector, emit=escribir, max_batch_points=500, max_batch_seconds=1)
+        scorer.start()
+        scorer.submit(df_long)
+        ...
+        scorer.close()
+        print(scorer.latency_percentiles())
+
+    `emit(results, batch)` recibe los resultados de detect_anomalies_multiple
+    (vacío si ninguna variable del lote tiene modelo) y el micro-lote en formato
+    largo; debe retornar True si los entregó. Los micro-lotes se cortan en límites
+    de datetime y se emiten en orden, así que la marca de agua del último lote
+    emitido (`committed_watermark`) cubre todos los puntos anteriores. Si `emit`
+    falla, los lotes siguientes se descartan hasta llamar a `reset`, igual que en
+    AsyncTableWriter.
+    """
+
+    def __init__(self,
+                 detector,
+                 emit: Callable[[pd.DataFrame, pd.DataFrame], bool],
+                 max_batch_points: int = 1000,
+                 max_batch_seconds: float = 1.0,
+                 n_jobs: int = 1,
+                 max_queue: int = 64,
+                 latency_window: int = 100000,
+                 initial_watermark=None):
+        """
+        Parámetros:
+        -----------
+        detector : ProphetAnomalyDetector
+            Detector con los modelos cargados
+        emit : Callable[[pd.DataFrame, pd.DataFrame], bool]
+            Recibe (resultados, micro-lote en formato largo) y retorna True si los entregó
+        max_batch_points : int
+            Puntos que cierran un micro-lote (default: 1000)
+        max_batch_seconds : float
+            Espera máxima del punto más antiguo antes de cerrar el micro-lote (default: 1)
+        n_jobs : int
+            Hilos de inferencia por micro-lote (default: 1)
+        max_queue : int
+            Máximo de envíos sin tomar; `submit` bloquea si se llena (default: 64)
+        latency_window : int
+            Cantidad de latencias recientes conservadas para los percentiles (default: 100000)
+        initial_watermark
+            Marca de agua ya entregada al iniciar
+        """
+        self.detector = detector
+        self.emit = emit
+        self.max_batch_points = max(1, max_batch_points)
+        self.max_batch_seconds = max_batch_seconds
+        self.n_jobs = n_jobs
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._outstanding = 0  # envíos aceptados y todavía no emitidos ni descartados
+        self._committed_watermark = initial_watermark
+        self._error = None
+        self._generation = 0  # se incrementa en reset; los envíos anteriores se descartan
+        self._thread = None
+
+        self._latencies = np.empty(max(1, latency_window), dtype=np.float64)
+        self._n_latencies = 0
+
+        self.batches_emitted = 0
+        self.points_emitted = 0
+        self.points_discarded = 0
+        self.score_seconds = 0.0
+        self.emit_seconds = 0.0
+
+    def start(self):
+        """Inicia el hilo de scoring"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='micro-batch-scorer', daemon=True)
+        self._thread.start()
+
+    def submit(self, df_long: pd.DataFrame, ingested_at=None) -> bool:
+        """
+        Agrega puntos en formato largo
+
+        Parámetros:
+        -----------
+        df_long : pd.DataFrame
+            Puntos con columnas datetime, variable_name, value (y opcionalmente source_file)
+        ingested_at : float o array, optional
+            Instante (time.time()) en que ingresó cada punto; por defecto, ahora
+
+        Retorna:
+        --------
+        bool: False si el scorer está en error (los puntos no se aceptan)
+        """
+        if self.error is not None:
+            return False
+        if df_long is None or len(df_long) == 0:
+            return True
+        now = time.time()
+        batch = df_long.copy()
+        batch['datetime'] = pd.to_datetime(batch['datetime'])
+        batch['_ingested_at'] = now if ingested_at is None else ingested_at
+        batch['_arrived_at'] = now
+        with self._lock:
+            self._outstanding += 1
+            generation = self._generation
+        self._queue.put((generation, batch))
+        return True
+
+    def _run(self):
+        pending = []
+        opened = None  # llegada del punto pendiente más antiguo
+        while True:
+            timeout = None if opened is None else max(0.0, opened + self.max_batch_seconds - time.time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = _DEADLINE
+
+            if item is None:
+                if pending:
+                    self._emit_pending(pending, force=True)
+                return
+
+            with self._lock:
+                generation = self._generation
+            if pending and pending[0][0] != generation:
+                self._discard(pending)
+                pending = []
+            if item is not _DEADLINE:
+                if item[0] != generation:
+                    self._discard([item])
+                else:
+                    pending.append(item)
+
+            # Cerrar micro-lotes por tamaño y, vencido el plazo, todo lo pendiente
+            expired = opened is not None and time.time() >= opened + self.max_batch_seconds
+            if pending and (expired or sum(len(df) for _, df in pending) >= self.max_batch_points):
+                pending = self._emit_pending(pending, force=expired)
+            opened = min(df['_arrived_at'].min() for _, df in pending) if pending else None
+
+    def _discard(self, items):
+        with self._lock:
+            self.points_discarded += sum(len(df) for _, df in items)
+        self._done(len(items))
+
+    def _emit_pending(self, pending, force: bool):
+        """Emite micro-lotes completos (o todo, con `force`) y retorna lo que queda pendiente."""
+        generation = pending[0][0]
+        data = pd.concat([df for _, df in pending], ignore_index=True) if len(pending) > 1 else pending[0][1]
+        data = data.sort_values('datetime', kind='stable', ignore_index=True)
+        n_submits = len(pending)
+
+        while len(data) >= self.max_batch_points or (force and len(data) > 0):
+            cut = min(self.max_batch_points, len(data))
+            if cut < len(data):
+                # No partir un datetime entre dos lotes: la marca de agua es por datetime
+                ds = data['datetime'].to_numpy()
+                cut = int(np.searchsorted(ds, ds[cut - 1], side='right'))
+            self._emit_batch(data.iloc[:cut])
+            data = data.iloc[cut:].reset_index(drop=True)
+
+        if len(data) == 0:
+            self._done(n_submits)
+            return []
+        # Lo pendiente queda como un único envío
+        self._done(n_submits - 1)
+        return [(generation, data)]
+
+    def _emit_batch(self, batch: pd.DataFrame):
+        if self.error is not None:
+            with self._lock:
+                self.points_discarded += len(batch)
+            return
+
+        points = batch.drop(columns=['_ingested_at', '_arrived_at'])
+        try:
+            start = time.time()
+            results = self._score(points)
+            self.score_seconds += time.time() - start
+            start = time.time()
+            success = self.emit(results, points)
+            self.emit_seconds += time.time() - start
+        except Exception as e:
+            print(f"[ERROR] Error en scoring por micro-lotes: {str(e)}")
+            success = False
+
+        if not success:
+            with self._lock:
+                self._error = (f"No se pudo entregar un micro-lote de {len(batch):,} puntos "
+                               f"(desde {batch['datetime'].iloc[0]})")
+                self.points_discarded += len(batch)
+            print(f"[ERROR] {self._error}")
+            sys.stdout.flush()
+            return
+
+        now = time.time()
+        with self._lock:
+            self._record_latencies(now - batch['_ingested_at'].to_numpy(dtype=np.float64))
+            self._committed_watermark = batch['datetime'].iloc[-1]
+            self.batches_emitted += 1
+            self.points_emitted += len(batch)
+
+    def _score(self, points: pd.DataFrame) -> pd.DataFrame:
+        """Puntúa un micro-lote con los modelos del detector."""
+        df_wide = long_to_wide(points).reset_index().rename(columns={'datetime': 'DATETIME'})
+        variables = [v for v in df_wide.columns[1:] if v in self.detector.models]
+        if not variables:
+            return pd.DataFrame()
+        return self.detector.detect_anomalies_multiple(
+            df=df_wide,
+            variables=variables,
+            datetime_col='DATETIME',
+            combine_results=True,
+            n_jobs=self.n_jobs,
+            verbose=False
+        )
+
+    def _record_latencies(self, values: np.ndarray):
+        size = len(self._latencies)
+        values = values[-size:]
+        idx = (self._n_latencies + np.arange(len(values))) % size
+        self._latencies[idx] = values
+        self._n_latencies += len(values)
+
+    def _done(self, n_submits: int):
+        with self._lock:
+            self._outstanding -= n_submits
+            if self._outstanding <= 0:
+                self._idle.notify_all()
+
+    @property
+    def committed_watermark(self):
+        """Último datetime del último micro-lote entregado"""
+        with self._lock:
+            return self._committed_watermark
+
+    @property
+    def error(self) -> Optional[str]:
+        """Descripción del error que detuvo la entrega, o None"""
+        with self._lock:
+            return self._error
+
+    def reset(self):
+        """
+        Limpia el error y retorna la marca de agua entregada
+
+        Los puntos enviados antes del reset que todavía no se emitieron se
+        descartan; el productor debe reenviar desde la marca retornada.
+        """
+        with self._lock:
+            self._error = None
+            self._generation += 1
+            return self._committed_watermark
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera a que se emita todo lo enviado (sin esperar al plazo del micro-lote abierto
+        más allá de `max_batch_seconds`)
+
+        Retorna:
+        --------
+        bool: True si no quedan puntos pendientes
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: self._outstanding <= 0, timeout=timeout)
+
+    def close(self):
+        """Emite lo pendiente y detiene el hilo"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def latency_percentiles(self, percentiles=(50, 95, 99)) -> Dict:
+        """Percentiles de latencia ingreso-entrega (segundos) de los puntos recientes"""
+        with self._lock:
+            n = min(self._n_latencies, len(self._latencies))
+            values = self._latencies[:n].copy()
+        if n == 0:
+            return {}
+        result = {f'p{p}': float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))}
+        result['max'] = float(values.max())
+        result['count'] = n
+        return result
+
+    def stats(self) -> Dict:
+        """Contadores del scorer"""
+        with self._lock:
+            stats = {
+                'batches_emitted': self.batches_emitted,
+                'points_emitted': self.points_emitted,
+                'points_discarded': self.points_discarded,
+                'pending_submits': self._outstanding,
+                'score_seconds': self.score_seconds,
+                'emit_seconds': self.emit_seconds,
+                'committed_watermark': self._committed_watermark,
+                'error': self._error
+            }
+        stats['latency'] = self.latency_percentiles()
+        return stats
@@ -4,6 +4,7 @@ Versión adaptada para datos de Argentina
 """
 
 import sys
+import argparse
 from pathlib import Path
 import pandas as pd
 
@@ -11,20 +12,53 @@ import pandas as pd
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
 from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+from pipeline.scripts.columnar_io import find_data_files, iter_data_files
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Entrena el detector de anomalías con los datos limpios del protocolo',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos:
+  # Todos los *_cleaned.parquet / *_cleaned.csv de output/
+  python pipeline/scripts/train_anomaly_detector.py
+
+  # Solo algunas variables y un rango de fechas (con Parquet se leen solo esas columnas y filas)
+  python pipeline/scripts/train_anomaly_detector.py --variables TAG-001 TAG-002 --start 2024-01-01 --end 2024-06-30
+        """
+    )
+    parser.add_argument('--data-dir', type=str, default='output',
+                       help='Directorio con los archivos *_cleaned (default: output)')
+    parser.add_argument('--models-dir', type=str, default='pipeline/models/prophet',
+                       help='Directorio donde guardar los modelos (default: pipeline/models/prophet)')
+    parser.add_argument('--variables', nargs='+', default=None,
+                       help='Variables a entrenar (default: todas las de los archivos)')
+    parser.add_argument('--start', type=str, default=None,
+                       help='Fecha inicial de los datos de entrenamiento (default: sin límite)')
+    parser.add_argument('--end', type=str, default=None,
+                       help='Fecha final de los datos de entrenamiento, inclusive (YYYY-MM-DD incluye el día completo; default: sin límite)')
+    parser.add_argument('--save-pickles', action='store_true',
+                       help='Guardar también el pickle completo de cada modelo Prophet (default: solo el almacén compacto)')
+    parser.add_argument('--validate-store', action='store_true',
+                       help='Comparar cada modelo con Prophet.predict antes de guardarlo; los que no pasan se guardan en pickle (más lento)')
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
+
     print("="*80)
     print("ENTRENAMIENTO DE DETECTOR DE ANOMALÍAS CON PROPHET - ARGENTINA")
     print("="*80)
     
     # Configuración
-    data_dir = Path("output")  # Datos limpios del protocolo
-    models_dir = Path("pipeline/models/prophet")
+    data_dir = Path(args.data_dir)  # Datos limpios del protocolo
+    models_dir = Path(args.models_dir)
     datetime_col = 'DATETIME'
     
-    # Encontrar archivos de datos limpios
-    cleaned_files = list(data_dir.glob("*_cleaned.csv"))
+    # Encontrar archivos de datos limpios (.parquet o .csv)
+    cleaned_files = find_data_files(data_dir)
     
     if not cleaned_files:
         print(f"\n[ERROR] No se encontraron archivos de datos limpios en {data_dir}")
@@ -36,21 +70,31 @@ def main():
     for f in cleaned_files:
         print(f"   - {f.name}")
     
-    # Usar el archivo más reciente o combinar múltiples archivos
-    if len(cleaned_files) == 1:
-        data_file = cleaned_files[0]
-        print(f"\n[INFO] Cargando datos de: {data_file.name}")
-        df = pd.read_csv(data_file, parse_dates=[datetime_col])
-    else:
-        # Combinar múltiples archivos
-        print(f"\n[INFO] Combinando {len(cleaned_files)} archivos...")
-        dfs = []
-        for f in cleaned_files:
-            df_temp = pd.read_csv(f, parse_dates=[datetime_col])
+    # Leer de a un archivo, solo las variables y fechas pedidas
+    if args.variables:
+        print(f"\n[INFO] Variables pedidas: {len(args.variables)}")
+    if args.start or args.end:
+        print(f"[INFO] Rango de fechas: {args.start or 'inicio'} a {args.end or 'fin'}")
+    dfs = []
+    for data_file, df_temp in iter_data_files(cleaned_files, columns=args.variables, datetime_col=datetime_col,
+                                              start=args.start, end=args.end):
+        print(f"[INFO] Cargando datos de: {data_file.name} ({len(df_temp)} filas)")
+        if len(df_temp) > 0:
             dfs.append(df_temp)
-        
-        # Combinar y eliminar duplicados
+    
+    if not dfs:
+        print("\n[ERROR] No hay datos en el rango de fechas indicado")
+        return
+    
+    if len(dfs) == 1:
+        df = dfs[0]
+    else:
+        # Combinar múltiples archivos (ya reducidos a las columnas y fechas pedidas)
+        print(f"\n[INFO] Combinando {len(dfs)} archivos...")
         df = pd.concat(dfs, ignore_index=True)
+        del dfs
+        
+        # Eliminar duplicados
         df = df.drop_duplicates(subset=[datetime_col], keep='last')
         df = df.sort_values(datetime_col).reset_index(drop=True)
         print(f"   Total de registros: {len(df)}")
@@ -60,6 +104,10 @@ def main():
     
     # Seleccionar variables (excluir datetime)
     variables = [col for col in df.columns if col != datetime_col]
+    if args.variables:
+        missing = [var for var in args.variables if var not in variables]
+        if missing:
+            print(f"\n[ADVERTENCIA] Variables sin datos: {', '.join(missing[:10])}")
     
     print(f"\n[OK] Entrenando modelos para {len(variables)} variables")
     
@@ -101,7 +149,7 @@ def main():
     print("="*80)
     
     try:
-        detector.save_models(str(models_dir))
+        detector.save_models(str(models_dir), save_pickles=args.save_pickles, validate=args.validate_store)
         print(f"\n[OK] Modelos guardados exitosamente en: {models_dir}")
     except Exception as e:
         print(f"\n[ERROR] Error guardando modelos: {str(e)}")
@@ -0,0 +1,156 @@
+"""
+Conversión de formato largo (datetime, variable_name, value) a formato ancho
+
+Reemplaza `pivot_table(index='datetime', columns='variable_name',
+values='value', aggfunc='first')`, que agrupa todo el formato largo y
+necesita tenerlo completo en memoria junto con el resultado.
+
+`LongToWidePivot` recibe el formato largo por bloques (p.ej. los que entrega
+`SQLConnection.execute_query_chunked`): cada bloque se factoriza en códigos
+enteros de fila (datetime) y columna (variable) y sus valores se escriben
+directamente en una matriz NumPy. Solo se conservan las matrices ya
+pivoteadas, y al final se combinan en una única matriz preasignada.
+
+Mantiene la semántica de pivot_table con aggfunc='first': los valores nulos
+se ignoran, ante duplicados gana el primero en orden de llegada, y no quedan
+filas ni columnas sin ningún valor.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+
+
+class LongToWidePivot:
+    """
+    Pivot incremental de formato largo a ancho.
+
+    Uso:
+        pivot = LongToWidePivot()
+        for chunk in chunks:
+            pivot.add(chunk)
+        df_wide = pivot.result()
+    """
+
+    def __init__(self,
+                 index_col: str = 'datetime',
+                 columns_col: str = 'variable_name',
+                 values_col: str = 'value',
+                 dtype=np.float64):
+        """
+        Parámetros:
+        -----------
+        index_col : str
+            Columna que forma las filas del resultado
+        columns_col : str
+            Columna cuyos valores forman las columnas del resultado
+        values_col : str
+            Columna con los valores
+        dtype : numpy dtype
+            Tipo de la matriz de valores (np.float32 reduce la memoria a la mitad)
+        """
+        self.index_col = index_col
+        self.columns_col = columns_col
+        self.values_col = values_col
+        self.dtype = np.dtype(dtype)
+
+        self._column_codes: Dict[object, int] = {}
+        self._column_names: List[object] = []
+        # Bloques ya pivoteados: (timestamps únicos ordenados, matriz filas x columnas conocidas)
+        self._blocks: List[tuple] = []
+        self.n_rows = 0
+
+    def add(self, chunk: pd.DataFrame):
+        """Agrega un bloque en formato largo."""
+        self.n_rows += len(chunk)
+
+        values = chunk[self.values_col].to_numpy(dtype=self.dtype, na_value=np.nan)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return
+        values = values[valid]
+
+        # Códigos de columna: se factoriza el bloque y solo los nombres únicos pasan por el dict
+        name_codes, names = pd.factorize(chunk[self.columns_col].to_numpy()[valid])
+        mapping = np.empty(len(names), dtype=np.int64)
+        for i, name in enumerate(names):
+            code = self._column_codes.get(name)
+            if code is None:
+                code = len(self._column_names)
+                self._column_codes[name] = code
+                self._column_names.append(name)
+            mapping[i] = code
+        cols = mapping[name_codes]
+
+        rows, timestamps = pd.factorize(chunk[self.index_col].to_numpy()[valid], sort=True)
+        n_cols = len(self._column_names)
+
+        # aggfunc='first': ante pares (fila, columna) repetidos se conserva la primera aparición
+        keys = rows.astype(np.int64) * n_cols + cols
+        first = ~pd.Series(keys).duplicated(keep='first').to_numpy()
+        if not first.all():
+            rows, cols, values = rows[first], cols[first], values[first]
+
+        matrix = np.full((len(timestamps), n_cols), np.nan, dtype=self.dtype)
+        matrix[rows, cols] = values
+        self._blocks.append((np.asarray(timestamps), matrix))
+
+    def result(self) -> pd.DataFrame:
+        """
+        Retorna el formato ancho con filas y columnas ordenadas, como pivot_table.
+
+        Los bloques se liberan a medida que se copian a la matriz final, así que
+        después de llamar a este método el pivot queda vacío.
+        """
+        n_cols = len(self._column_names)
+        if not self._blocks:
+            return pd.DataFrame(
+                index=pd.Index([], name=self.index_col),
+                columns=pd.Index([], name=self.columns_col),
+                dtype=self.dtype
+            )
+
+        # Un mismo timestamp puede aparecer en varios bloques (cortes a mitad de un datetime)
+        all_timestamps = np.unique(np.concatenate([ts for ts, _ in self._blocks]))
+        wide = np.full((len(all_timestamps), n_cols), np.nan, dtype=self.dtype)
+
+        # Del último bloque al primero: los valores de bloques anteriores pisan a los
+        # posteriores, de modo que gana la primera aparición igual que dentro de un bloque
+        while self._blocks:
+            timestamps, matrix = self._blocks.pop()
+            rows = np.searchsorted(all_timestamps, timestamps)
+            k = matrix.shape[1]
+            present = ~np.isnan(matrix)
+            target = wide[rows, :k]
+            target[present] = matrix[present]
+            wide[rows, :k] = target
+
+        order = np.argsort(np.asarray(self._column_names, dtype=object).astype(str), kind='stable')
+        columns = pd.Index([self._column_names[i] for i in order], name=self.columns_col)
+        return pd.DataFrame(wide[:, order], index=pd.Index(all_timestamps, name=self.index_col),
+                            columns=columns)
+
+
+def long_to_wide(df_long: pd.DataFrame,
+                 index_col: str = 'datetime',
+                 columns_col: str = 'variable_name',
+                 values_col: str = 'value',
+                 dtype=np.float64) -> pd.DataFrame:
+    """
+    Equivalente a `df_long.pivot_table(index=..., columns=..., values=..., aggfunc='first')`.
+
+    Parámetros:
+    -----------
+    df_long : pd.DataFrame
+        Datos en formato largo
+    dtype : numpy dtype
+        Tipo de los valores del resultado
+
+    Retorna:
+    --------
+    pd.DataFrame en formato ancho con `index_col` como índice
+    """
+    pivot = LongToWidePivot(index_col, columns_col, values_col, dtype)
+    pivot.add(df_long)
+    return pivot.result()
+
@@ -2,11 +2,13 @@
 Utilidades para conexión y operaciones con SQL Server
 """
 
+# pyodbc solo hace falta al conectar: sin él se pueden importar este módulo y
+# las fuentes de datos simuladas (p. ej. change_feed.FakeProcessDataSource)
 try:
     import pyodbc
+    PYODBC_AVAILABLE = True
 except ImportError:
-    print("[ERROR] pyodbc no está instalado. Ejecuta: pip install pyodbc")
-    raise
+    PYODBC_AVAILABLE = False
 
 try:
     from sqlalchemy import create_engine
@@ -16,8 +18,16 @@ except ImportError:
     print("[ADVERTENCIA] SQLAlchemy no está instalado. Usando método alternativo.")
 
 import pandas as pd
-from typing import Optional
+import numpy as np
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
 import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 
 
 class SQLConnection:
@@ -56,6 +66,9 @@ class SQLConnection:
     
     def connect(self):
         """Establece conexión a la base de datos"""
+        if not PYODBC_AVAILABLE:
+            print("[ERROR] pyodbc no está instalado. Ejecuta: pip install pyodbc")
+            return False
         try:
             self._conn = pyodbc.connect(self.connection_string)
             print(f"[OK] Conectado a SQL Server: {self.server}")
@@ -70,6 +83,19 @@ class SQLConnection:
             self._conn.close()
             self._conn = None
     
+    def is_alive(self) -> bool:
+        """Verifica que la conexión responda (SELECT 1)"""
+        if self._conn is None:
+            return False
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+    
     def execute_query(self, query: str) -> Optional[pd.DataFrame]:
         """
         Ejecuta una consulta SELECT y retorna un DataFrame
@@ -90,6 +116,48 @@ class SQLConnection:
             print(f"[ERROR] Error ejecutando query: {str(e)}")
             return None
     
+    def execute_query_chunked(self, query: str, chunk_size: int = 100000,
+                              dtypes: Optional[Dict[str, str]] = None) -> Iterator[pd.DataFrame]:
+        """
+        Ejecuta una consulta SELECT y retorna el resultado en bloques de `chunk_size` filas
+        
+        Las filas se leen del cursor con fetchmany, así que en memoria solo hay un
+        bloque a la vez (execute_query arma el resultado completo con pd.read_sql).
+        
+        Parámetros:
+        -----------
+        query : str
+            Consulta SQL
+        chunk_size : int
+            Filas por bloque (default: 100000)
+        dtypes : Optional[Dict[str, str]]
+            Tipo de cada columna, p.ej. {'value': 'float64'} (el resto se infiere)
+            
+        Retorna:
+        --------
+        Iterator[pd.DataFrame] con las mismas columnas en cada bloque
+        
+        A diferencia de execute_query, un error a mitad de la lectura se propaga
+        (después de informarlo) para no entregar un resultado incompleto.
+        """
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(query)
+            columns = [col[0] for col in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                chunk = pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+                if dtypes:
+                    chunk = chunk.astype({col: dtype for col, dtype in dtypes.items() if col in chunk.columns})
+                yield chunk
+        except Exception as e:
+            print(f"[ERROR] Error ejecutando query: {str(e)}")
+            raise
+        finally:
+            cursor.close()
+    
     def execute_non_query(self, query: str) -> bool:
         """
         Ejecuta una consulta que no retorna datos (INSERT, UPDATE, DELETE, CREATE, etc.)
@@ -115,7 +183,8 @@ class SQLConnection:
             return False
     
     def write_dataframe(self, df: pd.DataFrame, table_name: str, schema: str = "dbo", 
-                       if_exists: str = "append", index: bool = False) -> bool:
+                       if_exists: str = "append", index: bool = False,
+                       before_commit: Optional[Callable] = None) -> bool:
         """
         Escribe un DataFrame a una tabla SQL
         
@@ -131,6 +200,9 @@ class SQLConnection:
             'append', 'replace', o 'fail' (default: append)
         index : bool
             Si escribir el índice (default: False)
+        before_commit : Optional[Callable]
+            Función que recibe el cursor y se ejecuta en la misma transacción,
+            justo antes del commit (p.ej. WatermarkStore.apply)
             
         Retorna:
         --------
@@ -143,8 +215,10 @@ class SQLConnection:
             # pandas.to_sql con method='multi' tiene problemas con muchos parámetros en SQL Server
             # Inserción manual con pyodbc (más confiable para SQL Server)
             if df.empty:
-                print(f"[ADVERTENCIA] DataFrame vacío")
-                return True
+                # Un lote sin filas puede igual avanzar las marcas de agua (tramo vacío)
+                if before_commit is None:
+                    print(f"[ADVERTENCIA] DataFrame vacío")
+                return self._commit_only(before_commit)
             
             columns = list(df.columns)
             placeholders = ','.join(['?' for _ in columns])
@@ -198,6 +272,15 @@ class SQLConnection:
                     print(f"  Progreso: {total_inserted:,}/{total_rows:,} filas ({pct:.1f}%) - {rate:.0f} filas/seg")
                     sys.stdout.flush()
             
+            if before_commit is not None:
+                try:
+                    before_commit(cursor)
+                except Exception as e:
+                    print(f"\n[ERROR] Error antes del commit: {str(e)}")
+                    self._conn.rollback()
+                    cursor.close()
+                    return False
+            
             self._conn.commit()
             cursor.close()
             elapsed = time.time() - start_time
@@ -210,6 +293,163 @@ class SQLConnection:
             traceback.print_exc()
             return False
     
+    def write_dataframe_bulk(self, df: pd.DataFrame, table_name: str, schema: str = "dbo",
+                             batch_size: int = 50000, min_batch_size: int = 5000,
+                             max_batch_size: int = 500000, target_batch_seconds: float = 2.0,
+                             before_commit: Optional[Callable] = None) -> bool:
+        """
+        Escribe un DataFrame en una tabla existente mediante una tabla de staging
+        
+        Las filas se cargan en lotes grandes (executemany con fast_executemany) en una
+        tabla temporal de la sesión (#<tabla>_staging) con las mismas columnas, y luego
+        se pasan al destino con un único INSERT ... SELECT. El destino recibe todas las
+        filas o ninguna, y los índices de la tabla de destino se actualizan una sola vez.
+        Si el proceso se cae, SQL Server elimina la tabla temporal al cerrar la sesión.
+        
+        Los valores de cada lote se convierten a tipos de Python recién al enviarlo,
+        así no se tiene una copia completa del DataFrame como objetos en memoria.
+        
+        El tamaño del lote se ajusta según el tiempo de cada lote: se duplica si tarda
+        menos de la mitad de `target_batch_seconds` y se reduce a la mitad si tarda más
+        del doble, siempre entre `min_batch_size` y `max_batch_size`.
+        
+        Parámetros:
+        -----------
+        df : pd.DataFrame
+            DataFrame a escribir (las columnas deben existir en la tabla)
+        table_name : str
+            Nombre de la tabla de destino
+        schema : str
+            Schema (default: dbo)
+        batch_size : int
+            Filas del primer lote (default: 50000)
+        min_batch_size, max_batch_size : int
+            Límites del tamaño de lote adaptativo
+        target_batch_seconds : float
+            Duración buscada de cada lote en segundos (default: 2.0)
+        before_commit : Optional[Callable]
+            Función que recibe el cursor y se ejecuta en la misma transacción,
+            justo antes del commit (p.ej. WatermarkStore.apply)
+            
+        Retorna:
+        --------
+        bool: True si fue exitoso, False si hubo error
+        """
+        if df.empty:
+            if before_commit is None:
+                print(f"[ADVERTENCIA] DataFrame vacío")
+            return self._commit_only(before_commit)
+        
+        full_table_name = f"{schema}.{table_name}"
+        columns = list(df.columns)
+        columns_str = ','.join([f'[{col}]' for col in columns])
+        placeholders = ','.join(['?' for _ in columns])
+        total_rows = len(df)
+        
+        cursor = self._conn.cursor()
+        try:
+            cursor.fast_executemany = True
+        except:
+            pass  # Algunas versiones de pyodbc no lo soportan
+        
+        start_time = time.time()
+        staging = None
+        try:
+            staging = self._create_staging_table(cursor, schema, table_name, columns_str)
+            
+            insert_query = f"INSERT INTO {staging} ({columns_str}) VALUES ({placeholders})"
+            
+            position = 0
+            while position < total_rows:
+                end = min(position + batch_size, total_rows)
+                batch = df.iloc[position:end]
+                rows = list(zip(*[self._column_buffer(batch[col]) for col in columns]))
+                del batch
+                
+                batch_start = time.time()
+                cursor.executemany(insert_query, rows)
+                batch_seconds = time.time() - batch_start
+                position = end
+                
+                if batch_seconds < target_batch_seconds / 2:
+                    batch_size = min(batch_size * 2, max_batch_size)
+                elif batch_seconds > target_batch_seconds * 2:
+                    batch_size = max(batch_size // 2, min_batch_size)
+            
+            cursor.execute(
+                f"INSERT INTO [{schema}].[{table_name}] ({columns_str}) "
+                f"SELECT {columns_str} FROM {staging}"
+            )
+            self._drop_staging_table(cursor, staging)
+            if before_commit is not None:
+                before_commit(cursor)
+            self._conn.commit()
+        except Exception as e:
+            print(f"[ERROR] Error escribiendo a {full_table_name}: {str(e)}")
+            self._conn.rollback()
+            if staging is not None:
+                try:
+                    self._drop_staging_table(cursor, staging)
+                    self._conn.commit()
+                except Exception:
+                    pass
+            return False
+        finally:
+            cursor.close()
+        
+        elapsed = time.time() - start_time
+        rate = total_rows / elapsed if elapsed > 0 else 0
+        print(f"[OK] {total_rows:,} filas escritas en {full_table_name} en {elapsed:.1f} segundos ({rate:.0f} filas/seg)")
+        sys.stdout.flush()
+        return True
+    
+    def _commit_only(self, before_commit: Optional[Callable]) -> bool:
+        """Ejecuta `before_commit` en su propia transacción (lote sin filas)"""
+        if before_commit is None:
+            return True
+        cursor = self._conn.cursor()
+        try:
+            before_commit(cursor)
+            self._conn.commit()
+            return True
+        except Exception as e:
+            print(f"[ERROR] Error antes del commit: {str(e)}")
+            self._conn.rollback()
+            return False
+        finally:
+            cursor.close()
+    
+    def _create_staging_table(self, cursor, schema: str, table_name: str, columns_str: str) -> str:
+        """
+        Crea (vacía) la tabla temporal de staging con las columnas y tipos del destino
+        
+        Retorna:
+        --------
+        str: Nombre de la tabla para usar en las consultas
+        """
+        staging = f"[#{table_name}_staging]"
+        self._drop_staging_table(cursor, staging)
+        cursor.execute(f"SELECT TOP 0 {columns_str} INTO {staging} FROM [{schema}].[{table_name}]")
+        return staging
+    
+    def _drop_staging_table(self, cursor, staging: str):
+        """Elimina la tabla temporal de staging si existe"""
+        cursor.execute(f"IF OBJECT_ID('tempdb..{staging.strip('[]')}') IS NOT NULL DROP TABLE {staging}")
+    
+    @staticmethod
+    def _column_buffer(series: pd.Series) -> List:
+        """Valores de un lote de una columna como lista de tipos nativos de Python (NaN/NaT -> None)"""
+        if pd.api.types.is_bool_dtype(series):
+            return series.astype(int).tolist()
+        if series.dtype.kind in 'iu':
+            return series.tolist()
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = np.array(series.dt.to_pydatetime(), dtype=object)
+        else:
+            values = series.to_numpy(dtype=object)
+        values[pd.isna(series).to_numpy()] = None
+        return values.tolist()
+    
     def create_table_if_not_exists(self, table_name: str, schema: str = "dbo", 
                                    columns: dict = None) -> bool:
         """
@@ -270,3 +510,543 @@ class SQLConnection:
         """Context manager exit"""
         self.disconnect()
 
+
+
+class WatermarkStore:
+    """
+    Marcas de agua persistentes por worker y variable
+    
+    Guarda en una tabla pequeña el último datetime procesado, de modo que un worker
+    retoma desde su propio punto de control sin consultar MAX() sobre las tablas de
+    datos o de resultados. Las marcas se actualizan con `apply` dentro de la misma
+    transacción que escribe los resultados, así que nunca adelantan a las filas.
+    
+    La fila con variable = GLOBAL ('*') es la marca de lectura del worker: el último
+    datetime de entrada que cubre el lote escrito, tenga o no modelo cada variable.
+    Varios workers que se reparten las variables comparten `worker_id` (así una
+    variable que cambia de dueño conserva su marca) y cada uno usa su propia fila
+    global ('*<miembro>').
+    """
+    
+    GLOBAL = '*'
+    
+    def __init__(self, sql_conn: SQLConnection, worker_id: str,
+                 table_name: str = "ypf_anomaly_watermark", schema: str = "dbo",
+                 global_variable: str = GLOBAL):
+        """
+        Parámetros:
+        -----------
+        sql_conn : SQLConnection
+            Conexión a la base de datos de salida (para crear la tabla y leer marcas)
+        worker_id : str
+            Identificador del worker dueño de las marcas
+        table_name : str
+            Tabla de marcas (default: ypf_anomaly_watermark)
+        schema : str
+            Schema (default: dbo)
+        global_variable : str
+            Clave de la fila con la marca de lectura (default: GLOBAL); debe empezar con GLOBAL
+        """
+        self.sql_conn = sql_conn
+        self.worker_id = worker_id
+        self.table_name = table_name
+        self.schema = schema
+        self.global_variable = global_variable
+    
+    def create_table(self) -> bool:
+        """Crea la tabla de marcas si no existe"""
+        return self.sql_conn.execute_non_query(f"""
+            IF OBJECT_ID('{self.schema}.{self.table_name}', 'U') IS NULL
+            CREATE TABLE [{self.schema}].[{self.table_name}] (
+                worker_id VARCHAR(100) NOT NULL,
+                variable VARCHAR(100) NOT NULL,
+                last_ds DATETIME NOT NULL,
+                updated_at DATETIME DEFAULT GETDATE(),
+                CONSTRAINT pk_{self.table_name} PRIMARY KEY (worker_id, variable)
+            )
+        """)
+    
+    def load(self) -> Dict[str, pd.Timestamp]:
+        """
+        Lee las marcas del worker
+        
+        Retorna:
+        --------
+        Dict[str, pd.Timestamp]: último datetime por variable (incluye las filas globales)
+        """
+        cursor = self.sql_conn._conn.cursor()
+        try:
+            cursor.execute(
+                f"SELECT variable, last_ds FROM [{self.schema}].[{self.table_name}] WHERE worker_id = ?",
+                self.worker_id
+            )
+            return {variable: pd.Timestamp(last_ds) for variable, last_ds in cursor.fetchall()}
+        finally:
+            cursor.close()
+    
+    def apply(self, cursor, watermarks: Dict[str, datetime]):
+        """
+        Avanza las marcas indicadas usando el cursor de la transacción en curso
+        
+        Una marca nunca retrocede: si la guardada es posterior, se conserva.
+        """
+        if not watermarks:
+            return
+        rows = [(self.worker_id, variable, pd.Timestamp(last_ds).to_pydatetime())
+                for variable, last_ds in watermarks.items()]
+        cursor.executemany(f"""
+            MERGE [{self.schema}].[{self.table_name}] AS t
+            USING (SELECT ? AS worker_id, ? AS variable, ? AS last_ds) AS s
+            ON t.worker_id = s.worker_id AND t.variable = s.variable
+            WHEN MATCHED AND t.last_ds < s.last_ds THEN
+                UPDATE SET last_ds = s.last_ds, updated_at = GETDATE()
+            WHEN NOT MATCHED THEN
+                INSERT (worker_id, variable, last_ds) VALUES (s.worker_id, s.variable, s.last_ds);
+        """, rows)
+    
+    @classmethod
+    def is_global(cls, variable: str) -> bool:
+        """Si una clave de `load` es una marca global (de este u otro miembro)"""
+        return variable.startswith(cls.GLOBAL)
+    
+    def updater(self, global_watermark, variable_watermarks: Optional[Dict] = None) -> Callable:
+        """Función para `before_commit` que guarda las marcas de un lote"""
+        watermarks = dict(variable_watermarks or {})
+        if global_watermark is not None:
+            watermarks[self.global_variable] = global_watermark
+        return lambda cursor: self.apply(cursor, watermarks)
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones SQLConnection compartido entre hilos
+    
+    Cada conexión la usa un solo hilo a la vez (pyodbc no permite compartir una
+    conexión entre hilos): se pide con `connection()` y se devuelve al salir del
+    bloque. Se mantienen al menos `min_size` conexiones abiertas y como máximo
+    `max_size`; si están todas en uso, la solicitud espera hasta `checkout_timeout`.
+    
+    Las `min_size` conexiones iniciales se abren con un solo intento: si el
+    servidor no responde, el constructor falla enseguida con ConnectionError. Las
+    que se abren al pedir una conexión reintentan con espera exponencial, igual
+    que la reconexión de una conexión ociosa por más de `probe_after_seconds`
+    que no responde al verificarla.
+    
+    Uso:
+        pool = ConnectionPool(**SQL_CONFIG, max_size=4)
+        with pool.connection() as conn:
+            df = conn.execute_query(query)
+    """
+    
+    def __init__(self, server: str, database: str, username: str, password: str, port: int = 1433,
+                 min_size: int = 1, max_size: int = 5, checkout_timeout: float = 30.0,
+                 probe_after_seconds: float = 60.0, max_reconnect_attempts: int = 5,
+                 reconnect_backoff_seconds: float = 1.0, connection_class=None):
+        """
+        Parámetros:
+        -----------
+        server, database, username, password, port
+            Igual que SQLConnection
+        min_size : int
+            Conexiones que se abren al crear el pool (default: 1)
+        max_size : int
+            Máximo de conexiones abiertas (default: 5)
+        checkout_timeout : float
+            Segundos máximos de espera por una conexión libre (default: 30)
+        probe_after_seconds : float
+            Verificar conexiones ociosas por más de estos segundos (default: 60)
+        max_reconnect_attempts : int
+            Intentos de conexión antes de fallar al pedir una conexión (default: 5)
+        reconnect_backoff_seconds : float
+            Espera inicial entre intentos, duplicada en cada intento (default: 1)
+        connection_class : type
+            Clase de conexión (default: SQLConnection)
+        """
+        self._connection_kwargs = dict(server=server, database=database, username=username,
+                                       password=password, port=port)
+        self._connection_class = connection_class or SQLConnection
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.checkout_timeout = checkout_timeout
+        self.probe_after_seconds = probe_after_seconds
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.reconnect_backoff_seconds = reconnect_backoff_seconds
+        
+        self._idle = deque()  # (conexión, instante en que se devolvió)
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self._wait_times = deque(maxlen=1000)
+        self._hold_times = deque(maxlen=1000)
+        
+        try:
+            for _ in range(min_size):
+                conn = self._open(attempts=1)
+                with self._cond:
+                    self._size += 1
+                    self._idle.append((conn, time.time()))
+        except ConnectionError:
+            self.close()
+            raise
+    
+    def _open(self, attempts: Optional[int] = None) -> SQLConnection:
+        """Abre una conexión nueva, reintentando con espera exponencial (default: max_reconnect_attempts)"""
+        attempts = self.max_reconnect_attempts if attempts is None else attempts
+        delay = self.reconnect_backoff_seconds
+        for attempt in range(1, attempts + 1):
+            conn = self._connection_class(**self._connection_kwargs)
+            if conn.connect():
+                return conn
+            if attempt < attempts:
+                print(f"[ADVERTENCIA] Reintentando conexión en {delay:.0f}s ({attempt}/{attempts})")
+                sys.stdout.flush()
+                time.sleep(delay)
+                delay *= 2
+        raise ConnectionError(f"No se pudo conectar a {self._connection_kwargs['server']} "
+                              f"después de {attempts} intento(s)")
+    
+    def acquire(self, timeout: Optional[float] = None) -> SQLConnection:
+        """
+        Toma una conexión del pool (devolverla con `release`)
+        
+        Parámetros:
+        -----------
+        timeout : Optional[float]
+            Segundos máximos de espera (default: checkout_timeout del pool)
+        
+        Retorna:
+        --------
+        SQLConnection lista para usar
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.time()
+        deadline = start + timeout
+        
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("El pool de conexiones está cerrado")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reservar el lugar y abrir fuera del lock
+                    self._size += 1
+                    conn, idle_since = None, None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise TimeoutError(f"No hay conexiones libres después de {timeout:.0f}s "
+                                       f"({self.max_size} en uso)")
+                self._cond.wait(remaining)
+        
+        try:
+            if conn is None:
+                conn = self._open()
+            elif time.time() - idle_since > self.probe_after_seconds and not conn.is_alive():
+                print("[ADVERTENCIA] Conexión del pool sin respuesta, reconectando...")
+                sys.stdout.flush()
+                conn.disconnect()
+                conn = self._open()
+                with self._cond:
+                    self.reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        
+        with self._cond:
+            self.checkouts += 1
+            self._wait_times.append(time.time() - start)
+        conn._pool_checkout_time = time.time()
+        return conn
+    
+    def release(self, conn: SQLConnection, broken: bool = False):
+        """
+        Devuelve una conexión al pool
+        
+        Parámetros:
+        -----------
+        conn : SQLConnection
+            Conexión tomada con `acquire`
+        broken : bool
+            Si la conexión quedó inutilizable (se cierra en lugar de reutilizarse)
+        """
+        hold = time.time() - getattr(conn, '_pool_checkout_time', time.time())
+        if not broken and conn._conn is not None:
+            try:
+                # No dejar transacciones abiertas para el siguiente usuario
+                conn._conn.rollback()
+            except Exception:
+                broken = True
+        
+        with self._cond:
+            self._hold_times.append(hold)
+            if broken or self._closed:
+                self._size -= 1
+                conn.disconnect()
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+    
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """Context manager: toma una conexión y la devuelve al salir"""
+        conn = self.acquire(timeout)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = not conn.is_alive()
+            raise
+        finally:
+            self.release(conn, broken=broken)
+    
+    def close(self):
+        """Cierra las conexiones libres; las que están en uso se cierran al devolverse"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.disconnect()
+                self._size -= 1
+            self._cond.notify_all()
+    
+    def stats(self) -> Dict:
+        """Métricas de uso del pool (tiempos en segundos)"""
+        with self._cond:
+            waits = np.array(self._wait_times) if self._wait_times else np.zeros(1)
+            holds = np.array(self._hold_times) if self._hold_times else np.zeros(1)
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'reconnects': self.reconnects,
+                'wait_p50': float(np.percentile(waits, 50)),
+                'wait_p95': float(np.percentile(waits, 95)),
+                'hold_p50': float(np.percentile(holds, 50)),
+                'hold_p95': float(np.percentile(holds, 95))
+            }
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AsyncTableWriter:
+    """
+    Escritor en segundo plano para una tabla SQL
+    
+    El hilo que produce los resultados los encola con `submit` y un hilo dedicado
+    los escribe en orden, de modo que la detección del siguiente lote se solapa con
+    la escritura del anterior. La cola es acotada: si el escritor se atrasa,
+    `submit` bloquea hasta que haya lugar (contrapresión).
+    
+    Cada lote lleva una marca de agua (el último datetime de entrada que cubre).
+    `committed_watermark` solo avanza cuando un lote quedó escrito, así que ante
+    un error el productor puede volver a esa marca y reprocesar lo pendiente
+    (entrega al menos una vez). Tras un error el escritor descarta los lotes
+    siguientes hasta que se llame a `reset`, para no escribir fuera de orden.
+    
+    La conexión queda en uso exclusivo del hilo escritor mientras está activo.
+    """
+    
+    def __init__(self, sql_conn: SQLConnection, table_name: str, schema: str = "dbo",
+                 max_queue: int = 4, bulk: bool = False, max_retries: int = 3,
+                 retry_delay_seconds: float = 5.0, initial_watermark=None,
+                 watermark_store: Optional['WatermarkStore'] = None):
+        """
+        Parámetros:
+        -----------
+        sql_conn : SQLConnection
+            Conexión de salida (no usarla desde otros hilos mientras el escritor está activo)
+        table_name : str
+            Tabla de destino
+        schema : str
+            Schema (default: dbo)
+        max_queue : int
+            Máximo de lotes en espera de escritura (default: 4)
+        bulk : bool
+            Si usar write_dataframe_bulk en lugar de write_dataframe (default: False)
+        max_retries : int
+            Reintentos por lote antes de marcar error (default: 3)
+        retry_delay_seconds : float
+            Espera entre reintentos, duplicada en cada intento (default: 5)
+        initial_watermark
+            Marca de agua ya escrita al iniciar
+        watermark_store : Optional[WatermarkStore]
+            Si se indica, las marcas de cada lote se guardan en la misma transacción
+            que sus filas
+        """
+        self.sql_conn = sql_conn
+        self.table_name = table_name
+        self.schema = schema
+        self.bulk = bulk
+        self.max_retries = max_retries
+        self.retry_delay_seconds = retry_delay_seconds
+        self.watermark_store = watermark_store
+        
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._committed_watermark = initial_watermark
+        self._error = None
+        self._thread = None
+        
+        self.batches_written = 0
+        self.rows_written = 0
+        self.batches_discarded = 0
+        self.write_seconds = 0.0
+        self.wait_seconds = 0.0
+    
+    def start(self):
+        """Inicia el hilo escritor"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='sql-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, df: pd.DataFrame, watermark, variable_watermarks: Optional[Dict] = None) -> bool:
+        """
+        Encola un lote para escribir; bloquea si la cola está llena
+        
+        Parámetros:
+        -----------
+        df : pd.DataFrame
+            Filas a escribir
+        watermark
+            Último datetime de entrada cubierto por el lote
+        variable_watermarks : Optional[Dict]
+            Último datetime escrito por variable (para watermark_store)
+        
+        Retorna:
+        --------
+        bool: False si el escritor está en error (el lote no se encola)
+        """
+        if self.error is not None:
+            return False
+        start = time.time()
+        self._queue.put((df, watermark, variable_watermarks))
+        self.wait_seconds += time.time() - start
+        return True
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                df, watermark, variable_watermarks = item
+                if self.error is not None:
+                    self.batches_discarded += 1
+                    continue
+                self._write_with_retries(df, watermark, variable_watermarks)
+            finally:
+                self._queue.task_done()
+    
+    def _write_with_retries(self, df: pd.DataFrame, watermark, variable_watermarks: Optional[Dict]):
+        delay = self.retry_delay_seconds
+        before_commit = None
+        if self.watermark_store is not None:
+            before_commit = self.watermark_store.updater(watermark, variable_watermarks)
+        for attempt in range(self.max_retries + 1):
+            start = time.time()
+            try:
+                if self.bulk:
+                    success = self.sql_conn.write_dataframe_bulk(df, self.table_name, self.schema,
+                                                                 before_commit=before_commit)
+                else:
+                    success = self.sql_conn.write_dataframe(df, self.table_name, self.schema, if_exists='append',
+                                                            before_commit=before_commit)
+            except Exception as e:
+                print(f"[ERROR] Error en escritor de {self.schema}.{self.table_name}: {str(e)}")
+                success = False
+            self.write_seconds += time.time() - start
+            
+            if success:
+                with self._lock:
+                    self._committed_watermark = watermark
+                    self.batches_written += 1
+                    self.rows_written += len(df)
+                return
+            if attempt < self.max_retries:
+                print(f"[ADVERTENCIA] Reintentando escritura en {delay:.0f}s "
+                      f"({attempt + 1}/{self.max_retries})")
+                sys.stdout.flush()
+                time.sleep(delay)
+                delay *= 2
+        
+        with self._lock:
+            self._error = f"No se pudo escribir un lote de {len(df):,} filas (marca {watermark})"
+        print(f"[ERROR] {self._error}")
+        sys.stdout.flush()
+    
+    @property
+    def committed_watermark(self):
+        """Marca de agua del último lote escrito"""
+        with self._lock:
+            return self._committed_watermark
+    
+    @property
+    def error(self) -> Optional[str]:
+        """Descripción del error que detuvo la escritura, o None"""
+        with self._lock:
+            return self._error
+    
+    @property
+    def pending(self) -> int:
+        """Lotes en cola"""
+        return self._queue.qsize()
+    
+    def reset(self):
+        """
+        Descarta los lotes en cola, limpia el error y retorna la marca de agua escrita
+        
+        El productor debe reprocesar desde la marca retornada.
+        """
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self.batches_discarded += 1
+            self._queue.task_done()
+        with self._lock:
+            self._error = None
+            return self._committed_watermark
+    
+    def flush(self):
+        """Espera a que se escriban (o descarten) todos los lotes encolados"""
+        self._queue.join()
+    
+    def close(self):
+        """Escribe lo pendiente y detiene el hilo"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+    
+    def stats(self) -> Dict:
+        """Contadores del escritor"""
+        with self._lock:
+            return {
+                'batches_written': self.batches_written,
+                'rows_written': self.rows_written,
+                'batches_discarded': self.batches_discarded,
+                'pending': self._queue.qsize(),
+                'write_seconds': self.write_seconds,
+                'wait_seconds': self.wait_seconds,
+                'committed_watermark': self._committed_watermark,
+                'error': self._error
+            }
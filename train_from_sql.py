@@ -4,6 +4,7 @@ Script para entrenar modelos leyendo datos desde SQL Server
 
 import sys
 from pathlib import Path
+import argparse
 import pandas as pd
 
 # Agregar el directorio padre al path
@@ -11,6 +12,8 @@ sys.path.append(str(Path(__file__).parent))
 
 from sql_utils import SQLConnection
 from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+from pipeline.scripts.wide_pivot import LongToWidePivot
+from pipeline.scripts.history_cache import DEFAULT_OVERLAP_HOURS, read_history
 
 # Configuración de conexión SQL
 SQL_CONFIG = {
@@ -23,7 +26,9 @@ SQL_CONFIG = {
 
 
 def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None, 
-                       end_date: str = None) -> pd.DataFrame:
+                       end_date: str = None, chunk_size: int = 500000,
+                       history_cache: str = None,
+                       history_overlap_hours: float = DEFAULT_OVERLAP_HOURS) -> pd.DataFrame:
     """
     Lee datos desde SQL Server y los convierte a formato ancho
     
@@ -35,11 +40,24 @@ def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None,
         Fecha de inicio (opcional, formato: 'YYYY-MM-DD')
     end_date : str
         Fecha de fin (opcional, formato: 'YYYY-MM-DD')
+    chunk_size : int
+        Filas leídas de SQL por bloque (default: 500000)
+    history_cache : str
+        Directorio del cache de historial (opcional): se lee de SQL solo lo
+        posterior a lo ya cacheado (ver pipeline/scripts/history_cache.py)
+    history_overlap_hours : float
+        Con history_cache, horas anteriores a lo cacheado que se releen de SQL
+        por datos que llegan tarde
         
     Retorna:
     --------
     pd.DataFrame en formato ancho (datetime + variables en columnas)
     """
+    if history_cache:
+        print(f"\n[INFO] Leyendo datos desde el cache de historial ({history_cache})...")
+        return read_history(sql_conn, history_cache, start_date, end_date, chunk_size=chunk_size,
+                            overlap_hours=history_overlap_hours)
+    
     print("\n[INFO] Leyendo datos desde SQL Server...")
     
     # Construir query
@@ -58,23 +76,22 @@ def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None,
     
     print(f"  Query: {query[:100]}...")
     
-    # Ejecutar query
-    df_long = sql_conn.execute_query(query)
+    # Ejecutar query por bloques y pivotear cada bloque a medida que llega
+    # (así no se mantiene en memoria todo el formato largo)
+    pivot = LongToWidePivot()
+    try:
+        for chunk in sql_conn.execute_query_chunked(query, chunk_size, dtypes={'value': 'float64'}):
+            pivot.add(chunk)
+            print(f"  Filas leídas: {pivot.n_rows:,}")
+    except Exception:
+        return None
     
-    if df_long is None or len(df_long) == 0:
+    if pivot.n_rows == 0:
         print("[ERROR] No se encontraron datos en SQL")
         return None
     
-    print(f"  Filas leídas: {len(df_long):,}")
-    
-    # Convertir a formato ancho
     print("  Transformando a formato ancho...")
-    df_wide = df_long.pivot_table(
-        index='datetime',
-        columns='variable_name',
-        values='value',
-        aggfunc='first'  # Si hay duplicados, tomar el primero
-    )
+    df_wide = pivot.result()
     
     # Resetear índice para que datetime sea columna
     df_wide = df_wide.reset_index()
@@ -88,6 +105,19 @@ def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None,
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Entrena los modelos leyendo el historial desde SQL Server')
+    parser.add_argument('--history-cache', type=str, default=None,
+                       help='Directorio del cache de historial en disco; de SQL solo se leen los datos nuevos '
+                            '(p.ej. pipeline/cache/history; default: leer todo de SQL)')
+    parser.add_argument('--history-overlap-hours', type=float, default=DEFAULT_OVERLAP_HOURS,
+                       help=f'Con --history-cache, horas anteriores a lo cacheado que se releen de SQL '
+                            f'por datos que llegan tarde (default: {DEFAULT_OVERLAP_HOURS:g})')
+    parser.add_argument('--save-pickles', action='store_true',
+                       help='Guardar también el pickle completo de cada modelo Prophet (default: solo el almacén compacto)')
+    parser.add_argument('--validate-store', action='store_true',
+                       help='Comparar cada modelo con Prophet.predict antes de guardarlo; los que no pasan se guardan en pickle (más lento)')
+    args = parser.parse_args()
+    
     print("="*80)
     print("ENTRENAMIENTO DE MODELOS DESDE SQL SERVER")
     print("="*80)
@@ -105,7 +135,8 @@ def main():
         # Leer datos desde SQL
         # Si quieres filtrar por fechas, puedes usar:
         # df = read_data_from_sql(sql_conn, start_date='2024-10-01', end_date='2024-10-31')
-        df = read_data_from_sql(sql_conn)
+        df = read_data_from_sql(sql_conn, history_cache=args.history_cache,
+                                history_overlap_hours=args.history_overlap_hours)
         
         if df is None:
             return
@@ -153,7 +184,7 @@ def main():
         print("="*80)
         
         try:
-            detector.save_models(str(models_dir))
+            detector.save_models(str(models_dir), save_pickles=args.save_pickles, validate=args.validate_store)
             print(f"\n[OK] Modelos guardados exitosamente en: {models_dir}")
         except Exception as e:
             print(f"\n[ERROR] Error guardando modelos: {str(e)}")
@@ -4,6 +4,8 @@ Verifica periódicamente si hay nuevos datos y los procesa automáticamente
 """
 
 import sys
+import os
+import socket
 from pathlib import Path
 import pandas as pd
 import numpy as np
@@ -11,12 +13,18 @@ from datetime import datetime, timedelta
 import time
 import argparse
 import logging
-from typing import Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 sys.path.append(str(Path(__file__).parent))
 
-from sql_utils import SQLConnection
+from sql_utils import SQLConnection, AsyncTableWriter, WatermarkStore, ConnectionPool
+from change_feed import AdaptiveBackoff, ChangeFeed, NotificationSource, SQLChangeProbe
 from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+from pipeline.scripts.wide_pivot import long_to_wide
+from pipeline.scripts.streaming_scorer import MicroBatchScorer
+from pipeline.scripts.sharding import ShardMembership
 
 # Configuración de conexión SQL - Base de datos de entrada
 SQL_CONFIG_INPUT = {
@@ -107,6 +115,17 @@ def get_last_processed_datetime(sql_conn: SQLConnection) -> Optional[datetime]:
     return pd.to_datetime(result['last_ds'].iloc[0])
 
 
+def get_source_end(sql_conn: SQLConnection) -> Optional[datetime]:
+    """Obtiene el datetime más reciente de los datos de entrada (ypf_process_data)"""
+    query = "SELECT MAX(datetime) as last_ds FROM dbo.ypf_process_data"
+    result = sql_conn.execute_query(query)
+    
+    if result is None or result.empty or result['last_ds'].iloc[0] is None:
+        return None
+    
+    return pd.to_datetime(result['last_ds'].iloc[0])
+
+
 def get_new_data_from_sql(sql_conn: SQLConnection, since_datetime: datetime) -> Optional[pd.DataFrame]:
     """
     Lee nuevos datos desde SQL Server desde un datetime específico
@@ -133,14 +152,150 @@ def get_new_data_from_sql(sql_conn: SQLConnection, since_datetime: datetime) ->
     return df_long
 
 
+def get_new_data_per_variable(sql_conn: SQLConnection,
+                              watermarks: Dict[str, datetime],
+                              max_groups: int = 20) -> Optional[pd.DataFrame]:
+    """
+    Lee los datos nuevos de cada variable desde su propia marca de agua
+    
+    Las variables con la misma marca se consultan juntas (variable_name IN (...)),
+    y todos los grupos van en una sola query. Si hay más de `max_groups` marcas
+    distintas, los grupos vecinos se unen usando la marca más antigua del grupo y
+    el exceso se descarta al recibir los datos, así cada variable recibe
+    exactamente sus filas posteriores a su marca.
+    
+    Parámetros:
+    -----------
+    sql_conn : SQLConnection
+        Conexión a SQL Server (entrada)
+    watermarks : Dict[str, datetime]
+        Último datetime procesado por variable (solo se consultan estas variables)
+    max_groups : int
+        Máximo de grupos de marcas en la query (default: 20)
+    
+    Retorna:
+    --------
+    pd.DataFrame en formato largo, o None si no hay datos nuevos
+    """
+    if not watermarks:
+        return None
+    
+    by_mark: Dict[datetime, List[str]] = {}
+    for variable, mark in watermarks.items():
+        by_mark.setdefault(pd.Timestamp(mark), []).append(variable)
+    marks = sorted(by_mark)
+    
+    # Unir marcas vecinas hasta quedar en max_groups grupos
+    groups = []
+    group_size = -(-len(marks) // max_groups)
+    for i in range(0, len(marks), group_size):
+        group_marks = marks[i:i + group_size]
+        variables = [v for mark in group_marks for v in by_mark[mark]]
+        groups.append((group_marks[0], variables))
+    
+    conditions = []
+    for mark, variables in groups:
+        names = ','.join("'" + v.replace("'", "''") + "'" for v in variables)
+        conditions.append(f"(variable_name IN ({names}) AND datetime > '{mark.strftime('%Y-%m-%d %H:%M:%S')}')")
+    
+    query = f"""
+        SELECT datetime, variable_name, value, source_file
+        FROM dbo.ypf_process_data
+        WHERE datetime > '{marks[0].strftime('%Y-%m-%d %H:%M:%S')}'
+          AND ({' OR '.join(conditions)})
+        ORDER BY datetime, variable_name
+    """
+    
+    df_long = sql_conn.execute_query(query)
+    
+    if df_long is None or len(df_long) == 0:
+        return None
+    
+    # Descartar lo que el agrupamiento (o el redondeo a segundos) trajo de más
+    df_long['datetime'] = pd.to_datetime(df_long['datetime'])
+    since = df_long['variable_name'].map(pd.Series(watermarks).map(pd.Timestamp))
+    df_long = df_long[df_long['datetime'] > since].reset_index(drop=True)
+    
+    if len(df_long) == 0:
+        return None
+    
+    return df_long
+
+
+def get_data_slice(sql_conn: SQLConnection, start: datetime, end: Optional[datetime] = None) -> Optional[pd.DataFrame]:
+    """
+    Lee los datos de un intervalo (start, end] desde SQL Server
+    
+    Parámetros:
+    -----------
+    sql_conn : SQLConnection
+        Conexión a SQL Server (entrada)
+    start : datetime
+        Inicio del intervalo (excluido)
+    end : datetime, optional
+        Fin del intervalo (incluido); None = sin límite
+    
+    Retorna:
+    --------
+    pd.DataFrame en formato largo, o None si no hay datos
+    """
+    condition = f"datetime > '{pd.Timestamp(start).strftime('%Y-%m-%d %H:%M:%S')}'"
+    if end is not None:
+        condition += f" AND datetime <= '{pd.Timestamp(end).strftime('%Y-%m-%d %H:%M:%S')}'"
+    query = f"""
+        SELECT datetime, variable_name, value, source_file
+        FROM dbo.ypf_process_data
+        WHERE {condition}
+        ORDER BY datetime, variable_name
+    """
+    
+    df_long = sql_conn.execute_query(query)
+    
+    if df_long is None or len(df_long) == 0:
+        return None
+    
+    return df_long
+
+
+def plan_time_slices(start: datetime, end: datetime, slice_hours: float) -> List[tuple]:
+    """
+    Divide el intervalo (start, end] en tramos de `slice_hours`
+    
+    El último tramo queda abierto (fin None) para incluir lo que llegue mientras
+    se procesa el atraso.
+    
+    Retorna:
+    --------
+    List[tuple]: [(inicio, fin), ...] en orden
+    """
+    start = pd.Timestamp(start)
+    step = pd.Timedelta(hours=slice_hours)
+    slices = []
+    while start + step < pd.Timestamp(end):
+        slices.append((start, start + step))
+        start = start + step
+    slices.append((start, None))
+    return slices
+
+
+def batch_watermarks(df_long: pd.DataFrame, variables: Optional[List[str]] = None):
+    """
+    Marcas de agua de un lote leído
+    
+    Retorna:
+    --------
+    tuple: (último datetime del lote, Dict con el último datetime por variable)
+    """
+    datetimes = pd.to_datetime(df_long['datetime'])
+    per_variable = datetimes.groupby(df_long['variable_name']).max()
+    if variables is not None:
+        per_variable = per_variable[per_variable.index.isin(variables)]
+    return datetimes.max(), per_variable.to_dict()
+
+
 def convert_long_to_wide(df_long: pd.DataFrame) -> pd.DataFrame:
     """Convierte datos de formato largo a ancho"""
-    df_wide = df_long.pivot_table(
-        index='datetime',
-        columns='variable_name',
-        values='value',
-        aggfunc='first'
-    )
+    df_wide = long_to_wide(df_long)
     
     df_wide = df_wide.reset_index()
     df_wide.rename(columns={'datetime': 'DATETIME'}, inplace=True)
@@ -148,10 +303,158 @@ def convert_long_to_wide(df_long: pd.DataFrame) -> pd.DataFrame:
     return df_wide
 
 
+def attach_source_file(results: pd.DataFrame, df_long: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega a los resultados el source_file de cada (ds, variable) en los datos de entrada
+    
+    Se resuelve con un join sobre las dos columnas en lugar de buscar fila por fila.
+    Si un par tiene varios archivos se toma el primero; sin coincidencia queda 'unknown'.
+    
+    Parámetros:
+    -----------
+    results : pd.DataFrame
+        Resultados de la detección (columnas 'ds' y 'variable')
+    df_long : pd.DataFrame
+        Datos en formato largo (columnas datetime, variable_name, source_file)
+    
+    Retorna:
+    --------
+    pd.DataFrame: resultados (mismo orden e índice) con la columna source_file
+    """
+    if 'source_file' not in df_long.columns:
+        results['source_file'] = 'unknown'
+        return results
+    
+    lookup = (df_long[['datetime', 'variable_name', 'source_file']]
+              .dropna(subset=['source_file'])
+              .drop_duplicates(subset=['datetime', 'variable_name'], keep='first')
+              .rename(columns={'datetime': 'ds', 'variable_name': 'variable'}))
+    lookup['ds'] = pd.to_datetime(lookup['ds'])
+    
+    source_file = results[['ds', 'variable']].merge(lookup, on=['ds', 'variable'], how='left')['source_file']
+    results['source_file'] = source_file.fillna('unknown').values
+    return results
+
+
+def prepare_results_for_sql(results: pd.DataFrame, df_long: pd.DataFrame) -> pd.DataFrame:
+    """
+    Deja los resultados de la detección listos para ypf_anomaly_detector
+    
+    Agrega source_file, convierte los flags a 0/1 (BIT), acota los valores
+    numéricos y selecciona las columnas de la tabla.
+    
+    Parámetros:
+    -----------
+    results : pd.DataFrame
+        Resultados de detect_anomalies_multiple (se modifican en el lugar)
+    df_long : pd.DataFrame
+        Datos de entrada en formato largo (para source_file)
+    
+    Retorna:
+    --------
+    pd.DataFrame con las columnas a escribir
+    """
+    # Agregar source_file si no existe
+    if 'source_file' not in results.columns:
+        results = attach_source_file(results, df_long)
+    
+    # Convertir booleanos a 0/1 para SQL Server BIT
+    bool_cols = ['outside_interval', 'high_residual', 'is_anomaly']
+    for col in bool_cols:
+        if col in results.columns:
+            results[col] = results[col].astype(int)
+    
+    # Limpiar valores numéricos para SQL Server
+    if 'anomaly_score' in results.columns:
+        results['anomaly_score'] = results['anomaly_score'].fillna(0).clip(lower=0, upper=999.99)
+    
+    if 'prediction_error_pct' in results.columns:
+        results['prediction_error_pct'] = results['prediction_error_pct'].replace([np.inf, -np.inf], np.nan)
+        results['prediction_error_pct'] = results['prediction_error_pct'].fillna(0).clip(lower=0, upper=999.99)
+    
+    # Seleccionar columnas para escribir
+    columns_to_write = [
+        'ds', 'y', 'yhat', 'yhat_lower', 'yhat_upper', 'residual',
+        'outside_interval', 'high_residual', 'is_anomaly', 'anomaly_score',
+        'variable', 'prediction_error_pct', 'source_file'
+    ]
+    
+    available_cols = [col for col in columns_to_write if col in results.columns]
+    return results[available_cols].copy()
+
+
+def score_data(detector: ProphetAnomalyDetector, df_long: pd.DataFrame, n_jobs: int = 1) -> Optional[tuple]:
+    """
+    Detecta anomalías en un lote sin escribirlo (sin mensajes por variable)
+    
+    Retorna:
+    --------
+    tuple: (resultados listos para SQL, datetimes únicos, variables analizadas),
+    o None si ninguna variable del lote tiene modelo
+    """
+    df_wide = convert_long_to_wide(df_long)
+    available_vars = [v for v in detector.models.keys() if v in df_wide.columns]
+    if not available_vars:
+        return None
+    
+    results = detector.detect_anomalies_multiple(
+        df=df_wide,
+        variables=available_vars,
+        datetime_col='DATETIME',
+        combine_results=True,
+        n_jobs=n_jobs,
+        verbose=False
+    )
+    return prepare_results_for_sql(results, df_long), df_wide['DATETIME'].nunique(), available_vars
+
+
+def write_results(sql_conn: SQLConnection,
+                  results_to_write: pd.DataFrame,
+                  watermark,
+                  variable_watermarks: Optional[Dict] = None,
+                  bulk_write: bool = False,
+                  writer: Optional[AsyncTableWriter] = None,
+                  watermark_store: Optional[WatermarkStore] = None) -> bool:
+    """
+    Escribe resultados en ypf_anomaly_detector junto con sus marcas de agua
+    
+    Con `writer` los resultados se encolan en el escritor en segundo plano; si no,
+    se escriben aquí y las marcas (si hay `watermark_store`) se guardan en la misma
+    transacción.
+    
+    Retorna:
+    --------
+    bool: True si se escribieron (o encolaron)
+    """
+    if writer is not None:
+        return writer.submit(results_to_write, watermark, variable_watermarks)
+    
+    before_commit = None
+    if watermark_store is not None:
+        before_commit = watermark_store.updater(watermark, variable_watermarks)
+    
+    if bulk_write:
+        return sql_conn.write_dataframe_bulk(
+            results_to_write,
+            table_name='ypf_anomaly_detector',
+            before_commit=before_commit
+        )
+    return sql_conn.write_dataframe(
+        results_to_write,
+        table_name='ypf_anomaly_detector',
+        if_exists='append',
+        before_commit=before_commit
+    )
+
+
 def process_new_anomalies(sql_conn: SQLConnection,
                          detector: ProphetAnomalyDetector,
                          since_datetime: datetime,
-                         df_long: pd.DataFrame = None) -> tuple[int, int]:
+                         df_long: pd.DataFrame = None,
+                         n_jobs: int = 1,
+                         bulk_write: bool = False,
+                         writer: Optional[AsyncTableWriter] = None,
+                         watermark_store: Optional[WatermarkStore] = None) -> tuple[int, int]:
     """
     Procesa nuevos datos y detecta anomalías
     
@@ -165,6 +468,16 @@ def process_new_anomalies(sql_conn: SQLConnection,
         Fecha desde la cual procesar (usado si df_long no se proporciona)
     df_long : pd.DataFrame, optional
         Datos en formato largo. Si no se proporciona, se leen de SQL.
+    n_jobs : int
+        Máximo de hilos de inferencia concurrentes (default: 1)
+    bulk_write : bool
+        Si escribir con carga masiva vía tabla de staging (default: False)
+    writer : AsyncTableWriter, optional
+        Si se indica, los resultados se encolan en este escritor en segundo plano
+        (con el último datetime de df_long como marca de agua) en lugar de escribirse aquí
+    watermark_store : WatermarkStore, optional
+        Si se indica (y no hay writer), las marcas de agua del lote se guardan en la
+        misma transacción que los resultados
     
     Retorna:
     --------
@@ -203,50 +516,21 @@ def process_new_anomalies(sql_conn: SQLConnection,
             df=df_wide,
             variables=available_vars,
             datetime_col='DATETIME',
-            combine_results=True
+            combine_results=True,
+            n_jobs=n_jobs
         )
         
         if results is None or len(results) == 0:
             return 0, 0
         
-        # Agregar source_file si no existe
-        if 'source_file' not in results.columns:
-            source_file_map = df_long.groupby(['datetime', 'variable_name'])['source_file'].first().to_dict()
-            results['source_file'] = results.apply(
-                lambda row: source_file_map.get((row['ds'], row['variable']), 'unknown'),
-                axis=1
-            )
-        
-        # Convertir booleanos a 0/1 para SQL Server BIT
-        bool_cols = ['outside_interval', 'high_residual', 'is_anomaly']
-        for col in bool_cols:
-            if col in results.columns:
-                results[col] = results[col].astype(int)
+        results_to_write = prepare_results_for_sql(results, df_long)
         
-        # Limpiar valores numéricos para SQL Server
-        if 'anomaly_score' in results.columns:
-            results['anomaly_score'] = results['anomaly_score'].fillna(0).clip(lower=0, upper=999.99)
-        
-        if 'prediction_error_pct' in results.columns:
-            results['prediction_error_pct'] = results['prediction_error_pct'].replace([np.inf, -np.inf], np.nan)
-            results['prediction_error_pct'] = results['prediction_error_pct'].fillna(0).clip(lower=0, upper=999.99)
-        
-        # Seleccionar columnas para escribir
-        columns_to_write = [
-            'ds', 'y', 'yhat', 'yhat_lower', 'yhat_upper', 'residual',
-            'outside_interval', 'high_residual', 'is_anomaly', 'anomaly_score',
-            'variable', 'prediction_error_pct', 'source_file'
-        ]
-        
-        available_cols = [col for col in columns_to_write if col in results.columns]
-        results_to_write = results[available_cols].copy()
+        # Marcas de agua: último datetime leído, en total y por variable analizada
+        watermark, variable_watermarks = batch_watermarks(df_long, available_vars)
         
         # Escribir a SQL
-        success = sql_conn.write_dataframe(
-            results_to_write,
-            table_name='ypf_anomaly_detector',
-            if_exists='append'
-        )
+        success = write_results(sql_conn, results_to_write, watermark, variable_watermarks,
+                                bulk_write=bulk_write, writer=writer, watermark_store=watermark_store)
         
         if success:
             n_anomalies = results['is_anomaly'].sum()
@@ -262,7 +546,18 @@ def process_new_anomalies(sql_conn: SQLConnection,
 class AnomalyDetectionWorker:
     """Worker para procesamiento continuo de anomalías"""
     
-    def __init__(self, check_interval_minutes: int = 10):
+    def __init__(self, check_interval_minutes: int = 10, inference_jobs: int = 1,
+                 use_fast_predict: bool = False, forecast_cache_hours: float = 0,
+                 max_models_in_memory: int = 0, bulk_write: bool = False,
+                 async_write_queue: int = 0, worker_id: str = 'procesamiento',
+                 per_variable: bool = False, event_driven: bool = False,
+                 min_wait_seconds: float = 5.0, change_column: str = 'datetime',
+                 notifications: Optional[NotificationSource] = None,
+                 stream_batch_points: int = 0, stream_max_seconds: float = 2.0,
+                 shard_dir: Optional[str] = None, member_id: Optional[str] = None,
+                 catchup_slice_hours: float = 0, catchup_jobs: int = 2,
+                 catchup_memory_mb: float = 1024,
+                 residual_stats_update: Optional[str] = None):
         """
         Inicializa el worker
         
@@ -270,9 +565,99 @@ class AnomalyDetectionWorker:
         -----------
         check_interval_minutes : int
             Intervalo en minutos entre verificaciones (default: 10)
+        inference_jobs : int
+            Máximo de hilos de inferencia concurrentes (default: 1). Conviene dejar
+            núcleos libres para la escritura a SQL.
+        use_fast_predict : bool
+            Si usar la predicción en forma cerrada en lugar de Prophet.predict (default: False)
+        forecast_cache_hours : float
+            Horizonte en horas de pronósticos precalculados por modelo (default: 0 = sin cache)
+        max_models_in_memory : int
+            Si es > 0, los modelos se cargan bajo demanda y se mantienen como máximo
+            estos en memoria (LRU). 0 = cargar todos al inicio (default)
+        bulk_write : bool
+            Si escribir los resultados con carga masiva vía tabla de staging (default: False)
+        async_write_queue : int
+            Si es > 0, los resultados se escriben en un hilo aparte con una cola de
+            hasta estos lotes, solapando escritura y detección (default: 0 = sincrónico)
+        worker_id : str
+            Identificador del worker en la tabla de marcas de agua (default: 'procesamiento')
+        per_variable : bool
+            Si leer los datos nuevos de cada variable desde su propia marca de agua,
+            solo para variables con modelo (default: False = una marca global)
+        event_driven : bool
+            Si procesar apenas aparecen datos nuevos en lugar de esperar el intervalo
+            fijo: se sondea la tabla de entrada con una consulta liviana cada
+            `min_wait_seconds`, duplicando la espera mientras no haya cambios hasta
+            `check_interval_minutes` (default: False)
+        min_wait_seconds : float
+            Espera mínima entre sondeos en modo por eventos (default: 5)
+        change_column : str
+            Columna creciente e indexada de dbo.ypf_process_data usada por el sondeo
+            (default: 'datetime'; un id o rowversion si la tabla lo tiene)
+        notifications : Optional[NotificationSource]
+            Fuente de avisos de datos nuevos que despierta al worker sin esperar
+            al próximo sondeo (default: None)
+        stream_batch_points : int
+            Si es > 0, los datos leídos se puntúan y escriben en micro-lotes de hasta
+            estos puntos en un hilo aparte, en lugar de un único lote por ciclo
+            (default: 0 = desactivado)
+        stream_max_seconds : float
+            Espera máxima de un punto antes de cerrar su micro-lote (default: 2)
+        shard_dir : Optional[str]
+            Si se indica, el worker es un miembro de un despliegue particionado
+            (ver coordinador_shards.py): solo procesa las variables que le asigna el
+            coordinador, con marcas por variable compartidas bajo `worker_id` y su
+            propia marca global (default: None = procesa todas las variables)
+        member_id : Optional[str]
+            Identificador del miembro en el despliegue particionado (default: host-pid)
+        catchup_slice_hours : float
+            Si es > 0 y el atraso supera dos tramos, el atraso se procesa en tramos de
+            estas horas (ver catch_up) en lugar de una única lectura (default: 0 = desactivado)
+        catchup_jobs : int
+            Tramos leídos y analizados en paralelo durante la puesta al día (default: 2)
+        catchup_memory_mb : float
+            Memoria aproximada para tramos en curso; limita el paralelismo según el
+            tamaño medido de los tramos (default: 1024)
+        residual_stats_update : Optional[str]
+            Si actualizar el desvío de residuales de cada variable con los puntos
+            puntuados ('welford' o 'ewma') y guardarlo en el directorio de modelos
+            (default: None = desvío fijo de entrenamiento)
         """
         self.check_interval_minutes = check_interval_minutes
+        self.inference_jobs = inference_jobs
+        self.use_fast_predict = use_fast_predict
+        self.forecast_cache_hours = forecast_cache_hours
+        self.max_models_in_memory = max_models_in_memory
+        self.bulk_write = bulk_write
+        self.async_write_queue = async_write_queue
+        self.writer = None
+        self.worker_id = worker_id
+        self.watermark_store = None
+        self.per_variable = per_variable
+        self.variable_watermarks = {}
         self.check_interval_seconds = check_interval_minutes * 60
+        self.event_driven = event_driven
+        self.min_wait_seconds = min_wait_seconds
+        self.change_column = change_column
+        self.notifications = notifications
+        self.change_feed = None
+        self.stream_batch_points = stream_batch_points
+        self.stream_max_seconds = stream_max_seconds
+        self.scorer = None
+        self.shard_dir = shard_dir
+        self.member_id = member_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.membership = None
+        self.assignment_generation = None
+        self.pending_variables = []  # recibidas en la asignación vigente, a la espera del dueño anterior
+        if shard_dir is not None:
+            # Una variable puede cambiar de dueño: se lee desde su propia marca
+            self.per_variable = True
+        self.models_dir = Path("pipeline/models/prophet")
+        self.catchup_slice_hours = catchup_slice_hours
+        self.catchup_jobs = max(1, catchup_jobs)
+        self.catchup_memory_mb = catchup_memory_mb
+        self.residual_stats_update = residual_stats_update
         self.sql_conn_input = None  # Para leer datos de otms_main
         self.sql_conn_output = None  # Para escribir resultados en otms_analytics
         self.detector = None
@@ -284,8 +669,8 @@ class AnomalyDetectionWorker:
     def initialize(self) -> bool:
         """Inicializa conexiones y carga modelos"""
         # Verificar modelos
-        models_dir = Path("pipeline/models/prophet")
-        if not models_dir.exists() or not list(models_dir.glob("prophet_model_*.pkl")):
+        models_dir = self.models_dir
+        if not ProphetAnomalyDetector.has_saved_models(models_dir):
             print(f"[ERROR] No se encontraron modelos entrenados en {models_dir}")
             print("[ERROR] Entrena los modelos primero: python train_from_sql.py")
             sys.stdout.flush()
@@ -314,24 +699,78 @@ class AnomalyDetectionWorker:
             # Crear tabla de resultados si no existe (en base de datos de salida)
             create_anomalies_table(self.sql_conn_output)
             
-            # Cargar detector y modelos
-            print(f"[INFO] Cargando modelos desde: {models_dir}")
-            sys.stdout.flush()
-            self.detector = ProphetAnomalyDetector()
-            self.detector.load_models(str(models_dir))
-            print(f"[OK] {len(self.detector.models)} modelos cargados exitosamente")
-            sys.stdout.flush()
+            # Cargar detector y modelos (en modo particionado, solo los asignados)
+            self.detector = ProphetAnomalyDetector(use_fast_predict=self.use_fast_predict,
+                                                   residual_stats_update=self.residual_stats_update)
+            variables = None
+            global_variable = WatermarkStore.GLOBAL
+            if self.shard_dir is not None:
+                self.membership = ShardMembership(self.shard_dir)
+                assignment = self.membership.read_assignment() or {'generation': None, 'members': {}}
+                variables = assignment['members'].get(self.member_id, [])
+                self.assignment_generation = assignment['generation'] if self.member_id in assignment['members'] else None
+                # Recién iniciado no escribió nada: está al día con la generación leída
+                self.membership.start_heartbeat(self.member_id, {'generation': assignment['generation']})
+                global_variable = WatermarkStore.GLOBAL + self.member_id
+                print(f"[INFO] Miembro '{self.member_id}' del despliegue particionado en {self.shard_dir} "
+                      f"({len(variables)} variables asignadas)")
+            self._load_models(variables)
             
-            # Obtener último datetime procesado (de base de datos de salida)
-            self.last_processed_datetime = get_last_processed_datetime(self.sql_conn_output)
-            if self.last_processed_datetime:
-                print(f"[INFO] Último datetime procesado: {self.last_processed_datetime}")
+            # Obtener último datetime procesado: punto de control del worker o,
+            # si todavía no tiene, MAX(ds) de los resultados (solo la primera vez)
+            self.watermark_store = WatermarkStore(self.sql_conn_output, self.worker_id,
+                                                  global_variable=global_variable)
+            self.watermark_store.create_table()
+            watermarks = self.watermark_store.load()
+            self.variable_watermarks = {var: mark for var, mark in watermarks.items()
+                                        if not WatermarkStore.is_global(var)}
+            if global_variable in watermarks:
+                self.last_processed_datetime = watermarks[global_variable]
+                print(f"[INFO] Punto de control del worker '{self.worker_id}': {self.last_processed_datetime} "
+                      f"({len(self.variable_watermarks)} variables)")
             else:
+                self.last_processed_datetime = get_last_processed_datetime(self.sql_conn_output)
+                if self.last_processed_datetime:
+                    print(f"[INFO] Último datetime procesado: {self.last_processed_datetime}")
+            if self.last_processed_datetime is None:
                 print("[INFO] No hay datos procesados anteriormente. Procesará desde hace 24 horas")
                 # Si no hay datos procesados, buscar desde hace 24 horas
                 self.last_processed_datetime = datetime.now() - timedelta(hours=24)
             sys.stdout.flush()
             
+            if self.async_write_queue > 0:
+                # A partir de aquí la conexión de salida es de uso exclusivo del escritor
+                self.writer = AsyncTableWriter(
+                    self.sql_conn_output, 'ypf_anomaly_detector',
+                    max_queue=self.async_write_queue, bulk=self.bulk_write,
+                    initial_watermark=self.last_processed_datetime,
+                    watermark_store=self.watermark_store
+                )
+                self.writer.start()
+                print(f"[INFO] Escritura en segundo plano (cola de {self.async_write_queue} lotes)")
+                sys.stdout.flush()
+            
+            if self.stream_batch_points > 0:
+                self.scorer = MicroBatchScorer(
+                    self.detector, emit=self._emit_stream_batch,
+                    max_batch_points=self.stream_batch_points,
+                    max_batch_seconds=self.stream_max_seconds,
+                    n_jobs=self.inference_jobs,
+                    initial_watermark=self.last_processed_datetime
+                )
+                self.scorer.start()
+                print(f"[INFO] Scoring por micro-lotes: hasta {self.stream_batch_points} puntos "
+                      f"o {self.stream_max_seconds:g}s por lote")
+                sys.stdout.flush()
+            
+            if self.event_driven:
+                probe = SQLChangeProbe(self.sql_conn_input, since=lambda: self.last_processed_datetime,
+                                       column=self.change_column)
+                self.change_feed = ChangeFeed(
+                    probe, self.notifications,
+                    AdaptiveBackoff(self.min_wait_seconds, self.check_interval_seconds)
+                )
+            
             return True
             
         except Exception as e:
@@ -347,28 +786,82 @@ class AnomalyDetectionWorker:
         bool: True si se procesaron datos, False si no había datos nuevos
         """
         try:
+            writer_failed = self.writer is not None and self.writer.error is not None
+            scorer_failed = self.scorer is not None and self.scorer.error is not None
+            if writer_failed or scorer_failed:
+                # Volver a la última marca escrita y reprocesar lo que no llegó a SQL
+                if self.scorer is not None:
+                    self.last_processed_datetime = self.scorer.reset()
+                if self.writer is not None:
+                    self.last_processed_datetime = self.writer.reset()
+                self.variable_watermarks = {var: mark for var, mark in self.watermark_store.load().items()
+                                            if not WatermarkStore.is_global(var)}
+                print(f"  [ADVERTENCIA] Falló la escritura en segundo plano; se reprocesará desde {self.last_processed_datetime}")
+                sys.stdout.flush()
+            
+            if self.membership is not None:
+                self._apply_assignment()
+            
+            if self.catchup_slice_hours > 0:
+                # El atraso se mide contra el último dato de entrada, no contra el reloj:
+                # si la fuente no tiene datos recientes no hay nada que poner al día
+                source_end = get_source_end(self.sql_conn_input)
+                if source_end is not None and \
+                        source_end - self._catchup_start() > pd.Timedelta(hours=2 * self.catchup_slice_hours):
+                    return self.catch_up(source_end)
+            
             # Verificar si hay nuevos datos (de base de datos de entrada)
-            df_long = get_new_data_from_sql(self.sql_conn_input, self.last_processed_datetime)
+            if self.per_variable:
+                since = {var: self.variable_watermarks.get(var, self.last_processed_datetime)
+                         for var in self.detector.models.keys()}
+                df_long = get_new_data_per_variable(self.sql_conn_input, since)
+            else:
+                df_long = get_new_data_from_sql(self.sql_conn_input, self.last_processed_datetime)
             
             if df_long is None or len(df_long) == 0:
                 return False
             
+            if self.scorer is not None:
+                # Los micro-lotes se puntúan y escriben en el hilo del scorer
+                self.scorer.submit(df_long)
+                _, marks = batch_watermarks(df_long, list(self.detector.models.keys()))
+                self.variable_watermarks.update(marks)
+                self.last_processed_datetime = pd.to_datetime(df_long['datetime']).max()
+                print(f"  [OK] Enviados al scoring por micro-lotes: {len(df_long)} puntos "
+                      f"(entregado hasta {self.scorer.committed_watermark})")
+                sys.stdout.flush()
+                return True
+            
             # Procesar nuevos datos (escribir en base de datos de salida)
             n_datetimes, n_anomalies = process_new_anomalies(
                 self.sql_conn_output,
                 self.detector,
                 self.last_processed_datetime,
-                df_long  # Pasar los datos directamente
+                df_long,  # Pasar los datos directamente
+                n_jobs=self.inference_jobs,
+                bulk_write=self.bulk_write,
+                writer=self.writer,
+                watermark_store=self.watermark_store
             )
             
             if n_datetimes > 0:
-                # Actualizar último datetime procesado (de base de datos de entrada)
-                query = "SELECT MAX(datetime) as last_datetime FROM dbo.ypf_process_data"
-                result = self.sql_conn_input.execute_query(query)
-                if result is not None and not result.empty and result['last_datetime'].iloc[0] is not None:
-                    new_last = pd.to_datetime(result['last_datetime'].iloc[0])
-                    if new_last > self.last_processed_datetime:
-                        self.last_processed_datetime = new_last
+                _, marks = batch_watermarks(df_long, list(self.detector.models.keys()))
+                self.variable_watermarks.update(marks)
+            
+            if n_datetimes > 0 and self.writer is not None:
+                # Lote encolado: la próxima lectura sigue desde el final de este lote
+                self.last_processed_datetime = pd.to_datetime(df_long['datetime']).max()
+                self.total_processed += n_datetimes
+                self.total_anomalies += n_anomalies
+                
+                print(f"  [OK] Encolados: {n_datetimes} datetime(s), Anomalías: {n_anomalies} (Total: {self.total_anomalies}), "
+                      f"lotes pendientes de escritura: {self.writer.pending}")
+                sys.stdout.flush()
+                return True
+            elif n_datetimes > 0:
+                # Avanzar hasta el último datetime efectivamente procesado (ya guardado
+                # como punto de control junto con los resultados)
+                self.last_processed_datetime = pd.to_datetime(df_long['datetime']).max()
                 
                 self.total_processed += n_datetimes
                 self.total_anomalies += n_anomalies
@@ -383,6 +876,276 @@ class AnomalyDetectionWorker:
             logger.error(f"Error en check_and_process: {str(e)}", exc_info=True)
             return False
     
+    def _catchup_start(self) -> pd.Timestamp:
+        """
+        Desde dónde hay atraso: la marca global o, por variable, la marca más antigua
+        
+        Una variable puede tener su marca antes de la global (p.ej. recién
+        reasignada desde otro shard); la puesta al día tiene que empezar ahí o esas
+        filas no se leerían nunca.
+        """
+        start = pd.Timestamp(self.last_processed_datetime)
+        if self.per_variable:
+            for var in self.detector.models.keys():
+                start = min(start, pd.Timestamp(self.variable_watermarks.get(var, start)))
+        return start
+    
+    def catch_up(self, source_end: Optional[datetime] = None) -> bool:
+        """
+        Procesa el atraso desde la última marca en tramos de tiempo
+        
+        Cada tramo se lee (con su propia conexión de un pool) y se analiza en un
+        hilo; hasta `catchup_jobs` tramos en curso, menos si el tamaño medido de
+        los tramos no entra en `catchup_memory_mb`. Los tramos se escriben en
+        orden, así la marca de agua avanza siempre sobre un prefijo completo del
+        atraso. Si un tramo falla, la puesta al día se detiene y el próximo ciclo
+        retoma desde el último tramo escrito.
+        
+        Al escribir un tramo cerrado las marcas (global y, con per_variable, las de
+        todas las variables con modelo) avanzan hasta su fin aunque no haya tenido
+        filas: un hueco en los datos o una variable que dejó de reportar no hacen
+        que la puesta al día vuelva a empezar siempre desde el mismo punto.
+        
+        Parámetros:
+        -----------
+        source_end : datetime, optional
+            Último datetime de los datos de entrada (None = consultarlo)
+        
+        Retorna:
+        --------
+        bool: True si se escribió al menos un tramo
+        """
+        if source_end is None:
+            source_end = get_source_end(self.sql_conn_input) or pd.Timestamp.now()
+        plan_start = self._catchup_start()
+        slices = plan_time_slices(plan_start, source_end, self.catchup_slice_hours)
+        print(f"  [INFO] Puesta al día desde {plan_start}: {len(slices)} tramo(s) de "
+              f"{self.catchup_slice_hours:g} h, hasta {self.catchup_jobs} en paralelo")
+        sys.stdout.flush()
+        
+        if self.scorer is not None:
+            # La conexión de salida se usa desde este hilo durante la puesta al día
+            self.scorer.flush()
+        
+        budget_bytes = self.catchup_memory_mb * 1024 * 1024
+        slice_bytes = 0  # mayor tamaño observado de un tramo (datos + resultados)
+        pool = ConnectionPool(**SQL_CONFIG_INPUT, min_size=1, max_size=self.catchup_jobs)
+        variable_marks = {}
+        if self.per_variable:
+            # Las variables sin marca propia siguen la marca global
+            variable_marks = {var: self.variable_watermarks.get(var, self.last_processed_datetime)
+                              for var in self.detector.models.keys()}
+        
+        def process_slice(start, end):
+            with pool.connection() as conn:
+                df_long = get_data_slice(conn, start, end)
+            if df_long is None:
+                return None, None, 0
+            if variable_marks:
+                # Como en get_new_data_per_variable: cada variable desde su propia marca
+                df_long['datetime'] = pd.to_datetime(df_long['datetime'])
+                since = df_long['variable_name'].map(pd.Series(variable_marks).map(pd.Timestamp))
+                df_long = df_long[~(df_long['datetime'] <= since)].reset_index(drop=True)
+                if len(df_long) == 0:
+                    return None, None, 0
+            scored = score_data(self.detector, df_long, self.inference_jobs)
+            size = df_long.memory_usage(deep=True).sum()
+            if scored is not None:
+                size += scored[0].memory_usage(deep=True).sum()
+            return df_long, scored, size
+        
+        start_time = time.time()
+        total_points = 0
+        slices_written = 0
+        in_flight = deque()
+        next_slice = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.catchup_jobs) as executor:
+                while next_slice < len(slices) or in_flight:
+                    allowed = self.catchup_jobs
+                    if slice_bytes > 0:
+                        allowed = int(min(self.catchup_jobs, max(1, budget_bytes // slice_bytes)))
+                    while next_slice < len(slices) and len(in_flight) < allowed:
+                        start, end = slices[next_slice]
+                        in_flight.append((start, end, executor.submit(process_slice, start, end)))
+                        next_slice += 1
+                    
+                    # Escribir en orden: siempre el tramo más antiguo en curso
+                    start, end, future = in_flight.popleft()
+                    df_long, scored, size = future.result()
+                    slice_bytes = max(slice_bytes, size)
+                    if df_long is None and end is None:
+                        # Último tramo (abierto) sin datos: no hay hasta dónde avanzar
+                        continue
+                    
+                    # Los tramos anteriores a la marca global (variables atrasadas) no la retroceden
+                    watermark = pd.Timestamp(self.last_processed_datetime)
+                    marks = {}
+                    if end is not None:
+                        # Tramo cerrado: (start, end] quedó leído para todas las variables
+                        watermark = max(watermark, pd.Timestamp(end))
+                        marks = {var: max(pd.Timestamp(self.variable_watermarks.get(var, end)), pd.Timestamp(end))
+                                 for var in variable_marks}
+                    
+                    points = 0 if df_long is None else len(df_long)
+                    results_to_write, n_datetimes = pd.DataFrame(), 0
+                    if scored is not None:
+                        results_to_write, n_datetimes, available_vars = scored
+                        batch_mark, batch_marks = batch_watermarks(df_long, available_vars)
+                        watermark = max(watermark, batch_mark)
+                        for var, mark in batch_marks.items():
+                            marks[var] = max(marks.get(var, mark), mark)
+                    elif df_long is not None:
+                        # Ninguna variable con modelo: nada que escribir, pero la lectura avanza
+                        watermark = max(watermark, pd.to_datetime(df_long['datetime']).max())
+                    
+                    # Sin filas se guardan igual las marcas (write_results con un lote vacío)
+                    if not write_results(self.sql_conn_output, results_to_write, watermark, marks,
+                                         bulk_write=self.bulk_write, writer=self.writer,
+                                         watermark_store=self.watermark_store):
+                        print(f"  [ERROR] No se pudo escribir el tramo desde {start}; se retomará en el próximo ciclo")
+                        sys.stdout.flush()
+                        for _, _, pending in in_flight:
+                            pending.cancel()
+                        break
+                    
+                    self.last_processed_datetime = watermark
+                    self.variable_watermarks.update(marks)
+                    n_anomalies = int(results_to_write['is_anomaly'].sum()) if scored is not None else 0
+                    self.total_processed += n_datetimes
+                    self.total_anomalies += n_anomalies
+                    total_points += points
+                    slices_written += 1
+                    
+                    elapsed = time.time() - start_time
+                    print(f"  [OK] Tramo {start} → {end or 'ahora'}: {points:,} puntos, {n_anomalies} anomalías "
+                          f"({total_points / elapsed:,.0f} puntos/s acumulado, {len(in_flight)} en curso, "
+                          f"~{slice_bytes / 1024 / 1024:.0f} MB por tramo)")
+                    sys.stdout.flush()
+        except Exception as e:
+            logger.error(f"Error en la puesta al día: {str(e)}", exc_info=True)
+        finally:
+            pool.close()
+        
+        elapsed = time.time() - start_time
+        print(f"  [INFO] Puesta al día: {slices_written} tramo(s) escritos, {total_points:,} puntos en {elapsed:.1f}s "
+              f"({total_points / max(elapsed, 1e-9):,.0f} puntos/s); marca actual {self.last_processed_datetime}")
+        sys.stdout.flush()
+        return slices_written > 0
+    
+    def _load_models(self, variables: Optional[List[str]] = None):
+        """Carga los modelos (todos o solo `variables`) y, si corresponde, el cache de pronósticos"""
+        self._save_residual_stats()
+        print(f"[INFO] Cargando modelos desde: {self.models_dir}")
+        sys.stdout.flush()
+        self.detector.disable_forecast_cache()
+        if self.max_models_in_memory > 0:
+            self.detector.load_models(str(self.models_dir), variables=variables, lazy=True,
+                                      max_models=self.max_models_in_memory)
+        else:
+            self.detector.load_models(str(self.models_dir), variables=variables)
+        print(f"[OK] {len(self.detector.models)} modelos cargados exitosamente")
+        if len(self.detector.residual_stats) < len(self.detector.models):
+            print(f"[ADVERTENCIA] {len(self.detector.models) - len(self.detector.residual_stats)} modelos sin "
+                  f"desvío de residuales de entrenamiento (usan el del lote); reentrenar para generarlo")
+        sys.stdout.flush()
+        
+        if self.forecast_cache_hours > 0 and len(self.detector.models) > 0:
+            print(f"[INFO] Precalculando pronósticos para las próximas {self.forecast_cache_hours} horas...")
+            sys.stdout.flush()
+            self.detector.enable_forecast_cache(horizon_hours=self.forecast_cache_hours)
+            sys.stdout.flush()
+    
+    def _save_residual_stats(self):
+        """Guarda el desvío de residuales actualizado en línea (solo las variables de este worker)"""
+        if self.detector is None or self.residual_stats_update is None:
+            return
+        try:
+            self.detector.residual_stats.save_updates(str(self.models_dir))
+        except Exception as e:
+            print(f"  [ADVERTENCIA] No se pudo guardar el desvío de residuales: {str(e)}")
+            sys.stdout.flush()
+    
+    def _apply_assignment(self):
+        """
+        Si el coordinador publicó una asignación nueva, pasa a procesar esas variables
+        
+        Las variables que pasan a otro miembro se sueltan enseguida (después de
+        escribir lo pendiente) y se informa la generación en el latido. Las
+        recibidas se empiezan a procesar recién cuando todos los miembros vivos
+        informan esa generación: antes, el dueño anterior puede tener resultados
+        sin escribir y se duplicarían filas en ypf_anomaly_detector.
+        """
+        assignment = self.membership.read_assignment()
+        if assignment is None:
+            return
+        
+        changed = False
+        if assignment['generation'] != self.assignment_generation:
+            if self.member_id not in assignment['members']:
+                # Todavía no incluido (recién llegado): seguir con la asignación actual
+                if len(self.detector.models) == 0:
+                    self.membership.set_generation(self.member_id, assignment['generation'])
+                return
+            
+            variables = assignment['members'][self.member_id]
+            print(f"  [INFO] Asignación {assignment['generation']}: {len(variables)} variables "
+                  f"(antes {len(self.detector.models)})")
+            sys.stdout.flush()
+            
+            # Lo pendiente se termina de escribir antes de soltar las variables perdidas
+            if self.scorer is not None:
+                self.scorer.flush()
+            if self.writer is not None:
+                self.writer.flush()
+            
+            kept = [var for var in variables if var in self.detector.models]
+            self.pending_variables = [var for var in variables if var not in self.detector.models]
+            if set(kept) != set(self.detector.models.keys()):
+                self._load_models(kept)
+            self.assignment_generation = assignment['generation']
+            self.membership.set_generation(self.member_id, self.assignment_generation)
+            changed = True
+        
+        if self.pending_variables:
+            behind = self.membership.members_behind(self.assignment_generation, exclude=[self.member_id])
+            if behind:
+                print(f"  [INFO] {len(self.pending_variables)} variables recibidas esperan a que "
+                      f"{', '.join(behind)} aplique la asignación {self.assignment_generation}")
+                sys.stdout.flush()
+            else:
+                self._load_models(list(self.detector.models.keys()) + self.pending_variables)
+                self.pending_variables = []
+                changed = True
+        
+        if not changed:
+            return
+        # Marcas de agua releídas después de que el dueño anterior escribió las suyas
+        self.variable_watermarks = {var: mark for var, mark in self.watermark_store.load().items()
+                                    if not WatermarkStore.is_global(var)}
+    
+    def _emit_stream_batch(self, results: pd.DataFrame, batch: pd.DataFrame) -> bool:
+        """
+        Escribe los resultados de un micro-lote (se ejecuta en el hilo del scorer)
+        
+        Retorna:
+        --------
+        bool: True si los resultados quedaron escritos (o encolados en el escritor)
+        """
+        if results is None or len(results) == 0:
+            return True
+        
+        results_to_write = prepare_results_for_sql(results, batch)
+        watermark, variable_watermarks = batch_watermarks(batch, list(results_to_write['variable'].unique()))
+        success = write_results(self.sql_conn_output, results_to_write, watermark, variable_watermarks,
+                                bulk_write=self.bulk_write, writer=self.writer,
+                                watermark_store=self.watermark_store)
+        
+        if success:
+            self.total_processed += results_to_write['ds'].nunique()
+            self.total_anomalies += int(results_to_write['is_anomaly'].sum())
+        return success
+    
     def run(self):
         """Ejecuta el worker en modo continuo"""
         print("\n" + "="*80)
@@ -395,12 +1158,20 @@ class AnomalyDetectionWorker:
             sys.stdout.flush()
             return
         
-        print(f"\n[INFO] Intervalo de verificación: {self.check_interval_minutes} minutos")
+        if self.change_feed is not None:
+            print(f"\n[INFO] Modo por eventos: sondeo cada {self.min_wait_seconds:g}s a "
+                  f"{self.check_interval_minutes} minutos según la actividad")
+        else:
+            print(f"\n[INFO] Intervalo de verificación: {self.check_interval_minutes} minutos")
         print("[INFO] Presiona Ctrl+C para detener\n")
         sys.stdout.flush()
         
         try:
             while True:
+                if self.change_feed is not None and not self.change_feed.wait_for_change():
+                    # Sin datos nuevos: el próximo sondeo espera más
+                    continue
+                
                 self.iterations += 1
                 current_time = datetime.now()
                 
@@ -408,6 +1179,8 @@ class AnomalyDetectionWorker:
                 sys.stdout.flush()
                 
                 processed = self.check_and_process()
+                if self.change_feed is not None:
+                    self.change_feed.processed(processed)
                 
                 if not processed:
                     print("  [INFO] No hay datos nuevos para procesar")
@@ -416,7 +1189,28 @@ class AnomalyDetectionWorker:
                 # Mostrar estadísticas cada 10 iteraciones
                 if self.iterations % 10 == 0:
                     print(f"  [ESTADÍSTICAS] {self.total_processed} datetime(s) procesados, {self.total_anomalies} anomalía(s) detectadas")
+                    if hasattr(self.detector.models, 'stats'):
+                        stats = self.detector.models.stats()
+                        print(f"  [ESTADÍSTICAS] Modelos en memoria: {stats['loaded']}/{stats['registered']}, "
+                              f"aciertos: {stats['hits']}, fallos: {stats['misses']}, expulsiones: {stats['evictions']}")
+                    if self.scorer is not None:
+                        latency = self.scorer.latency_percentiles()
+                        if latency:
+                            print(f"  [ESTADÍSTICAS] Latencia ingreso-escritura: p50 {latency['p50']:.2f}s, "
+                                  f"p95 {latency['p95']:.2f}s, p99 {latency['p99']:.2f}s, máx {latency['max']:.2f}s "
+                                  f"({latency['count']:,} puntos)")
+                    if self.writer is not None:
+                        stats = self.writer.stats()
+                        print(f"  [ESTADÍSTICAS] Escritor: {stats['rows_written']:,} filas en {stats['batches_written']} lotes "
+                              f"({stats['write_seconds']:.1f}s escribiendo, {stats['wait_seconds']:.1f}s de espera por cola llena), "
+                              f"escrito hasta {stats['committed_watermark']}")
+                    sys.stdout.flush()
+                    self._save_residual_stats()
+                
+                if self.change_feed is not None:
+                    print(f"  [INFO] Esperando datos nuevos (próximo sondeo en {self.change_feed.backoff.current:g}s)...\n")
                     sys.stdout.flush()
+                    continue
                 
                 # Esperar antes de la próxima verificación
                 print(f"  [INFO] Esperando {self.check_interval_minutes} minutos hasta la próxima verificación...\n")
@@ -433,6 +1227,28 @@ class AnomalyDetectionWorker:
             sys.stdout.flush()
         
         finally:
+            if self.detector is not None:
+                self.detector.disable_forecast_cache()
+            if self.scorer is not None:
+                print("[INFO] Puntuando los micro-lotes pendientes...")
+                sys.stdout.flush()
+                self.scorer.close()
+                latency = self.scorer.latency_percentiles()
+                if latency:
+                    print(f"[INFO] Latencia ingreso-escritura: p50 {latency['p50']:.2f}s, p95 {latency['p95']:.2f}s, "
+                          f"p99 {latency['p99']:.2f}s")
+                sys.stdout.flush()
+            if self.writer is not None:
+                print(f"[INFO] Escribiendo {self.writer.pending} lote(s) pendiente(s)...")
+                sys.stdout.flush()
+                self.writer.close()
+                print(f"[INFO] Escrito hasta: {self.writer.committed_watermark}")
+                sys.stdout.flush()
+            self._save_residual_stats()
+            if self.membership is not None:
+                self.membership.leave(self.member_id)
+                print(f"[INFO] Miembro '{self.member_id}' dado de baja")
+                sys.stdout.flush()
             if self.sql_conn_input:
                 self.sql_conn_input.disconnect()
                 print("[INFO] Conexión a SQL (entrada) cerrada")
@@ -460,17 +1276,112 @@ Ejemplos:
   
   # Verificar cada 30 minutos
   python worker_procesamiento.py --interval 30
+  
+  # Inferencia con hasta 4 hilos concurrentes
+  python worker_procesamiento.py --jobs 4
+  
+  # Predicción rápida (sin muestreo Monte Carlo de Prophet)
+  python worker_procesamiento.py --fast-predict
+  
+  # Servir las predicciones de las próximas 24 horas desde un cache precalculado
+  python worker_procesamiento.py --forecast-cache-hours 24
+  
+  # Cargar modelos bajo demanda, con máximo 200 en memoria
+  python worker_procesamiento.py --max-models 200
+  
+  # Escribir resultados con carga masiva (staging + INSERT ... SELECT)
+  python worker_procesamiento.py --bulk-write
+  
+  # Escribir en segundo plano mientras se detecta el siguiente lote (cola de 4 lotes)
+  python worker_procesamiento.py --bulk-write --async-write 4
+  
+  # Varios workers con puntos de control independientes
+  python worker_procesamiento.py --worker-id planta_norte
+  
+  # Leer cada variable desde su propia marca (tolera variables que reportan tarde)
+  python worker_procesamiento.py --per-variable
+  
+  # Procesar apenas llegan datos: sondeo liviano cada 5 s, hasta 10 minutos si no hay actividad
+  python worker_procesamiento.py --event-driven --min-wait 5 --interval 10
+  
+  # Alarmas casi en tiempo real: micro-lotes de hasta 500 puntos o 1 segundo
+  python worker_procesamiento.py --event-driven --min-wait 1 --stream-batch 500 --stream-max-seconds 1
+  
+  # Miembro de un despliegue particionado (normalmente lo lanza coordinador_shards.py)
+  python worker_procesamiento.py --shard-dir pipeline/shards --member-id shard-0 --event-driven
+  
+  # Tras una caída: procesar el atraso en tramos de 6 horas, 4 en paralelo, con 2 GB como máximo
+  python worker_procesamiento.py --catchup-slice-hours 6 --catchup-jobs 4 --catchup-memory-mb 2048
+  
+  # Seguir la deriva del desvío de residuales sin reentrenar (media exponencial)
+  python worker_procesamiento.py --residual-stats-update ewma
         """
     )
     parser.add_argument('--interval', type=int, default=10,
                        help='Intervalo en minutos entre verificaciones (default: 10)')
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Máximo de hilos de inferencia concurrentes (default: 1)')
+    parser.add_argument('--fast-predict', action='store_true',
+                       help='Calcular predicciones e intervalos en forma cerrada en lugar de Prophet.predict')
+    parser.add_argument('--forecast-cache-hours', type=float, default=0,
+                       help='Horas de pronósticos precalculados por modelo (default: 0 = sin cache)')
+    parser.add_argument('--max-models', type=int, default=0,
+                       help='Cargar modelos bajo demanda con este máximo en memoria (default: 0 = todos al inicio)')
+    parser.add_argument('--bulk-write', action='store_true',
+                       help='Escribir resultados por lotes grandes en una tabla de staging y un único INSERT ... SELECT')
+    parser.add_argument('--async-write', type=int, default=0,
+                       help='Escribir resultados en un hilo aparte con una cola de hasta N lotes (default: 0 = sincrónico)')
+    parser.add_argument('--worker-id', type=str, default='procesamiento',
+                       help="Identificador del worker para sus marcas de agua (default: procesamiento)")
+    parser.add_argument('--per-variable', action='store_true',
+                       help='Leer datos nuevos por variable desde su propia marca de agua (solo variables con modelo)')
+    parser.add_argument('--event-driven', action='store_true',
+                       help='Procesar apenas hay datos nuevos (sondeo con espera adaptativa hasta --interval)')
+    parser.add_argument('--min-wait', type=float, default=5.0,
+                       help='Segundos mínimos entre sondeos en modo --event-driven (default: 5)')
+    parser.add_argument('--change-column', type=str, default='datetime',
+                       help='Columna creciente indexada de ypf_process_data para el sondeo (default: datetime)')
+    parser.add_argument('--stream-batch', type=int, default=0,
+                       help='Puntuar y escribir en micro-lotes de hasta N puntos en un hilo aparte (default: 0 = desactivado)')
+    parser.add_argument('--stream-max-seconds', type=float, default=2.0,
+                       help='Espera máxima de un punto antes de cerrar su micro-lote (default: 2)')
+    parser.add_argument('--shard-dir', type=str, default=None,
+                       help='Directorio de coordinación de un despliegue particionado (ver coordinador_shards.py)')
+    parser.add_argument('--member-id', type=str, default=None,
+                       help='Identificador del miembro en el despliegue particionado (default: host-pid)')
+    parser.add_argument('--catchup-slice-hours', type=float, default=0,
+                       help='Procesar atrasos de más de dos tramos en tramos de estas horas (default: 0 = desactivado)')
+    parser.add_argument('--catchup-jobs', type=int, default=2,
+                       help='Tramos en paralelo durante la puesta al día (default: 2)')
+    parser.add_argument('--catchup-memory-mb', type=float, default=1024,
+                       help='Memoria aproximada para tramos en curso en MB (default: 1024)')
+    parser.add_argument('--residual-stats-update', type=str, default=None, choices=['welford', 'ewma'],
+                       help='Actualizar el desvío de residuales con los puntos puntuados (default: fijo de entrenamiento)')
     
     args = parser.parse_args()
     
     print(f"Configurado para verificar cada {args.interval} minutos")
     sys.stdout.flush()
     
-    worker = AnomalyDetectionWorker(check_interval_minutes=args.interval)
+    worker = AnomalyDetectionWorker(check_interval_minutes=args.interval, inference_jobs=args.jobs,
+                                    use_fast_predict=args.fast_predict,
+                                    forecast_cache_hours=args.forecast_cache_hours,
+                                    max_models_in_memory=args.max_models,
+                                    bulk_write=args.bulk_write,
+                                    async_write_queue=args.async_write,
+                                    worker_id=args.worker_id,
+                                    per_variable=args.per_variable,
+                                    event_driven=args.event_driven,
+                                    min_wait_seconds=args.min_wait,
+                                    change_column=args.change_column,
+                                    stream_batch_points=args.stream_batch,
+                                    stream_max_seconds=args.stream_max_seconds,
+                                    shard_dir=args.shard_dir,
+                                    member_id=args.member_id,
+                                    catchup_slice_hours=args.catchup_slice_hours,
+                                    catchup_jobs=args.catchup_jobs,
+                                    catchup_memory_mb=args.catchup_memory_mb,
+                                    residual_stats_update=args.residual_stats_update)
     worker.run()
 
 
@@ -15,6 +15,8 @@ sys.path.append(str(Path(__file__).parent))
 
 from sql_utils import SQLConnection
 from pipeline.scripts.prophet_anomaly_detector import ProphetAnomalyDetector
+from pipeline.scripts.wide_pivot import LongToWidePivot
+from pipeline.scripts.history_cache import DEFAULT_OVERLAP_HOURS, read_history
 
 # Configuración de conexión SQL
 SQL_CONFIG = {
@@ -38,7 +40,9 @@ logger = logging.getLogger(__name__)
 
 
 def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None, 
-                       end_date: str = None) -> pd.DataFrame:
+                       end_date: str = None, chunk_size: int = 500000,
+                       history_cache: str = None,
+                       history_overlap_hours: float = DEFAULT_OVERLAP_HOURS) -> pd.DataFrame:
     """
     Lee datos desde SQL Server y los convierte a formato ancho
     
@@ -50,11 +54,27 @@ def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None,
         Fecha de inicio (opcional, formato: 'YYYY-MM-DD')
     end_date : str
         Fecha de fin (opcional, formato: 'YYYY-MM-DD')
+    chunk_size : int
+        Filas leídas de SQL por bloque (default: 500000)
+    history_cache : str
+        Directorio del cache de historial (opcional): se lee de SQL solo lo
+        posterior a lo ya cacheado (ver pipeline/scripts/history_cache.py)
+    history_overlap_hours : float
+        Con history_cache, horas anteriores a lo cacheado que se releen de SQL
+        por datos que llegan tarde
         
     Retorna:
     --------
     pd.DataFrame en formato ancho (datetime + variables en columnas)
     """
+    if history_cache:
+        print(f"\n[INFO] Leyendo datos desde el cache de historial ({history_cache})...")
+        sys.stdout.flush()
+        df_wide = read_history(sql_conn, history_cache, start_date, end_date, chunk_size=chunk_size,
+                               overlap_hours=history_overlap_hours)
+        sys.stdout.flush()
+        return df_wide
+    
     print("\n[INFO] Leyendo datos desde SQL Server...")
     sys.stdout.flush()
     
@@ -75,26 +95,26 @@ def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None,
     print(f"  Query: {query[:100]}...")
     sys.stdout.flush()
     
-    # Ejecutar query
-    df_long = sql_conn.execute_query(query)
+    # Ejecutar query por bloques y pivotear cada bloque a medida que llega
+    # (así no se mantiene en memoria todo el formato largo)
+    pivot = LongToWidePivot()
+    try:
+        for chunk in sql_conn.execute_query_chunked(query, chunk_size, dtypes={'value': 'float64'}):
+            pivot.add(chunk)
+            print(f"  Filas leídas: {pivot.n_rows:,}")
+            sys.stdout.flush()
+    except Exception:
+        return None
     
-    if df_long is None or len(df_long) == 0:
+    if pivot.n_rows == 0:
         print("[ERROR] No se encontraron datos en SQL")
         sys.stdout.flush()
         return None
     
-    print(f"  Filas leídas: {len(df_long):,}")
-    sys.stdout.flush()
-    
-    # Convertir a formato ancho
+    # Unir bloques (un mismo datetime puede quedar repartido entre dos bloques)
     print("  Transformando a formato ancho...")
     sys.stdout.flush()
-    df_wide = df_long.pivot_table(
-        index='datetime',
-        columns='variable_name',
-        values='value',
-        aggfunc='first'  # Si hay duplicados, tomar el primero
-    )
+    df_wide = pivot.result()
     
     # Resetear índice para que datetime sea columna
     df_wide = df_wide.reset_index()
@@ -108,10 +128,38 @@ def read_data_from_sql(sql_conn: SQLConnection, start_date: str = None,
     return df_wide
 
 
-def retrain_models(sql_conn: SQLConnection, models_dir: Path) -> bool:
+def retrain_models(sql_conn: SQLConnection, models_dir: Path,
+                   n_jobs: int = 1, timeout: float = None,
+                   incremental: bool = False, window_days: float = None,
+                   history_cache: str = None, save_pickles: bool = False,
+                   validate_store: bool = False,
+                   history_overlap_hours: float = DEFAULT_OVERLAP_HOURS) -> bool:
     """
     Reentrena los modelos usando datos de SQL
     
+    Parámetros:
+    -----------
+    sql_conn : SQLConnection
+        Conexión a SQL
+    models_dir : Path
+        Directorio donde guardar los modelos
+    n_jobs : int
+        Procesos de entrenamiento en paralelo (1 = secuencial, -1 = todos los núcleos)
+    timeout : float
+        Tiempo máximo en segundos por variable (None = sin límite)
+    incremental : bool
+        Si partir de los modelos guardados (warm start) en lugar de entrenar desde cero
+    window_days : float
+        Leer y entrenar solo con los últimos días de datos (None = todo el historial)
+    history_cache : str
+        Directorio del cache de historial (None = leer todo de SQL)
+    save_pickles : bool
+        Si guardar también el pickle completo de cada modelo
+    validate_store : bool
+        Si validar cada modelo contra Prophet.predict antes de guardarlo en el almacén
+    history_overlap_hours : float
+        Con history_cache, horas anteriores a lo cacheado que se releen de SQL
+    
     Retorna:
     --------
     bool: True si fue exitoso, False si hubo error
@@ -123,7 +171,11 @@ def retrain_models(sql_conn: SQLConnection, models_dir: Path) -> bool:
         sys.stdout.flush()
         
         # Leer datos desde SQL
-        df = read_data_from_sql(sql_conn)
+        start_date = None
+        if window_days:
+            start_date = (datetime.now() - timedelta(days=window_days)).strftime('%Y-%m-%d %H:%M:%S')
+        df = read_data_from_sql(sql_conn, start_date=start_date, history_cache=history_cache,
+                                history_overlap_hours=history_overlap_hours)
         
         if df is None:
             print("[ERROR] No se pudieron leer datos de SQL")
@@ -154,12 +206,29 @@ def retrain_models(sql_conn: SQLConnection, models_dir: Path) -> bool:
         sys.stdout.flush()
         
         try:
-            detector.train_multiple_variables(
-                df=df,
-                variables=variables,
-                datetime_col='DATETIME',
-                verbose=True
-            )
+            if incremental and ProphetAnomalyDetector.has_saved_models(str(models_dir)):
+                detector.load_models(str(models_dir))
+                detector.train_incremental(
+                    df=df,
+                    variables=variables,
+                    datetime_col='DATETIME',
+                    window_days=window_days,
+                    verbose=True,
+                    n_jobs=n_jobs,
+                    timeout=timeout
+                )
+            else:
+                if incremental:
+                    print("[INFO] No hay modelos guardados, se entrenará desde cero")
+                    sys.stdout.flush()
+                detector.train_multiple_variables(
+                    df=df,
+                    variables=variables,
+                    datetime_col='DATETIME',
+                    verbose=True,
+                    n_jobs=n_jobs,
+                    timeout=timeout
+                )
         except Exception as e:
             print(f"\n[ERROR] Error durante el entrenamiento: {str(e)}")
             import traceback
@@ -174,7 +243,7 @@ def retrain_models(sql_conn: SQLConnection, models_dir: Path) -> bool:
         sys.stdout.flush()
         
         try:
-            detector.save_models(str(models_dir))
+            detector.save_models(str(models_dir), save_pickles=save_pickles, validate=validate_store)
             print(f"\n[OK] Modelos guardados exitosamente en: {models_dir}")
             print(f"[OK] Total de modelos: {len(detector.models)}")
             sys.stdout.flush()
@@ -197,7 +266,12 @@ def retrain_models(sql_conn: SQLConnection, models_dir: Path) -> bool:
 class RetrainingWorker:
     """Worker para reentrenamiento automático de modelos"""
     
-    def __init__(self, training_hour: int = 2, training_minute: int = 0):
+    def __init__(self, training_hour: int = 2, training_minute: int = 0,
+                 n_jobs: int = 1, timeout: float = None,
+                 incremental: bool = False, window_days: float = None,
+                 history_cache: str = None, save_pickles: bool = False,
+                 validate_store: bool = False,
+                 history_overlap_hours: float = DEFAULT_OVERLAP_HOURS):
         """
         Inicializa el worker
         
@@ -207,9 +281,35 @@ class RetrainingWorker:
             Hora del día para reentrenar (0-23, default: 2 = 2:00 AM)
         training_minute : int
             Minuto de la hora para reentrenar (0-59, default: 0)
+        n_jobs : int
+            Procesos de entrenamiento en paralelo (default: 1 = secuencial)
+        timeout : float
+            Tiempo máximo en segundos por variable (default: None = sin límite)
+        incremental : bool
+            Si reentrenar con warm start a partir de los modelos guardados (default: False)
+        window_days : float
+            Días de datos recientes a usar (default: None = todo el historial)
+        history_cache : str
+            Directorio del cache de historial; cada reentrenamiento solo lee de SQL
+            los datos nuevos (default: None = leer todo de SQL)
+        save_pickles : bool
+            Si guardar también el pickle completo de cada modelo (default: False)
+        validate_store : bool
+            Si validar cada modelo contra Prophet.predict al guardarlo (default: False)
+        history_overlap_hours : float
+            Con history_cache, horas anteriores a lo cacheado que se releen de SQL
+            (default: DEFAULT_OVERLAP_HOURS)
         """
         self.training_hour = training_hour
         self.training_minute = training_minute
+        self.n_jobs = n_jobs
+        self.timeout = timeout
+        self.incremental = incremental
+        self.window_days = window_days
+        self.history_cache = history_cache
+        self.save_pickles = save_pickles
+        self.validate_store = validate_store
+        self.history_overlap_hours = history_overlap_hours
         self.sql_conn = None
         self.models_dir = Path("pipeline/models/prophet")
         self.last_training_date = None
@@ -259,7 +359,9 @@ class RetrainingWorker:
             sys.stdout.flush()
             return False
         
-        success = retrain_models(self.sql_conn, self.models_dir)
+        success = retrain_models(self.sql_conn, self.models_dir, self.n_jobs, self.timeout,
+                                 self.incremental, self.window_days, self.history_cache,
+                                 self.save_pickles, self.validate_store, self.history_overlap_hours)
         
         if success:
             self.last_training_date = datetime.now().date()
@@ -284,6 +386,10 @@ class RetrainingWorker:
         print("="*80)
         print(f"[INFO] Hora de reentrenamiento: {self.training_hour:02d}:{self.training_minute:02d}")
         print(f"[INFO] Verificando cada {self.check_interval_seconds} segundos")
+        print(f"[INFO] Procesos de entrenamiento: {self.n_jobs}")
+        if self.incremental:
+            print(f"[INFO] Reentrenamiento incremental (warm start)" +
+                  (f", ventana de {self.window_days} días" if self.window_days else ""))
         print(f"[INFO] Presiona Ctrl+C para detener")
         print()
         sys.stdout.flush()
@@ -354,12 +460,38 @@ Ejemplos:
   
   # Reentrenar todos los días a medianoche
   python worker_reentrenamiento.py --hour 0 --minute 0
+  
+  # Entrenar con 16 procesos y máximo 10 minutos por variable
+  python worker_reentrenamiento.py --jobs 16 --timeout 600
+  
+  # Reentrenar partiendo de los modelos actuales con los últimos 30 días
+  python worker_reentrenamiento.py --incremental --window-days 30
+  
+  # Mantener el historial pivoteado en disco y leer de SQL solo los datos nuevos
+  python worker_reentrenamiento.py --history-cache pipeline/cache/history
         """
     )
     parser.add_argument('--hour', type=int, default=2,
                        help='Hora del día para reentrenar (0-23, default: 2)')
     parser.add_argument('--minute', type=int, default=0,
                        help='Minuto de la hora para reentrenar (0-59, default: 0)')
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Procesos de entrenamiento en paralelo (-1 = todos los núcleos, default: 1)')
+    parser.add_argument('--timeout', type=float, default=None,
+                       help='Tiempo máximo de entrenamiento por variable en segundos (default: sin límite)')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Partir de los modelos guardados (warm start) y conservar los que no tienen datos nuevos')
+    parser.add_argument('--window-days', type=float, default=None,
+                       help='Entrenar solo con los últimos N días de datos (default: todo el historial)')
+    parser.add_argument('--history-cache', type=str, default=None,
+                       help='Directorio del cache de historial en disco (default: leer todo de SQL)')
+    parser.add_argument('--history-overlap-hours', type=float, default=DEFAULT_OVERLAP_HOURS,
+                       help=f'Con --history-cache, horas anteriores a lo cacheado que se releen de SQL '
+                            f'por datos que llegan tarde (default: {DEFAULT_OVERLAP_HOURS:g})')
+    parser.add_argument('--save-pickles', action='store_true',
+                       help='Guardar también el pickle completo de cada modelo Prophet (default: solo el almacén compacto)')
+    parser.add_argument('--validate-store', action='store_true',
+                       help='Comparar cada modelo con Prophet.predict antes de guardarlo; los que no pasan se guardan en pickle (más lento)')
     
     args = parser.parse_args()
     
@@ -372,7 +504,12 @@ Ejemplos:
         print("[ERROR] El minuto debe estar entre 0 y 59")
         sys.exit(1)
     
-    worker = RetrainingWorker(training_hour=args.hour, training_minute=args.minute)
+    worker = RetrainingWorker(training_hour=args.hour, training_minute=args.minute,
+                              n_jobs=args.jobs, timeout=args.timeout,
+                              incremental=args.incremental, window_days=args.window_days,
+                              history_cache=args.history_cache, save_pickles=args.save_pickles,
+                              validate_store=args.validate_store,
+                              history_overlap_hours=args.history_overlap_hours)
     worker.run()
 
 